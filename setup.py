@@ -50,6 +50,8 @@ setup(name='toxicbuild',
                         'aiozk==0.30.0', 'blinker==1.5',
                         'aiobotocore==2.4.0', 'awscli==1.25.60',
                         'bcrypt==4.0.1', 'mongoengine==0.27.0'],
+      extras_require={'fast': ['orjson', 'msgpack', 'zstandard', 'uvloop',
+                               'pygit2']},
       classifiers=[
           'Development Status :: 3 - Alpha',
           'Environment :: No Input/Output (Daemon)',
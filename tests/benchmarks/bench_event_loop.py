@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Compares the default asyncio event loop with uvloop for the protocol
+round trips and for streaming the output of a command with ``exec_cmd``.
+
+Each loop runs in its own process so the event loop policy of one run
+does not leak to the other.
+
+Usage:
+
+.. code-block:: sh
+
+    $ python tests/benchmarks/bench_event_loop.py
+"""
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+from toxicbuild.core.client import BaseToxicClient  # noqa E402
+from toxicbuild.core.protocol import BaseToxicProtocol  # noqa E402
+from toxicbuild.core import utils  # noqa E402
+
+TOKEN = 'bench-token'
+ROUND_TRIPS = 2000
+CONCURRENCY = 50
+OUTPUT_LINES = 200000
+
+
+class EchoProtocol(BaseToxicProtocol):
+
+    encrypted_token = utils.bcrypt_string(TOKEN, utils.bcrypt.gensalt(4))
+
+    async def client_connected(self):
+        await self.send_response(code=0, body={'echo': self.data['body']})
+        self.close_connection()
+        return 0
+
+
+async def _round_trips(port):
+    async def request():
+        async with BaseToxicClient('127.0.0.1', port) as client:
+            await client.request2server('echo', {'some': 'thing'}, TOKEN)
+
+    # sequential, one connection per request.
+    init = time.time()
+    for i in range(ROUND_TRIPS // 4):
+        await request()
+    sequential = (ROUND_TRIPS // 4) / (time.time() - init)
+
+    # many multiplexed requests through a single connection.
+    init = time.time()
+    async with BaseToxicClient('127.0.0.1', port,
+                               multiplex=True) as client:
+        sem = asyncio.Semaphore(CONCURRENCY)
+
+        async def multiplexed():
+            async with sem:
+                await client.request2server('echo', {'some': 'thing'},
+                                            TOKEN)
+
+        await asyncio.gather(*[multiplexed() for i in range(ROUND_TRIPS)])
+    multiplexed = ROUND_TRIPS / (time.time() - init)
+    return sequential, multiplexed
+
+
+async def _exec_cmd():
+    lines = 0
+
+    async def out_fn(index, line):
+        nonlocal lines
+        lines += 1
+
+    init = time.time()
+    await utils.exec_cmd('seq 1 {}'.format(OUTPUT_LINES), cwd='.',
+                         out_fn=out_fn)
+    # let the out_fn tasks run
+    await asyncio.sleep(0)
+    return OUTPUT_LINES / (time.time() - init)
+
+
+async def _run():
+    loop = asyncio.get_event_loop()
+    server = await loop.create_server(lambda: EchoProtocol(loop),
+                                      '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    sequential, multiplexed = await _round_trips(port)
+    server.close()
+    lines = await _exec_cmd()
+    return {'sequential req/s': sequential,
+            'multiplexed req/s': multiplexed,
+            'exec_cmd lines/s': lines}
+
+
+def run(use_uvloop):
+    class settings:
+        USE_UVLOOP = use_uvloop
+
+    if use_uvloop and not utils.set_event_loop_policy(settings):
+        return None
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    return loop.run_until_complete(_run())
+
+
+def main():
+    if len(sys.argv) > 1:
+        # the child process
+        print(json.dumps(run(sys.argv[1] == 'uvloop')))
+        return
+
+    results = {}
+    for name in ('asyncio', 'uvloop'):
+        out = subprocess.check_output([sys.executable, __file__, name])
+        results[name] = json.loads(out.decode().strip().splitlines()[-1])
+
+    if results['uvloop'] is None:
+        print('uvloop is not installed')
+        results.pop('uvloop')
+
+    names = list(results)
+    print('{:<20}'.format('') + ''.join('{:>14}'.format(n) for n in names))
+    for metric in results['asyncio']:
+        print('{:<20}'.format(metric) + ''.join(
+            '{:>14.1f}'.format(results[n][metric]) for n in names))
+
+
+if __name__ == '__main__':
+    main()
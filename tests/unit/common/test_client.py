@@ -66,6 +66,23 @@ class HoleClientTest(TestCase):
         called = self.client.write.call_args[0][0]
         self.assertNotIn('user_id', called.keys())
 
+    @patch.object(HoleClient, 'request2server', AsyncMock(
+        return_value=[{'code': 0, 'body': {'repo-list': []}},
+                      {'code': 3, 'body': {'error': 'bla'}}]))
+    @async_test
+    async def test_batch(self):
+        requests = [('repo-list', {}), ('slave-list', {})]
+
+        r = await self.client.batch(requests)
+
+        called = self.client.request2server.call_args[0]
+        expected = ('batch', {'requests': [
+            {'action': 'repo-list', 'body': {}},
+            {'action': 'slave-list', 'body': {}}]})
+        self.assertEqual(called, expected)
+        self.assertEqual(r[0], [])
+        self.assertIsInstance(r[1], NotEnoughPerms)
+
     @patch.object(HoleClient, 'request2server', AsyncMock())
     @async_test
     async def test_connect2stream(self):
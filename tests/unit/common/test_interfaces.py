@@ -251,6 +251,22 @@ class BaseHoleInterfaceTest(TestCase):
         finally:
             interfaces.BaseHoleInterface._client = None
 
+    @async_test
+    async def test_batch(self):
+        requester = MagicMock()
+        requests = [('repo-list', {}), ('slave-list', {})]
+        client = MagicMock()
+        client.__enter__.return_value = client
+        client.batch = AsyncMock(return_value=[[], []])
+        get_client = AsyncMock(return_value=client)
+
+        with patch.object(interfaces.BaseHoleInterface, 'get_client',
+                          get_client):
+            r = await interfaces.BaseHoleInterface.batch(requester, requests)
+
+        self.assertEqual(r, [[], []])
+        client.batch.assert_called_with(requests)
+
 
 async def get_client_mock(requester, r2s_return_value=None):
     requester = MagicMock()
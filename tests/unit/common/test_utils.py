@@ -16,7 +16,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
-from unittest import TestCase
+from unittest import TestCase, mock
 from toxicbuild.common import utils
 from toxicbuild.core.utils import now, localtime2utc
 
@@ -70,3 +70,10 @@ class UtilsTest(TestCase):
         formated = utils.format_datetime(
             dt, dtformat, tzname='America/SSao_Paulo')
         self.assertTrue(formated.endswith('0000'))
+
+    def test_get_connection_pool_settings(self):
+        settings = mock.Mock(spec=['CONNECTION_POOL_MAX_SIZE'],
+                             CONNECTION_POOL_MAX_SIZE=2)
+        pool_kw = utils.get_connection_pool_settings(settings)
+        self.assertEqual(pool_kw, {'max_size': 2, 'idle_timeout': 60,
+                                   'response_timeout': 300})
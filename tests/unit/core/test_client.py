@@ -17,7 +17,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
-from unittest import mock, TestCase
+import json
+from unittest import mock, TestCase, skipIf
 from toxicbuild.core import client
 from tests import async_test
 
@@ -128,32 +129,84 @@ class BuildClientTest(TestCase):
     @async_test
     async def test_write(self):
         self.client.writer = mock.MagicMock(drain=mock.AsyncMock())
+        self.client._codecs_sent = True
 
         data = {"some": "json"}
-        msg = '16\n{"some": "json"}'.encode('utf-8')
 
         await self.client.write(data)
 
         called_arg = self.client.writer.write.call_args[0][0].decode()
+        length, msg = called_arg.split('\n', 1)
 
-        self.assertEqual(called_arg, msg.decode())
+        self.assertEqual(int(length), len(msg))
+        self.assertEqual(json.loads(msg), data)
 
+    @mock.patch.object(client.codecs, 'get_available_codecs', mock.Mock(
+        return_value=['msgpack', 'json']))
     @async_test
-    async def test_read(self):
+    async def test_write_first_message(self):
+        self.client.writer = mock.MagicMock(drain=mock.AsyncMock())
 
-        msg = '16\n{"some": "json"}'.encode('utf-8')
+        await self.client.write({"some": "json"})
+        await self.client.write({"other": "json"})
+
+        calls = self.client.writer.write.call_args_list
+        first = json.loads(calls[0][0][0].decode().split('\n', 1)[1])
+        second = json.loads(calls[1][0][0].decode().split('\n', 1)[1])
+
+        self.assertEqual(first['codecs'], ['msgpack', 'json'])
+        self.assertNotIn('codecs', second)
+
+    @mock.patch.object(client.codecs, 'get_available_codecs', mock.Mock(
+        return_value=['json']))
+    @async_test
+    async def test_write_first_message_json_only(self):
+        self.client.writer = mock.MagicMock(drain=mock.AsyncMock())
+
+        await self.client.write({"some": "json"})
+
+        called_arg = self.client.writer.write.call_args[0][0].decode()
+
+        self.assertNotIn('codecs', json.loads(called_arg.split('\n', 1)[1]))
+
+    @async_test
+    async def test_write_first_message_compression(self):
+        self.client.writer = mock.MagicMock(drain=mock.AsyncMock())
+
+        await self.client.write({"some": "json"})
+
+        called_arg = self.client.writer.write.call_args[0][0].decode()
+        msg = json.loads(called_arg.split('\n', 1)[1])
 
-        self._rlimit = 0
+        self.assertIn('zlib', msg['compression'])
 
-        async def read(nbytes):
-            part = msg[self._rlimit: self._rlimit + nbytes]
-            self._rlimit += nbytes
-            return part
+    @async_test
+    async def test_write_compressed(self):
+        self.client.writer = mock.MagicMock(drain=mock.AsyncMock())
+        self.client._codecs_sent = True
+        self.client.compressor = client.compression.get_compressor('zlib')
+        data = {'some': 'json' * 10000}
+
+        await self.client.write(data)
+
+        written = b''.join(bytes(c[0][0])
+                           for c in self.client.writer.write.call_args_list)
+        header, msg = written.split(b'\n', 1)
+
+        self.assertEqual(header, '{}z'.format(len(msg)).encode())
+        self.assertEqual(
+            json.loads(client.compression.zlib.decompress(msg)), data)
+
+    @async_test
+    async def test_read(self):
+
+        msg = '16\n{"some": "json"}'.encode('utf-8')
 
-        self.client.reader = mock.Mock()
-        self.client.reader.read = read
+        self.client.reader = client.asyncio.StreamReader()
+        self.client.reader.feed_data(msg)
+        self.client.reader.feed_eof()
 
-        expected = client.OrderedDict({'some': 'json'})
+        expected = {'some': 'json'}
         returned = await self.client.read()
 
         self.assertEqual(expected, returned)
@@ -164,19 +217,45 @@ class BuildClientTest(TestCase):
 
         msg = '19\n{"some": "json"}{sd'.encode('utf-8')
 
-        self._rlimit = 0
-
-        async def read(nbytes):
-            part = msg[self._rlimit: self._rlimit + nbytes]
-            self._rlimit += nbytes
-            return part
-
-        self.client.reader = mock.Mock()
-        self.client.reader.read = read
+        self.client.reader = client.asyncio.StreamReader()
+        self.client.reader.feed_data(msg)
+        self.client.reader.feed_eof()
 
         with self.assertRaises(client.BadJsonData):
             await self.client.read()
 
+    @skipIf(client.codecs.msgpack is None, 'msgpack not installed')
+    @async_test
+    async def test_read_with_codec(self):
+        msg = client.codecs.get_codec('msgpack').encode(
+            {'some': 'thing', 'codec': 'msgpack'})
+
+        self.client.reader = client.asyncio.StreamReader()
+        self.client.reader.feed_data(
+            '{}\n'.format(len(msg)).encode() + msg)
+        self.client.reader.feed_eof()
+
+        returned = await self.client.read()
+
+        self.assertEqual(returned, {'some': 'thing'})
+        self.assertEqual(self.client.codec.name, 'msgpack')
+
+    @async_test
+    async def test_read_with_compression(self):
+        msg = json.dumps({'some': 'thing' * 10000,
+                          'compression': 'zlib'}).encode()
+        msg = client.compression.zlib.compress(msg)
+
+        self.client.reader = client.asyncio.StreamReader()
+        self.client.reader.feed_data(
+            '{}z\n'.format(len(msg)).encode() + msg)
+        self.client.reader.feed_eof()
+
+        returned = await self.client.read()
+
+        self.assertEqual(returned, {'some': 'thing' * 10000})
+        self.assertEqual(self.client.compressor.name, 'zlib')
+
     @async_test
     async def test_get_response(self):
         expected = {'code': 0}
@@ -213,3 +292,214 @@ class BuildClientTest(TestCase):
                                              'token')
 
         self.assertEqual(r, 'ok')
+
+    @async_test
+    async def test_request2server_multiplexed(self):
+        self.client.multiplex = True
+        self.client._connected = True
+        responses = client.asyncio.Queue()
+
+        async def write(data, timeout=None):
+            # answers in the reverse order of the requests
+            if data['request_id'] == 0:
+                return
+            await responses.put({'code': 0, 'request_id': 1,
+                                 'body': {'b': 'second'}})
+            await responses.put({'code': 0, 'request_id': 0,
+                                 'body': {'a': 'first'}})
+
+        async def read(timeout=None):
+            return await responses.get()
+
+        self.client.write = write
+        self.client.read = read
+        self.client._read_responses_future = client.ensure_future(
+            self.client._read_responses())
+
+        r = await client.asyncio.gather(
+            self.client.request2server('a', {}, 'token'),
+            self.client.request2server('b', {}, 'token'))
+        self.client._read_responses_future.cancel()
+
+        self.assertEqual(r, ['first', 'second'])
+        self.assertFalse(self.client._pending)
+
+    @async_test
+    async def test_read_responses_connection_closed(self):
+        self.client._connected = True
+        future = client.asyncio.get_event_loop().create_future()
+        self.client._pending[0] = future
+        self.client.read = mock.AsyncMock(return_value={})
+
+        await self.client._read_responses()
+
+        self.assertIsInstance(future.exception(),
+                              client.ToxicClientException)
+        self.assertFalse(self.client._connected)
+
+    @async_test
+    async def test_read_responses_no_request_id(self):
+        # a server that does not support multiplexing
+        self.client._connected = True
+        future = client.asyncio.get_event_loop().create_future()
+        self.client._pending[0] = future
+        self.client.read = mock.AsyncMock(return_value={'code': 0})
+
+        await self.client._read_responses()
+
+        self.assertIsInstance(future.exception(),
+                              client.ToxicClientException)
+        self.assertFalse(self.client._connected)
+
+    @mock.patch.object(client.asyncio, 'open_connection', mock.MagicMock())
+    @async_test
+    async def test_connect_multiplexed(self):
+
+        async def oc(*a, **kw):
+            return mock.MagicMock(), mock.MagicMock()
+
+        client.asyncio.open_connection = oc
+        self.client.multiplex = True
+        self.client._read_responses = mock.AsyncMock()
+
+        await self.client.connect()
+        self.assertIsNotNone(self.client._read_responses_future)
+        self.client.disconnect()
+        self.assertIsNone(self.client._read_responses_future)
+
+    @mock.patch.object(client.ConnectionPool, 'acquire', mock.AsyncMock())
+    @async_test
+    async def test_connect_with_pool(self):
+        self.client.use_pool = True
+        await self.client.connect()
+
+        self.assertTrue(self.client.is_connected())
+        self.assertIs(self.client._pooled_conn,
+                      client.ConnectionPool.acquire.return_value)
+
+    @async_test
+    async def test_disconnect_with_pool(self):
+        conn = mock.Mock()
+        self.client._pool = mock.Mock()
+        self.client._pooled_conn = conn
+        self.client._connected = True
+        self.client.disconnect()
+
+        self.client._pool.release.assert_called_once_with(conn)
+        self.assertFalse(self.client.is_connected())
+
+    @async_test
+    async def test_send_request_with_pool(self):
+        self.client._pool = mock.Mock(response_timeout=None)
+        self.client._pooled_conn = mock.Mock(send_multiplexed=mock.AsyncMock(
+            return_value={'code': 1, 'body': {'error': 'bad'}}))
+
+        with self.assertRaises(client.ToxicClientException):
+            await self.client.request2server('action', {}, 'token')
+
+    @async_test
+    async def test_send_request_with_pool_timeout(self):
+        self.client._pool = mock.Mock(response_timeout=3)
+        self.client._pooled_conn = mock.Mock(send_multiplexed=mock.AsyncMock(
+            return_value={'code': 0}))
+
+        await self.client.send_request({})
+
+        self.client._pooled_conn.send_multiplexed.assert_called_once_with(
+            {}, timeout=3)
+
+
+class ConnectionPoolTest(TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.pool = client.ConnectionPool('localhost', 7777, max_size=2)
+
+        async def create_connection():
+            conn = mock.Mock()
+            conn.is_connected.return_value = True
+            conn.writer.is_closing.return_value = False
+            return conn
+
+        self.pool._create_connection = create_connection
+
+    def tearDown(self):
+        client.ConnectionPool._pools = {}
+        super().tearDown()
+
+    def test_get_pool(self):
+        pool = client.ConnectionPool.get_pool('localhost', 7777)
+        other = client.ConnectionPool.get_pool('localhost', 7777, True)
+
+        self.assertIs(pool, client.ConnectionPool.get_pool('localhost', 7777))
+        self.assertIsNot(pool, other)
+
+    def test_get_pool_ssl_kw(self):
+        pool = client.ConnectionPool.get_pool('localhost', 7777, True)
+        other = client.ConnectionPool.get_pool('localhost', 7777, True,
+                                               cafile='/some/ca.pem')
+
+        self.assertIsNot(pool, other)
+        self.assertEqual(other.ssl_kw, {'cafile': '/some/ca.pem'})
+
+    def test_get_pool_pool_kw(self):
+        pool = client.ConnectionPool.get_pool(
+            'localhost', 7777, pool_kw={'max_size': 2, 'idle_timeout': 5,
+                                        'response_timeout': 1})
+
+        self.assertEqual(pool.max_size, 2)
+        self.assertEqual(pool.idle_timeout, 5)
+        self.assertEqual(pool.response_timeout, 1)
+        self.assertFalse(pool.ssl_kw)
+
+    def test_get_ssl_context(self):
+        ctx = client.ConnectionPool.get_ssl_context(validate_cert=False)
+
+        self.assertIs(
+            ctx, client.ConnectionPool.get_ssl_context(validate_cert=False))
+        self.assertEqual(ctx.verify_mode, client.ssl.CERT_NONE)
+
+    @async_test
+    async def test_acquire_reuses_connection(self):
+        conn = await self.pool.acquire()
+        self.pool.release(conn)
+        other = await self.pool.acquire()
+
+        self.assertIs(conn, other)
+        self.assertEqual(len(self.pool), 1)
+
+    @async_test
+    async def test_acquire_max_size(self):
+        conns = [await self.pool.acquire() for i in range(3)]
+
+        self.assertEqual(len(self.pool), 2)
+        self.assertIs(conns[0], conns[2])
+
+    @async_test
+    async def test_acquire_unhealthy_connection(self):
+        conn = await self.pool.acquire()
+        self.pool.release(conn)
+        conn.writer.is_closing.return_value = True
+        other = await self.pool.acquire()
+
+        self.assertIsNot(conn, other)
+        self.assertEqual(len(self.pool), 1)
+
+    @async_test
+    async def test_acquire_idle_connection(self):
+        self.pool.idle_timeout = -1
+        conn = await self.pool.acquire()
+        self.pool.release(conn)
+        other = await self.pool.acquire()
+        self.pool.close()
+
+        self.assertIsNot(conn, other)
+        self.assertTrue(conn.disconnect.called)
+
+    @async_test
+    async def test_release_unhealthy_connection(self):
+        conn = await self.pool.acquire()
+        conn.is_connected.return_value = False
+        self.pool.release(conn)
+
+        self.assertEqual(len(self.pool), 0)
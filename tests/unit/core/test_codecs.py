@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+from toxicbuild.core import codecs
+
+
+class JSONCodecTest(TestCase):
+
+    def test_encode(self):
+        data = codecs.JSON.encode({'a': 1})
+
+        self.assertEqual(json.loads(data.decode()), {'a': 1})
+
+    def test_decode(self):
+        data = codecs.JSON.decode(b'{"a": 1}')
+
+        self.assertEqual(data, {'a': 1})
+
+    def test_encode_decode_int_keys(self):
+        data = codecs.JSON.encode({'a': {1: 'b'}})
+
+        # json keys are always strings
+        self.assertEqual(codecs.decode(data), {'a': {'1': 'b'}})
+
+    @patch.object(codecs, 'orjson', None)
+    def test_encode_without_orjson(self):
+        data = codecs.JSON.encode({'a': 1})
+
+        self.assertEqual(data, b'{"a": 1}')
+
+    @patch.object(codecs, 'orjson', None)
+    def test_decode_without_orjson(self):
+        data = codecs.JSON.decode(b'{"a": 1}')
+
+        self.assertEqual(data, {'a': 1})
+
+
+class CodecsTest(TestCase):
+
+    def test_get_codec_unknown(self):
+        self.assertIs(codecs.get_codec('bla'), codecs.JSON)
+
+    @patch.object(codecs, 'msgpack', None)
+    def test_get_codec_not_available(self):
+        self.assertIs(codecs.get_codec('msgpack'), codecs.JSON)
+
+    @patch.object(codecs, 'msgpack', None)
+    def test_get_available_codecs(self):
+        self.assertEqual(codecs.get_available_codecs(), ['json'])
+
+    @patch.object(codecs, 'msgpack', None)
+    def test_choose_codec_not_available(self):
+        codec = codecs.choose_codec(['msgpack', 'json'])
+
+        self.assertIs(codec, codecs.JSON)
+
+    def test_choose_codec_unknown(self):
+        codec = codecs.choose_codec(['bla'])
+
+        self.assertIs(codec, codecs.JSON)
+
+    def test_decode_json(self):
+        self.assertEqual(codecs.decode(b'{"a": 1}'), {'a': 1})
+
+    @skipIf(codecs.msgpack is None, 'msgpack not installed')
+    def test_choose_codec(self):
+        codec = codecs.choose_codec(['json', 'msgpack'])
+
+        self.assertEqual(codec.name, 'msgpack')
+
+    @skipIf(codecs.msgpack is None, 'msgpack not installed')
+    def test_decode_msgpack(self):
+        data = codecs.get_codec('msgpack').encode({'a': 1, 'b': 'ç'})
+
+        self.assertEqual(codecs.decode(data), {'a': 1, 'b': 'ç'})
+
+    @skipIf(codecs.msgpack is None, 'msgpack not installed')
+    def test_decode_msgpack_int_keys(self):
+        data = codecs.get_codec('msgpack').encode({'a': {1: 'b'}})
+
+        self.assertEqual(codecs.decode(data), {'a': {1: 'b'}})
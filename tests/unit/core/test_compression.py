@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+
+from toxicbuild.core import compression
+from toxicbuild.core.exceptions import FrameTooLarge
+
+
+class ZlibCompressorTest(TestCase):
+
+    def setUp(self):
+        self.compressor = compression.ZlibCompressor()
+
+    def test_compress_decompress(self):
+        data = b'some data' * 1000
+        compressed = self.compressor.compress(data)
+
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(self.compressor.decompress(compressed), data)
+
+    def test_decompress_max_len(self):
+        data = b'some data' * 1000
+        compressed = self.compressor.compress(data)
+
+        self.assertEqual(
+            self.compressor.decompress(compressed, max_len=len(data)), data)
+
+    def test_decompress_too_large(self):
+        compressed = self.compressor.compress(b'some data' * 1000)
+
+        with self.assertRaises(FrameTooLarge):
+            self.compressor.decompress(compressed, max_len=100)
+
+
+@skipIf(compression.zstandard is None, 'zstandard not installed')
+class ZstdCompressorTest(TestCase):
+
+    def setUp(self):
+        self.compressor = compression.ZstdCompressor()
+
+    def test_compress_decompress(self):
+        data = b'some data' * 1000
+        compressed = self.compressor.compress(data)
+
+        self.assertLess(len(compressed), len(data))
+        self.assertEqual(self.compressor.decompress(compressed), data)
+
+    def test_decompress_max_len(self):
+        data = b'some data' * 1000
+        compressed = self.compressor.compress(data)
+
+        self.assertEqual(
+            self.compressor.decompress(compressed, max_len=len(data)), data)
+
+    def test_decompress_too_large(self):
+        # a small message that is huge when decompressed.
+        compressed = self.compressor.compress(b'\0' * (2 ** 24))
+
+        with self.assertRaises(FrameTooLarge):
+            self.compressor.decompress(compressed, max_len=100)
+
+
+class CompressionTest(TestCase):
+
+    def test_get_compressor_unknown(self):
+        self.assertIsNone(compression.get_compressor('bla'))
+
+    @patch.object(compression, 'zstandard', None)
+    def test_get_compressor_not_available(self):
+        self.assertIsNone(compression.get_compressor('zstd'))
+
+    def test_get_compressor_by_flag(self):
+        compressor = compression.get_compressor_by_flag(b'z')
+
+        self.assertEqual(compressor.name, 'zlib')
+
+    def test_get_compressor_by_flag_unknown(self):
+        with self.assertRaises(ValueError):
+            compression.get_compressor_by_flag(b'x')
+
+    @patch.object(compression, 'zstandard', None)
+    def test_get_available_compressors(self):
+        self.assertEqual(compression.get_available_compressors(), ['zlib'])
+
+    def test_choose_compressor(self):
+        compressor = compression.choose_compressor(['zlib'])
+
+        self.assertEqual(compressor.name, 'zlib')
+
+    def test_choose_compressor_unknown(self):
+        self.assertIsNone(compression.choose_compressor(['bla']))
+
+    @skipIf(compression.zstandard is None, 'zstandard not installed')
+    def test_choose_compressor_zstd(self):
+        compressor = compression.choose_compressor(['zlib', 'zstd'])
+
+        self.assertEqual(compressor.name, 'zstd')
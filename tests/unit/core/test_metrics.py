@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from unittest import TestCase
+
+from toxicbuild.core import metrics
+from tests import async_test
+
+
+class HistogramTest(TestCase):
+
+    def test_observe(self):
+        histogram = metrics.Histogram(buckets=(0.1, 1, float('inf')))
+
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(10)
+
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.sum, 10.65)
+        self.assertEqual(histogram.cumulative(),
+                         [(0.1, 2), (1, 3), (float('inf'), 4)])
+
+
+class MetricsRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+
+    def test_request(self):
+        self.registry.request_started('Server', 'thing')
+        self.registry.request_started('Server', 'thing')
+
+        self.assertEqual(self.registry.in_flight[('Server', 'thing')], 2)
+
+        self.registry.request_finished('Server', 'thing', 0.2)
+
+        self.assertEqual(self.registry.in_flight[('Server', 'thing')], 1)
+        self.assertEqual(
+            self.registry.histograms[('Server', 'thing')].count, 1)
+
+    def test_to_dict(self):
+        self.registry.observe('Server', 'thing', 0.2)
+        self.registry.request_started('Server', 'other')
+        self.registry.add_bytes_in('Server', 10)
+        self.registry.add_bytes_out('Server', 20)
+        self.registry.add_auth_failure('Server')
+
+        r = self.registry.to_dict()
+
+        self.assertEqual(r['requests']['Server']['thing']['count'], 1)
+        self.assertEqual(r['requests']['Server']['thing']['buckets'][-1],
+                         ['+Inf', 1])
+        self.assertEqual(r['requests']['Server']['other']['in_flight'], 1)
+        self.assertEqual(r['bytes_in'], {'Server': 10})
+        self.assertEqual(r['bytes_out'], {'Server': 20})
+        self.assertEqual(r['auth_failures'], {'Server': 1})
+
+    def test_to_prometheus(self):
+        self.registry.observe('Server', 'thing', 0.2)
+        self.registry.add_bytes_in('Server', 10)
+
+        r = self.registry.to_prometheus()
+
+        self.assertIn('# TYPE toxicbuild_request_duration_seconds histogram',
+                      r)
+        self.assertIn('toxicbuild_request_duration_seconds_bucket{'
+                      'server="Server",action="thing",le="0.25"} 1', r)
+        self.assertIn('toxicbuild_request_duration_seconds_bucket{'
+                      'server="Server",action="thing",le="0.1"} 0', r)
+        self.assertIn('toxicbuild_received_bytes_total{server="Server"} 10',
+                      r)
+
+    def test_to_prometheus_escape(self):
+        self.registry.observe('Server', 'a"b', 0.2)
+
+        r = self.registry.to_prometheus()
+
+        self.assertIn('action="a\\"b"', r)
+
+    def test_clear(self):
+        self.registry.observe('Server', 'thing', 0.2)
+
+        self.registry.clear()
+
+        self.assertFalse(self.registry.histograms)
+
+
+class MetricsHTTPServerTest(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.MetricsRegistry()
+        self.registry.observe('Server', 'thing', 0.2)
+        self.server = metrics.MetricsHTTPServer('127.0.0.1', 0,
+                                                registry=self.registry)
+
+    async def _request(self, request):
+        await self.server.start()
+        port = self.server.server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request)
+        response = await reader.read()
+        writer.close()
+        self.server.close()
+        return response
+
+    @async_test
+    async def test_metrics(self):
+        response = await self._request(b'GET /metrics HTTP/1.1\r\n\r\n')
+
+        self.assertTrue(response.startswith(b'HTTP/1.0 200 OK'))
+        self.assertIn(b'toxicbuild_request_duration_seconds_count', response)
+
+    @async_test
+    async def test_not_found(self):
+        response = await self._request(b'GET /bla HTTP/1.1\r\n\r\n')
+
+        self.assertTrue(response.startswith(b'HTTP/1.0 404'))
+
+    @async_test
+    async def test_bad_request(self):
+        response = await self._request(b'bla\r\n\r\n')
+
+        self.assertEqual(response, b'')
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from toxicbuild.core import output
+
+
+class OutputBufferTest(TestCase):
+
+    def setUp(self):
+        self.buff = output.OutputBuffer(head_len=5, tail_len=5)
+
+    def tearDown(self):
+        self.buff.close()
+        if self.buff.path:
+            os.remove(self.buff.path)
+
+    def test_write_small(self):
+        self.buff.write('abc')
+        self.buff.write('def')
+
+        self.assertFalse(self.buff.truncated)
+        self.assertIsNone(self.buff.path)
+        self.assertEqual(self.buff.getvalue(), 'abcdef')
+
+    def test_write_truncated(self):
+        for i in range(10):
+            self.buff.write('{}\n'.format(i))
+
+        self.assertTrue(self.buff.truncated)
+        self.assertEqual(self.buff.size, 20)
+        expected = '0\n1\n2\n\n[... 10 characters omitted ...]\n\n\n8\n9\n'
+        self.assertEqual(self.buff.getvalue(), expected)
+
+    def test_write_spill(self):
+        self.buff.write('abcdefgh')
+        self.buff.write('ijklmnop')
+        self.buff.close()
+
+        with open(self.buff.path) as fd:
+            self.assertEqual(fd.read(), 'abcdefghijklmnop')
+
+    def test_write_spill_path(self):
+        path = os.path.join(tempfile.gettempdir(), 'toxic-test-spill.log')
+        self.buff.spill_path = path
+        self.buff.write('a' * 11)
+        self.buff.close()
+
+        self.assertEqual(self.buff.path, path)
+
+    def test_tail_memory(self):
+        for i in range(1000):
+            self.buff.write('x' * 3)
+
+        self.assertLessEqual(self.buff._tail_size, 8)
+
+
+class ReadOutputFileTest(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'output.log')
+        with open(self.path, 'wb') as fd:
+            fd.write('abc€def'.encode())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_read_output_file(self):
+        text, offset, size = output.read_output_file(self.path)
+
+        self.assertEqual(text, 'abc€def')
+        self.assertEqual(offset, size)
+        self.assertEqual(size, 9)
+
+    def test_read_output_file_incomplete_char(self):
+        text, offset, size = output.read_output_file(self.path, length=4)
+
+        self.assertEqual(text, 'abc')
+        self.assertEqual(offset, 3)
+
+        text, offset, size = output.read_output_file(self.path, offset,
+                                                     length=4)
+        self.assertEqual(text, '€d')
+        self.assertEqual(offset, 7)
+
+    def test_remove_old_outputs(self):
+        old = time.time() - 100
+        os.utime(self.path, (old, old))
+        output.remove_old_outputs(self.dir, 50)
+
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_remove_old_outputs_no_dir(self):
+        output.remove_old_outputs('/does/not/exist', 50)
@@ -56,7 +56,7 @@ class BaseToxicProtocolTest(TestCase):
 
         self.protocol._stream_writer.write = w
 
-        # the return of _stream_reader.read()
+        # the data read from _stream_reader
         self.message = json.dumps(
             {'action': 'thing', 'token': '123sd'}).encode('utf-8')
 
@@ -65,12 +65,22 @@ class BaseToxicProtocolTest(TestCase):
 
         self._rlimit = 0
 
-        async def r(limit):
-            part = self.full_message[self._rlimit:limit + self._rlimit]
-            self._rlimit += limit
+        async def readuntil(sep):
+            msg = self.full_message[self._rlimit:]
+            i = msg.find(sep)
+            if i < 0:
+                self._rlimit += len(msg)
+                raise protocol.asyncio.IncompleteReadError(msg, None)
+            self._rlimit += i + 1
+            return msg[:i + 1]
+
+        async def readexactly(n):
+            part = self.full_message[self._rlimit:n + self._rlimit]
+            self._rlimit += n
             return part
 
-        self.protocol._stream_reader.read = r
+        self.protocol._stream_reader.readuntil = readuntil
+        self.protocol._stream_reader.readexactly = readexactly
 
     def test_call(self):
 
@@ -89,7 +99,10 @@ class BaseToxicProtocolTest(TestCase):
         prot = protocol.BaseToxicProtocol(loop)
         prot._stream_reader_wr = mock.MagicMock()
         prot._stream_writer = mock.MagicMock()
-        prot._stream_reader.read = self.protocol._stream_reader.read
+        prot._stream_reader.readuntil = \
+            self.protocol._stream_reader.readuntil
+        prot._stream_reader.readexactly = \
+            self.protocol._stream_reader.readexactly
         transport = mock.Mock()
         cc_mock = mock.Mock()
 
@@ -115,7 +128,10 @@ class BaseToxicProtocolTest(TestCase):
         prot = protocol.BaseToxicProtocol(loop)
         prot._stream_reader_wr = mock.MagicMock()
         prot._stream_writer = mock.MagicMock()
-        prot._stream_reader.read = self.protocol._stream_reader.read
+        prot._stream_reader.readuntil = \
+            self.protocol._stream_reader.readuntil
+        prot._stream_reader.readexactly = \
+            self.protocol._stream_reader.readexactly
         transport = mock.Mock()
 
         async def cc():
@@ -177,6 +193,23 @@ class BaseToxicProtocolTest(TestCase):
         await self.protocol.check_data()
         self.assertEqual(self.response['code'], 3)
 
+    @mock.patch.object(protocol.metrics, 'registry',
+                       protocol.metrics.MetricsRegistry())
+    @mock.patch.object(protocol.utils, 'log', mock.Mock())
+    @async_test
+    async def test_check_data_with_bad_token_metrics(self):
+        message = '{"salci": "fufu", "token": "123sdf"}'
+        self.full_message = '{}\n'.format(len(message)) + message
+        self.full_message = self.full_message.encode('utf-8')
+
+        await self.protocol.check_data()
+
+        registry = protocol.metrics.registry
+        self.assertEqual(registry.auth_failures['BaseToxicProtocol'], 1)
+        self.assertEqual(registry.bytes_in['BaseToxicProtocol'],
+                         len(message))
+        self.assertTrue(registry.bytes_out['BaseToxicProtocol'])
+
     @mock.patch.object(protocol.utils.LoggerMixin, 'log', mock.Mock())
     @async_test
     async def test_check_data_without_action(self):
@@ -227,3 +260,256 @@ class BaseToxicProtocolTest(TestCase):
         self.protocol.close_connection()
 
         self.assertFalse(self.protocol._connected)
+
+    @async_test
+    async def test_send_response_with_request_id(self):
+        self.protocol.request_id = 3
+        await self.protocol.send_response(code=0, body='something!')
+
+        self.assertEqual(self.response['request_id'], 3)
+
+    @async_test
+    async def test_check_data_with_request_id(self):
+        message = '{"action": "hack!", "token": "123sd", "request_id": 0}'
+        self.full_message = '{}\n'.format(len(message)) + message
+        self.full_message = self.full_message.encode('utf-8')
+
+        await self.protocol.check_data()
+
+        self.assertTrue(self.protocol.is_multiplexed)
+
+    def test_close_connection_multiplexed_request(self):
+        req = self.protocol._get_request_protocol(
+            {'action': 'thing', 'request_id': 1})
+        req.close_connection()
+
+        self.assertFalse(self.protocol._stream_writer.close.called)
+
+    @mock.patch.object(protocol.asyncio, 'StreamReader', mock.MagicMock(
+        spec=protocol.asyncio.StreamReader))
+    @mock.patch.object(protocol.asyncio, 'StreamWriter', mock.MagicMock(
+        spec=protocol.asyncio.StreamWriter))
+    @async_test
+    async def test_connection_made_multiplexed(self):
+        messages = [{'action': 'thing', 'token': '123sd', 'request_id': 0},
+                    {'action': 'other', 'request_id': 1}]
+        self.full_message = b''
+        for msg in messages:
+            msg = json.dumps(msg).encode('utf-8')
+            self.full_message += '{}\n'.format(len(msg)).encode() + msg
+
+        actions = []
+
+        class Proto(protocol.BaseToxicProtocol):
+
+            async def client_connected(self):
+                actions.append((self.action, self.request_id))
+                self.close_connection()
+
+        loop = mock.Mock()
+        prot = Proto(loop)
+        prot._stream_reader_wr = mock.MagicMock()
+        prot._stream_writer = mock.MagicMock()
+        prot._stream_reader.readuntil = \
+            self.protocol._stream_reader.readuntil
+        prot._stream_reader.readexactly = \
+            self.protocol._stream_reader.readexactly
+        transport = mock.Mock()
+        prot.encrypted_token = self.protocol.encrypted_token
+        prot.connection_made(transport)
+        await prot._check_data_future
+        await prot._client_connected_future
+
+        self.assertEqual(actions, [('thing', 0), ('other', 1)])
+        self.assertFalse(prot._connected)
+
+    @mock.patch.object(protocol.asyncio, 'StreamReader', mock.MagicMock(
+        spec=protocol.asyncio.StreamReader))
+    @mock.patch.object(protocol.asyncio, 'StreamWriter', mock.MagicMock(
+        spec=protocol.asyncio.StreamWriter))
+    @async_test
+    async def test_connection_made_multiplexed_bad_length(self):
+        msg = json.dumps({'action': 'thing', 'token': '123sd',
+                          'request_id': 0}).encode('utf-8')
+        self.full_message = '{}\n'.format(len(msg)).encode() + msg
+        # not a number
+        self.full_message += b'bla\n{}'
+
+        actions = []
+
+        class Proto(protocol.BaseToxicProtocol):
+
+            async def client_connected(self):
+                actions.append((self.action, self.request_id))
+
+        loop = mock.Mock()
+        prot = Proto(loop)
+        prot._stream_reader_wr = mock.MagicMock()
+        prot._stream_writer = mock.MagicMock()
+        prot._stream_reader.readuntil = \
+            self.protocol._stream_reader.readuntil
+        prot._stream_reader.readexactly = \
+            self.protocol._stream_reader.readexactly
+        prot.log = mock.Mock()
+        transport = mock.Mock()
+        prot.encrypted_token = self.protocol.encrypted_token
+        prot.connection_made(transport)
+        await prot._check_data_future
+        await prot._client_connected_future
+
+        # the requests already read are handled and the connection closed
+        self.assertEqual(actions, [('thing', 0)])
+        self.assertFalse(prot._connected)
+
+    @mock.patch.object(protocol.asyncio, 'StreamReader', mock.MagicMock(
+        spec=protocol.asyncio.StreamReader))
+    @mock.patch.object(protocol.asyncio, 'StreamWriter', mock.MagicMock(
+        spec=protocol.asyncio.StreamWriter))
+    @async_test
+    async def test_connection_made_multiplexed_not_a_dict(self):
+        msg = json.dumps({'action': 'thing', 'token': '123sd',
+                          'request_id': 0}).encode('utf-8')
+        self.full_message = '{}\n'.format(len(msg)).encode() + msg
+        # valid json, but not a dict
+        other = json.dumps([1, 2]).encode('utf-8')
+        self.full_message += '{}\n'.format(len(other)).encode() + other
+
+        actions = []
+
+        class Proto(protocol.BaseToxicProtocol):
+
+            async def client_connected(self):
+                actions.append((self.action, self.request_id))
+
+        loop = mock.Mock()
+        prot = Proto(loop)
+        prot._stream_reader_wr = mock.MagicMock()
+        prot._stream_reader.readuntil = \
+            self.protocol._stream_reader.readuntil
+        prot._stream_reader.readexactly = \
+            self.protocol._stream_reader.readexactly
+        prot.log = mock.Mock()
+        transport = mock.Mock()
+        prot.encrypted_token = self.protocol.encrypted_token
+        prot.connection_made(transport)
+        # to read the responses
+        prot._stream_writer = self.protocol._stream_writer
+        await prot._check_data_future
+        await prot._client_connected_future
+
+        self.assertEqual(actions, [('thing', 0)])
+        self.assertEqual(self.response['code'], 1)
+        self.assertFalse(prot._connected)
+
+    @async_test
+    async def test_check_data_cb_with_exception(self):
+        self.protocol._connected = True
+        self.protocol.client_connected = mock.AsyncMock()
+        future = protocol.asyncio.get_event_loop().create_future()
+        future.set_exception(protocol.asyncio.IncompleteReadError(b'1', 3))
+
+        self.protocol._check_data_cb(future)
+
+        self.assertFalse(self.protocol._connected)
+        self.assertIsNone(self.protocol._client_connected_future)
+
+    @mock.patch.object(protocol.metrics, 'registry',
+                       protocol.metrics.MetricsRegistry())
+    @async_test
+    async def test_logged_client_connected_metrics(self):
+        self.protocol.action = 'thing'
+        self.protocol.client_connected = mock.AsyncMock(return_value=0)
+
+        await self.protocol._logged_client_connected()
+
+        registry = protocol.metrics.registry
+        histogram = registry.histograms[('BaseToxicProtocol', 'thing')]
+        self.assertEqual(histogram.count, 1)
+        self.assertEqual(registry.in_flight[('BaseToxicProtocol', 'thing')],
+                         0)
+
+    @mock.patch.object(protocol.metrics, 'registry',
+                       protocol.metrics.MetricsRegistry())
+    @async_test
+    async def test_logged_client_connected_metrics_exception(self):
+        self.protocol.action = 'thing'
+        self.protocol.client_connected = mock.AsyncMock(
+            side_effect=Exception)
+
+        with self.assertRaises(Exception):
+            await self.protocol._logged_client_connected()
+
+        registry = protocol.metrics.registry
+        histogram = registry.histograms[('BaseToxicProtocol', 'thing')]
+        self.assertEqual(histogram.count, 1)
+        self.assertEqual(registry.in_flight[('BaseToxicProtocol', 'thing')],
+                         0)
+
+    @mock.patch.object(protocol.metrics, 'registry',
+                       protocol.metrics.MetricsRegistry())
+    @async_test
+    async def test_metrics_action(self):
+        protocol.metrics.registry.observe('SomeServer', 'thing', 0.1)
+        self.protocol.action = 'metrics'
+        self.protocol.data = {'action': 'metrics', 'body': {}}
+        self.protocol.client_connected = mock.AsyncMock()
+
+        await self.protocol._logged_client_connected()
+
+        body = self.response['body']['metrics']
+        self.assertEqual(body['requests']['SomeServer']['thing']['count'], 1)
+        self.assertFalse(self.protocol.client_connected.called)
+        self.assertTrue(self.protocol._stream_writer.close.called)
+
+    @mock.patch.object(protocol.metrics, 'registry',
+                       protocol.metrics.MetricsRegistry())
+    @async_test
+    async def test_metrics_action_prometheus(self):
+        protocol.metrics.registry.observe('SomeServer', 'thing', 0.1)
+        self.protocol.action = 'metrics'
+        self.protocol.data = {'action': 'metrics',
+                              'body': {'format': 'prometheus'}}
+
+        await self.protocol._logged_client_connected()
+
+        body = self.response['body']['metrics']
+        self.assertIn('toxicbuild_request_duration_seconds_count{'
+                      'server="SomeServer",action="thing"} 1', body)
+
+    @async_test
+    async def test_check_data_with_codecs(self):
+        message = '{"action": "hack!", "token": "123sd", "codecs": ["bla"]}'
+        self.full_message = '{}\n'.format(len(message)) + message
+        self.full_message = self.full_message.encode('utf-8')
+
+        await self.protocol.check_data()
+        await self.protocol.send_response(code=0, body='ok')
+
+        self.assertIs(self.protocol.codec, protocol.codecs.JSON)
+        self.assertEqual(self.response['codec'], 'json')
+
+    @async_test
+    async def test_check_data_with_compression(self):
+        message = ('{"action": "hack!", "token": "123sd", '
+                   '"compression": ["bla", "zlib"]}')
+        self.full_message = '{}\n'.format(len(message)) + message
+        self.full_message = self.full_message.encode('utf-8')
+
+        await self.protocol.check_data()
+        await self.protocol.send_response(code=0, body='ok')
+
+        self.assertEqual(self.protocol.compressor.name, 'zlib')
+        self.assertEqual(self.response['compression'], 'zlib')
+
+    @async_test
+    async def test_check_data_with_unknown_compression(self):
+        message = ('{"action": "hack!", "token": "123sd", '
+                   '"compression": ["bla"]}')
+        self.full_message = '{}\n'.format(len(message)) + message
+        self.full_message = self.full_message.encode('utf-8')
+
+        await self.protocol.check_data()
+        await self.protocol.send_response(code=0, body='ok')
+
+        self.assertIsNone(self.protocol.compressor)
+        self.assertIsNone(self.response['compression'])
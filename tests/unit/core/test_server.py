@@ -42,6 +42,15 @@ class ToxicServerTest(TestCase):
                                          use_ssl=True, ssl_kw={})
         self.assertTrue(server.ssl.create_default_context.called)
 
+    @patch.object(server, 'MetricsHTTPServer', Mock())
+    def test_instance_metrics_port(self):
+        loop = Mock()
+        self.server = server.ToxicServer('0.0.0.0', 8888, loop=loop,
+                                         metrics_port=9999)
+
+        server.MetricsHTTPServer.assert_called_with('0.0.0.0', 9999)
+        self.assertTrue(self.server.metrics_server.start.called)
+
     def test_context_management(self):
         self.server.loop.run_until_complete = asyncio.get_event_loop()\
                                                      .run_until_complete
@@ -54,6 +63,18 @@ class ToxicServerTest(TestCase):
         self.assertTrue(self.server.server.close.called)
         self.assertTrue(self.server.server.wait_closed.called)
 
+    def test_context_management_metrics_server(self):
+        self.server.loop.run_until_complete = asyncio.get_event_loop()\
+                                                     .run_until_complete
+        self.server.server = Mock(close=Mock(),
+                                  wait_closed=AsyncMock())
+        self.server.metrics_server = Mock()
+
+        with self.server:
+            pass
+
+        self.assertTrue(self.server.metrics_server.close.called)
+
     def test_start(self):
         self.server.loop.run_forever = Mock()
         self.server.sync_shutdown = Mock(spec=self.server.sync_shutdown)
@@ -62,3 +83,105 @@ class ToxicServerTest(TestCase):
 
         self.assertTrue(self.server.loop.run_forever.called)
         self.assertTrue(self.server.sync_shutdown.called)
+
+    def test_instance_workers(self):
+        loop = Mock()
+        self.server = server.ToxicServer('0.0.0.0', 8888, loop=loop,
+                                         workers=2)
+
+        self.assertIsNone(self.server.server)
+        self.assertFalse(loop.create_server.called)
+
+    @patch.object(server, 'WorkersSupervisor', Mock())
+    def test_start_workers(self):
+        self.server.workers = 2
+
+        self.server.start()
+
+        server.WorkersSupervisor.assert_called_with(self.server.run_worker, 2)
+        self.assertTrue(server.WorkersSupervisor.return_value.run.called)
+
+    def test_exit_without_server(self):
+        self.server.server = None
+
+        with self.server:
+            pass
+
+        self.assertFalse(self.server.loop.close.called)
+
+    @patch.object(server, 'MetricsHTTPServer', Mock())
+    @patch.object(server.asyncio, 'set_event_loop', Mock())
+    @patch.object(server.asyncio, 'new_event_loop', Mock())
+    def test_run_worker(self):
+        self.server.workers = 2
+        self.server.metrics_port = 9000
+        self.server.start = Mock()
+
+        self.server.run_worker(1)
+
+        loop = server.asyncio.new_event_loop.return_value
+        kw = loop.create_server.call_args[1]
+        self.assertTrue(kw['reuse_port'])
+        server.MetricsHTTPServer.assert_called_with('0.0.0.0', 9001)
+        self.assertTrue(self.server.start.called)
+        self.assertTrue(loop.close.called)
+
+    def test_stop(self):
+        self.server.stop()
+
+        self.assertTrue(self.server.loop.stop.called)
+
+
+class WorkersSupervisorTest(TestCase):
+
+    def setUp(self):
+        self.target = Mock()
+        self.supervisor = server.WorkersSupervisor(self.target, 2)
+        self.supervisor.restart_delay = 0
+
+    @patch.object(server.os, 'fork', Mock(return_value=123))
+    def test_spawn(self):
+        pid = self.supervisor.spawn(1)
+
+        self.assertEqual(pid, 123)
+        self.assertEqual(self.supervisor.pids, {123: 1})
+        self.assertFalse(self.target.called)
+
+    @patch.object(server.signal, 'signal', Mock())
+    @patch.object(server.os, 'fork', Mock(side_effect=[1, 2, 3]))
+    def test_run_restarts_worker(self):
+        waits = [(1, 9), (2, 0), (3, 0)]
+
+        def wait():
+            if len(waits) == 2:
+                # the worker was restarted, now we stop.
+                self.supervisor._stopping = True
+            return waits.pop(0)
+
+        with patch.object(server.os, 'wait', wait):
+            self.supervisor.run()
+
+        self.assertEqual(server.os.fork.call_count, 3)
+        self.assertEqual(self.supervisor.pids, {})
+
+    @patch.object(server.signal, 'signal', Mock())
+    @patch.object(server.os, 'wait', Mock(
+        side_effect=[(1, 9), ChildProcessError]))
+    @patch.object(server.os, 'fork', Mock(side_effect=[1, 2]))
+    def test_run_stopping(self):
+        self.supervisor._stopping = True
+
+        self.supervisor.run()
+
+        self.assertEqual(server.os.fork.call_count, 2)
+
+    @patch.object(server.os, 'kill', Mock(
+        side_effect=[None, ProcessLookupError]))
+    def test_terminate(self):
+        self.supervisor.pids = {1: 0, 2: 1}
+
+        self.supervisor.terminate()
+
+        self.assertTrue(self.supervisor._stopping)
+        self.assertEqual(server.os.kill.call_count, 2)
+        self.assertEqual(self.supervisor.pids, {1: 0})
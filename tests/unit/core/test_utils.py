@@ -22,62 +22,114 @@ import asyncio
 import datetime
 import os
 import subprocess
+import tempfile
 import time
 from unittest import TestCase
 from unittest.mock import patch, Mock, MagicMock, AsyncMock
 from toxicbuild.core import utils
+from toxicbuild.core import output as output_mod
 from tests.unit.core import TEST_DATA_DIR
 from tests import async_test
 
 
 class UtilsTest(TestCase):
 
+    def test_split_lines(self):
+        lines, rest = utils._split_lines('a\nb\r\nc\x0cd\u2028e\nf')
+
+        self.assertEqual(lines, ['a\n', 'b\r\n', 'c\x0cd\u2028e\n'])
+        self.assertEqual(rest, 'f')
+
+    def test_split_lines_cr_at_end(self):
+        lines, rest = utils._split_lines('a\nb\r')
+
+        self.assertEqual(lines, ['a\n'])
+        self.assertEqual(rest, 'b\r')
+
+    def test_split_lines_too_long(self):
+        text = 'a' * (utils.OUTPUT_CHUNK_LEN + 1)
+        lines, rest = utils._split_lines(text)
+
+        self.assertEqual(lines, [text])
+        self.assertEqual(rest, '')
+
     @async_test
-    async def test_try_readline_lf(self):
+    async def test_read_output(self):
         stream = AsyncMock()
-        await utils._try_readline(stream)
+        # a multi-byte char split between two chunks
+        euro = '€'.encode()
+        stream.read.side_effect = [b'line 1\nline 2\nli' + euro[:1],
+                                   euro[1:] + b'ne 3', b'']
+        out_fn = AsyncMock()
+        out = []
+
+        await utils._read_output(stream, out.append, out_fn)
+        await asyncio.sleep(0)
 
-        assert stream.readuntil.call_args[0][0] == b'\n'
+        self.assertEqual(''.join(out), 'line 1\nline 2\nli€ne 3')
+        calls = [c[0] for c in out_fn.call_args_list]
+        self.assertEqual(calls, [(0, ['line 1\n', 'line 2\n']),
+                                 (2, ['li€ne 3'])])
 
     @async_test
-    async def test_try_readline_cr(self):
+    async def test_read_output_batches(self):
         stream = AsyncMock()
-        stream.readuntil.side_effect = [
-            utils.LimitOverrunError('msg', False), '']
-        await utils._try_readline(stream)
+        stream.read.side_effect = [b'a\nb', b'\nc\n', b'']
+        out_fn = AsyncMock()
+
+        await utils._read_output(stream, Mock(), out_fn)
+        await asyncio.sleep(0)
 
-        assert stream.readuntil.call_args[0][0] == b'\r'
+        calls = [c[0] for c in out_fn.call_args_list]
+        self.assertEqual(calls, [(0, ['a\n']), (1, ['b\n', 'c\n'])])
 
-    @patch.object(utils, '_try_readline', AsyncMock(
-        side_effect=utils.IncompleteReadError('partial', 'exp')))
     @async_test
-    async def test_readline_incomplete(self):
+    async def test_read_output_order(self):
         stream = AsyncMock()
-        r = await utils._readline(stream)
+        stream.read.side_effect = [b'a\n', b'b\n', b'c\n', b'']
+        delivered = []
 
-        self.assertEqual(r, 'partial')
+        async def out_fn(line_index, lines):
+            # the first batch is the slowest one
+            await asyncio.sleep(0.01 if line_index == 0 else 0)
+            delivered.append(line_index)
 
-    @patch.object(utils, '_try_readline', AsyncMock(
-        side_effect=utils.LimitOverrunError('msg', 0)))
+        await utils._read_output(stream, Mock(), out_fn)
+
+        self.assertEqual(delivered, [0, 1, 2])
+
+    @patch.object(utils, 'OUTPUT_QUEUE_LEN', 1)
     @async_test
-    async def test_readline_limit_overrun(self):
+    async def test_read_output_backpressure(self):
         stream = AsyncMock()
-        stream._buffer = bytearray()
-        stream._maybe_resume_transport = Mock()
-        stream._buffer.extend(b'\nblerg')
-        with self.assertRaises(ValueError):
-            await utils._readline(stream)
+        stream.read.side_effect = [b'a\n'] * 10 + [b'']
+        release = asyncio.Event()
+
+        async def out_fn(line_index, lines):
+            await release.wait()
+
+        t = asyncio.ensure_future(
+            utils._read_output(stream, Mock(), out_fn))
+        await asyncio.sleep(0.01)
+        # one chunk being delivered, one in the queue and one waiting
+        # for a place in the queue.
+        self.assertEqual(stream.read.call_count, 3)
 
-    @patch.object(utils, '_try_readline', AsyncMock(
-        side_effect=utils.LimitOverrunError('msg', 0)))
+        release.set()
+        await t
+        self.assertEqual(stream.read.call_count, 11)
+
+    @patch.object(utils, 'log', Mock())
     @async_test
-    async def test_readline_limit_overrun_clear(self):
+    async def test_read_output_out_fn_error(self):
         stream = AsyncMock()
-        stream._buffer = bytearray()
-        stream._maybe_resume_transport = Mock()
-        await stream.extend(b'blerg')
-        with self.assertRaises(ValueError):
-            await utils._readline(stream)
+        stream.read.side_effect = [b'a\n', b'b\n', b'']
+        out_fn = AsyncMock(side_effect=[Exception('bla'), None])
+
+        await utils._read_output(stream, Mock(), out_fn)
+
+        self.assertEqual(out_fn.call_count, 2)
+        self.assertTrue(utils.log.called)
 
     @async_test
     async def test_exec_cmd(self):
@@ -99,6 +151,48 @@ class UtilsTest(TestCase):
         # when the process try to send its message to the caller
         time.sleep(1)
 
+    @async_test
+    async def test_exec_argv(self):
+        out = await utils.exec_argv(['echo', 'some $thing'], cwd='.')
+        self.assertEqual(out, 'some $thing')
+
+    @async_test
+    async def test_exec_argv_with_env(self):
+        out = await utils.exec_argv(['sh', '-c', 'echo $MYPROGRAMVAR'],
+                                    cwd='.', env={'MYPROGRAMVAR': 'bla'})
+        self.assertEqual(out, 'bla')
+
+    @async_test
+    async def test_exec_argv_with_input(self):
+        out = await utils.exec_argv(['cat'], cwd='.', input='some\nthing\n')
+        self.assertEqual(out, 'some\nthing')
+
+    @async_test
+    async def test_exec_argv_with_input_not_read(self):
+        # the command exits without reading the input
+        out = await utils.exec_argv(['echo', 'ok'], cwd='.',
+                                    input='a' * 1024 * 1024)
+        self.assertEqual(out, 'ok')
+
+    @async_test
+    async def test_exec_argv_with_error(self):
+        with self.assertRaises(utils.ExecCmdError):
+            await utils.exec_argv(['ls', '/does/not/exist'], cwd='.')
+
+    @async_test
+    async def test_exec_argv_program_not_found(self):
+        with self.assertRaises(utils.ExecCmdError):
+            await utils.exec_argv(['lsz'], cwd='.')
+
+    @async_test
+    async def test_exec_argv_kills_background_processes(self):
+        cmd = 'sleep 57'
+        shell_cmd = '{} > /dev/null 2>&1 &'.format(cmd)
+        await utils.exec_argv(['sh', '-c', shell_cmd], cwd='.')
+
+        procs = subprocess.check_output(['ps', 'aux']).decode()
+        self.assertNotIn(cmd, procs)
+
     @async_test
     async def test_kill_group(self):
         cmd = 'sleep 55'
@@ -141,8 +235,59 @@ class UtilsTest(TestCase):
 
         await wait()
         self.assertTrue(out_fn.called)
-        self.assertTrue(isinstance(
-            out_fn.call_args[0][1], str), out_fn.call_args)
+        self.assertEqual(out_fn.call_args[0], (0, ['something\n']))
+
+    @async_test
+    async def test_exec_cmd_many_lines(self):
+        cmd = 'seq 1 100000'
+
+        out = await utils.exec_cmd(cmd, cwd='.')
+
+        lines = out.splitlines()
+        self.assertEqual(len(lines), 100000)
+        self.assertEqual(lines[-1], '100000')
+
+    @async_test
+    async def test_exec_cmd_with_output(self):
+        output = output_mod.OutputBuffer(head_len=10, tail_len=10)
+        with output:
+            out = await utils.exec_cmd('seq 1 1000', cwd='.', output=output)
+
+        try:
+            self.assertTrue(output.truncated)
+            self.assertEqual(out, output.getvalue().strip('\n'))
+            with open(output.path) as fd:
+                full = fd.read()
+        finally:
+            os.remove(output.path)
+        self.assertEqual(full.splitlines()[-1], '1000')
+
+    @async_test
+    async def test_exec_cmd_timeout_kills_command(self):
+        cmd = 'sleep 56'
+        with self.assertRaises(asyncio.TimeoutError):
+            await utils.exec_cmd(cmd, cwd='.', timeout=0.5)
+
+        procs = subprocess.check_output(['ps', 'aux']).decode()
+        self.assertNotIn(cmd, procs)
+
+    @async_test
+    async def test_exec_cmd_timeout_without_output(self):
+        # the timeout is for how long we wait for output, not for
+        # the whole command.
+        cmd = 'for i in 1 2 3 4 5; do echo $i; sleep 0.2; done'
+        out = await utils.exec_cmd(cmd, cwd='.', timeout=0.5)
+
+        self.assertEqual(out.splitlines()[-1], '5')
+
+    @async_test
+    async def test_exec_cmd_timeout_output_closed(self):
+        cmd = 'exec >&- 2>&-; sleep 57'
+        with self.assertRaises(asyncio.TimeoutError):
+            await utils.exec_cmd(cmd, cwd='.', timeout=0.5)
+
+        procs = subprocess.check_output(['ps', 'aux']).decode()
+        self.assertNotIn('sleep 57', procs)
 
     def test_get_envvars(self):
         envvars = {'PATH': 'PATH:venv/bin',
@@ -173,6 +318,42 @@ class UtilsTest(TestCase):
 
         self.assertEqual(len(list(returned.keys())), 2)
 
+    def test_get_envvars_dict(self):
+        # uvloop only accepts a real dict as env for subprocesses
+        returned = utils.get_envvars({})
+
+        self.assertIs(type(returned), dict)
+
+    @patch.object(utils.asyncio, 'set_event_loop_policy', Mock())
+    def test_set_event_loop_policy_disabled(self):
+        settings = Mock(USE_UVLOOP=False)
+
+        r = utils.set_event_loop_policy(settings)
+
+        self.assertFalse(r)
+        self.assertFalse(utils.asyncio.set_event_loop_policy.called)
+
+    @patch.object(utils, 'uvloop', None)
+    @patch.object(utils.asyncio, 'set_event_loop_policy', Mock())
+    def test_set_event_loop_policy_no_uvloop(self):
+        settings = Mock(USE_UVLOOP=True)
+
+        r = utils.set_event_loop_policy(settings)
+
+        self.assertFalse(r)
+        self.assertFalse(utils.asyncio.set_event_loop_policy.called)
+
+    @patch.object(utils, 'uvloop', Mock())
+    @patch.object(utils.asyncio, 'set_event_loop_policy', Mock())
+    def test_set_event_loop_policy(self):
+        settings = Mock(USE_UVLOOP=True)
+
+        r = utils.set_event_loop_policy(settings)
+
+        self.assertTrue(r)
+        utils.asyncio.set_event_loop_policy.assert_called_with(
+            utils.uvloop.EventLoopPolicy.return_value)
+
     def test_load_module_from_file_with_file_not_found(self):
         with self.assertRaises(FileNotFoundError):
             utils.load_module_from_file('/some/file/that/does/not/exist.conf')
@@ -324,6 +505,48 @@ class UtilsTest(TestCase):
         encrypted = utils.bcrypt_string(passwd)
         self.assertTrue(utils.compare_bcrypt_string(passwd, encrypted))
 
+    @async_test
+    async def test_verify_token(self):
+        encrypted = utils.bcrypt_string('the-token', utils.bcrypt.gensalt(4))
+        utils._VERIFIED_TOKENS.clear()
+
+        self.assertTrue(await utils.verify_token('the-token', encrypted))
+        self.assertTrue(utils._VERIFIED_TOKENS.has('the-token', encrypted))
+
+    @async_test
+    async def test_verify_token_bad_token(self):
+        encrypted = utils.bcrypt_string('the-token', utils.bcrypt.gensalt(4))
+        utils._VERIFIED_TOKENS.clear()
+
+        self.assertFalse(await utils.verify_token('bad-token', encrypted))
+        self.assertEqual(len(utils._VERIFIED_TOKENS), 0)
+
+    @patch.object(utils, 'compare_bcrypt_string', Mock(return_value=True))
+    @async_test
+    async def test_verify_token_cached(self):
+        utils._VERIFIED_TOKENS.clear()
+        await asyncio.gather(*[utils.verify_token('the-token', 'encrypted')
+                               for i in range(3)])
+        await utils.verify_token('the-token', 'encrypted')
+
+        self.assertEqual(utils.compare_bcrypt_string.call_count, 1)
+
+    def test_verified_token_cache_ttl(self):
+        cache = utils.VerifiedTokenCache(ttl=-1)
+        cache.add('token', 'encrypted')
+
+        self.assertFalse(cache.has('token', 'encrypted'))
+        self.assertEqual(len(cache), 0)
+
+    def test_verified_token_cache_max_size(self):
+        cache = utils.VerifiedTokenCache(max_size=2)
+        for token in ['a', 'b', 'c']:
+            cache.add(token, 'encrypted')
+
+        self.assertFalse(cache.has('a', 'encrypted'))
+        self.assertTrue(cache.has('c', 'encrypted'))
+        self.assertEqual(len(cache), 2)
+
     def test_create_random_string(self):
         length = 10
         random_str = utils.create_random_string(length)
@@ -366,14 +589,14 @@ class UtilsTest(TestCase):
         smatch = 'somestuff'
         self.assertFalse(utils.match_string(smatch, filters))
 
-    @patch.object(utils, '_THREAD_EXECUTOR', MagicMock())
     @async_test
     async def test_run_in_thread(self):
-        fn = Mock()
-        await utils.run_in_thread(fn, 1, a=2)
-        called = utils._THREAD_EXECUTOR.submit.call_args
-        expected = ((fn, 1), {'a': 2})
+        fn = Mock(return_value='ok')
+        r = await utils.run_in_thread(fn, 1, a=2)
+        called = fn.call_args
+        expected = ((1,), {'a': 2})
         self.assertEqual(called, expected)
+        self.assertEqual(r, 'ok')
 
     def test_patch_source_suffixes(self):
         patcher = utils.SourceSuffixesPatcher()
@@ -399,6 +622,56 @@ class UtilsTest(TestCase):
         c = await utils.read_file(filename)
         self.assertTrue(c)
 
+    @async_test
+    async def test_read_file_binary(self):
+        filename = os.path.join(TEST_DATA_DIR, 'toxicbuild.conf')
+        c = await utils.read_file(filename, binary=True)
+        self.assertIsInstance(c, bytes)
+
+    @async_test
+    async def test_read_file_does_not_block(self):
+        fd, filename = tempfile.mkstemp()
+        os.write(fd, b'a' * 50 * 1024 * 1024)
+        os.close(fd)
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        t = asyncio.ensure_future(tick())
+        try:
+            c = await utils.read_file(filename)
+        finally:
+            t.cancel()
+            os.remove(filename)
+
+        self.assertEqual(len(c), 50 * 1024 * 1024)
+        # the loop kept running while the file was read
+        self.assertGreater(ticks, 1)
+
+    @async_test
+    async def test_write_file(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            await utils.write_file(filename, 'some ')
+            await utils.write_file(filename, b'thing', append=True)
+            c = await utils.read_file(filename)
+            st = await utils.stat_file(filename)
+        finally:
+            os.remove(filename)
+
+        self.assertEqual(c, 'some thing')
+        self.assertEqual(st.st_size, 10)
+
+    @async_test
+    async def test_stat_file_does_not_exist(self):
+        with self.assertRaises(FileNotFoundError):
+            await utils.stat_file('/does/not/exist')
+
 
 class StreamUtilsTest(TestCase):
 
@@ -412,30 +685,32 @@ class StreamUtilsTest(TestCase):
         self.giant_data_with_more = self.giant_data + self.good_data
         self.data = b'{"action": "bla"}'
 
+    def _get_reader(self, data, eof=True):
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        if eof:
+            reader.feed_eof()
+        return reader
+
     @async_test
     async def test_read_stream_without_data(self):
-        reader = Mock()
-
-        async def read(limit):
-            return self.bad_data
-        reader.read = read
+        reader = self._get_reader(self.bad_data)
 
         ret = await utils.read_stream(reader)
 
         self.assertFalse(ret)
 
     @async_test
-    async def test_read_stream_good_data(self):
-        reader = Mock()
+    async def test_read_stream_connection_closed(self):
+        reader = self._get_reader(b'')
 
-        self._rlimit = 0
+        ret = await utils.read_stream(reader)
 
-        async def read(limit):
-            part = self.good_data[self._rlimit: limit + self._rlimit]
-            self._rlimit += limit
-            return part
+        self.assertFalse(ret)
 
-        reader.read = read
+    @async_test
+    async def test_read_stream_good_data(self):
+        reader = self._get_reader(self.good_data)
 
         ret = await utils.read_stream(reader)
 
@@ -443,16 +718,7 @@ class StreamUtilsTest(TestCase):
 
     @async_test
     async def test_read_stream_with_giant_data(self):
-        reader = Mock()
-
-        self._rlimit = 0
-
-        async def read(limit):
-            part = self.giant_data[self._rlimit: limit + self._rlimit]
-            self._rlimit += limit
-            return part
-
-        reader.read = read
+        reader = self._get_reader(self.giant_data)
 
         ret = await utils.read_stream(reader)
 
@@ -460,40 +726,48 @@ class StreamUtilsTest(TestCase):
 
     @async_test
     async def test_read_stream_with_good_data_in_parts(self):
-        reader = Mock()
+        reader = self._get_reader(b'', eof=False)
+
+        async def feed():
+            for i in range(0, len(self.good_data), 5):
+                await asyncio.sleep(0)
+                reader.feed_data(self.good_data[i:i + 5])
 
-        self._rlimit = 0
+        asyncio.ensure_future(feed())
+        ret = await utils.read_stream(reader, timeout=1)
 
-        async def read(limit):
-            if limit != 1:
-                limit = 10
+        self.assertEqual(ret, self.data)
 
-            part = self.good_data[self._rlimit: limit + self._rlimit]
-            self._rlimit += limit
-            return part
+    @async_test
+    async def test_read_stream_with_giant_data_with_more(self):
+        reader = self._get_reader(self.giant_data_with_more)
 
-        reader.read = read
         ret = await utils.read_stream(reader)
+        more = await utils.read_stream(reader)
 
-        self.assertEqual(ret, self.data)
+        self.assertEqual(ret, self.giant)
+        self.assertEqual(more, self.data)
 
     @async_test
-    async def test_read_stream_with_giant_data_with_more(self):
-        reader = Mock()
+    async def test_read_stream_incomplete(self):
+        reader = self._get_reader(self.good_data[:-2])
 
-        self._rlimit = 0
+        with self.assertRaises(utils.IncompleteReadError):
+            await utils.read_stream(reader)
 
-        async def read(limit):
-            part = self.giant_data_with_more[
-                self._rlimit: limit + self._rlimit]
-            self._rlimit += limit
-            return part
+    @async_test
+    async def test_read_stream_too_large(self):
+        reader = self._get_reader(self.giant_data)
 
-        reader.read = read
+        with self.assertRaises(utils.FrameTooLarge):
+            await utils.read_stream(reader, max_len=3000)
 
-        ret = await utils.read_stream(reader)
+    @async_test
+    async def test_read_stream_timeout(self):
+        reader = self._get_reader(self.good_data[:-2], eof=False)
 
-        self.assertEqual(ret, self.giant)
+        with self.assertRaises(asyncio.TimeoutError):
+            await utils.read_stream(reader, timeout=0.01)
 
     @async_test
     async def test_write_stream(self):
@@ -505,6 +779,61 @@ class StreamUtilsTest(TestCase):
         self.assertEqual(called_arg, self.good_data)
         self.assertTrue(r)
 
+    @async_test
+    async def test_write_stream_giant_data(self):
+        writer = MagicMock(drain=AsyncMock())
+        r = await utils.write_stream(writer, self.giant.decode())
+
+        written = b''.join(bytes(c[0][0])
+                           for c in writer.write.call_args_list)
+
+        self.assertEqual(written, self.giant_data)
+        self.assertEqual(writer.drain.call_count, 1)
+        self.assertTrue(r)
+
+    @async_test
+    async def test_write_stream_compressed(self):
+        writer = MagicMock(drain=AsyncMock())
+        compressor = utils.compression.get_compressor('zlib')
+        data = self.giant * 10
+        r = await utils.write_stream(writer, data, compressor=compressor)
+
+        written = b''.join(bytes(c[0][0])
+                           for c in writer.write.call_args_list)
+        reader = self._get_reader(written)
+        read = await utils.read_stream(reader)
+
+        self.assertTrue(written.split(b'\n', 1)[0].endswith(b'z'))
+        self.assertLess(len(written), len(data))
+        self.assertEqual(read, data)
+        self.assertTrue(r)
+
+    @async_test
+    async def test_write_stream_small_not_compressed(self):
+        writer = MagicMock(drain=AsyncMock())
+        compressor = utils.compression.get_compressor('zlib')
+        await utils.write_stream(writer, self.data, compressor=compressor)
+
+        called_arg = writer.write.call_args[0][0]
+
+        self.assertEqual(called_arg, self.good_data)
+
+    @async_test
+    async def test_read_stream_compressed_too_large(self):
+        data = utils.compression.zlib.compress(self.giant)
+        reader = self._get_reader(
+            '{}z\n'.format(len(data)).encode() + data)
+
+        with self.assertRaises(utils.FrameTooLarge):
+            await utils.read_stream(reader, max_len=len(data) + 10)
+
+    @async_test
+    async def test_read_stream_unknown_compression(self):
+        reader = self._get_reader(b'3x\nabc')
+
+        with self.assertRaises(ValueError):
+            await utils.read_stream(reader)
+
     @async_test
     async def test_write_stream_no_writer(self):
         writer = None
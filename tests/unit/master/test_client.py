@@ -96,6 +96,20 @@ class BuildClientTest(TestCase):
 
         self.assertEqual(expected, builders)
 
+    @async_test
+    async def test_get_step_output(self):
+        self.client.write = AsyncMock()
+        self.client.get_response = AsyncMock(return_value={
+            'code': 0, 'body': {'output': 'out', 'offset': 3, 'size': 10}})
+
+        r = await self.client.get_step_output('some-uuid', 0)
+
+        called = self.client.write.call_args[0][0]
+        self.assertEqual(called['action'], 'step_output')
+        self.assertEqual(called['body'], {'step_uuid': 'some-uuid',
+                                          'offset': 0})
+        self.assertEqual(r['offset'], 3)
+
     @mock.patch.object(build.BuildSet, 'notify', AsyncMock(
         spec=build.BuildSet.notify))
     @mock.patch.object(client, 'MAX_PROCESS_TASKS', 1)
@@ -287,6 +301,18 @@ class PollerClientTest(TestCase):
 
         self.assertIsInstance(called['branches_conf'], dict)
 
+    @async_test
+    async def test_poll_repo_since_commits(self):
+        self.client.request2server.return_value = {}
+        self.client.repo.get_latest_commits = AsyncMock(
+            return_value={'master': '123asdf'})
+        await self.client.poll_repo()
+        called = self.client.request2server.call_args[0][1]
+
+        self.assertEqual(called['since_commits'], {'master': '123asdf'})
+        self.assertIn('clone_options', called)
+        self.assertIn('poll_concurrency', called)
+
     @mock.patch.object(client, 'settings', mock.Mock(
         VALIDATE_CERT_POLLER=False))
     @async_test
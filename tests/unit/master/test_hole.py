@@ -252,6 +252,67 @@ class HoleHandlerTest(TestCase):
         with self.assertRaises(hole.UIFunctionNotFound):
             await self.handler.handle()
 
+    @async_test
+    async def test_batch(self):
+        async def my_action(**kw):
+            return {'my-action': kw}
+
+        def other_action():
+            return {'other-action': 'ok'}
+
+        self.handler.my_action = my_action
+        self.handler.other_action = other_action
+        requests = [{'action': 'my-action', 'body': {'a': 1}},
+                    {'action': 'other-action'}]
+
+        r = await self.handler.batch(requests)
+
+        expected = [{'code': 0, 'body': {'my-action': {'a': 1}}},
+                    {'code': 0, 'body': {'other-action': 'ok'}}]
+        self.assertEqual(r['batch'], expected)
+
+    @async_test
+    async def test_batch_with_error(self):
+        async def my_action():
+            raise hole.NotEnoughPerms
+
+        self.handler.my_action = my_action
+        requests = [{'action': 'my-action', 'body': {}},
+                    {'action': 'list-funcs', 'body': {}}]
+
+        r = await self.handler.batch(requests)
+
+        self.assertEqual(r['batch'][0]['code'], 3)
+        self.assertIn('error', r['batch'][0]['body'])
+        self.assertEqual(r['batch'][1]['code'], 0)
+
+    @async_test
+    async def test_batch_nested(self):
+        requests = [{'action': 'batch', 'body': {'requests': []}}]
+
+        r = await self.handler.batch(requests)
+
+        self.assertEqual(r['batch'][0]['code'], 1)
+
+    @async_test
+    async def test_batch_bad_requests(self):
+        requests = ['bla', {'body': {}}, {'action': 'list-funcs', 'a': 1},
+                    {'action': '_get_action_methods'},
+                    {'action': 'list-funcs'}]
+
+        r = await self.handler.batch(requests)
+
+        self.assertEqual([resp['code'] for resp in r['batch']],
+                         [1, 1, 1, 1, 0])
+
+    @patch.object(hole, 'MAX_BATCH_REQUESTS', 1)
+    @async_test
+    async def test_batch_too_many_requests(self):
+        requests = [{'action': 'list-funcs'}, {'action': 'list-funcs'}]
+
+        with self.assertRaises(ValueError):
+            await self.handler.batch(requests)
+
     def test_user_is_allowed_not_allowed(self):
         self.handler.protocol.user.allowed_actions = []
         self.handler.protocol.user.is_superuser = False
@@ -1843,6 +1904,16 @@ class HoleServerTest(TestCase):
         self.server.serve()
         self.assertTrue(loop.create_server.called)
 
+    @patch.object(hole, 'MetricsHTTPServer', Mock())
+    @patch.object(hole, 'ensure_future', Mock())
+    def test_serve_metrics(self):
+        loop = MagicMock(create_server=Mock())
+        self.server.loop = loop
+        self.server.metrics_port = 9999
+        self.server.serve()
+        hole.MetricsHTTPServer.assert_called_with('127.0.0.1', 9999)
+        self.assertEqual(hole.ensure_future.call_count, 2)
+
     @patch.object(hole.ssl, 'create_default_context', MagicMock(
         spec=hole.ssl.create_default_context))
     @patch.object(hole.asyncio, 'get_event_loop', Mock())
@@ -383,6 +383,33 @@ class RepositoryTest(TestCase, RepoTestData):
         self.assertEqual(revs['master'].commit, '123asdf1')
         self.assertEqual(revs['dev'].commit, '123asdf1')
 
+    def test_get_clone_options(self):
+        self.repo.clone_depth = 10
+        self.repo.sparse_paths = ['some/dir']
+
+        options = self.repo.get_clone_options()
+
+        self.assertEqual(options, {'depth': 10, 'filter': None,
+                                   'sparse_paths': ['some/dir']})
+
+    @async_test
+    async def test_get_latest_commits(self):
+        commits = await self.repo.get_latest_commits()
+
+        self.assertEqual(commits, {'master': '123asdf1',
+                                   'dev': '123asdf1'})
+
+    @async_test
+    async def test_get_latest_commits_last_added(self):
+        # the last one added is returned, no matter the commit date
+        await self.repo.add_revision(
+            'master', 'old-commit', datetime.datetime(2000, 1, 1),
+            'someone', 'old commit')
+        commits = await self.repo.get_latest_commits()
+
+        self.assertEqual(commits, {'master': 'old-commit',
+                                   'dev': '123asdf1'})
+
     @async_test
     async def test_get_known_branches(self):
         expected = ['master', 'dev']
@@ -17,12 +17,21 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 from unittest.mock import Mock, MagicMock, patch, AsyncMock
 from uuid import uuid4
+from toxicbuild.core import utils
 from toxicbuild.core.utils import datetime2string
 from toxicbuild.master import slave, build, repository, users
+# creates the slave settings
+from tests.unit import slave as slave_tests  # noqa: F401
+from toxicbuild.slave import (build as slave_build,
+                              protocols as slave_protocols)
 from tests import async_test
 
 
@@ -104,6 +113,39 @@ class SlaveTest(TestCase):
         client = await self.slave.get_client()
         self.assertTrue(client.connect.called)
 
+    @async_test
+    async def test_get_step_output(self):
+        # A real build server, so the output is read in many pieces
+        # and each piece uses a new connection.
+        step_uuid = str(uuid4())
+        outdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, outdir)
+        with open(os.path.join(outdir, '{}.log'.format(step_uuid)),
+                  'w') as fd:
+            fd.write('some step output')
+
+        loop = asyncio.get_event_loop()
+        token = utils.bcrypt_string(self.slave.token, utils.bcrypt.gensalt(4))
+        with patch.object(slave_build, 'get_step_output_dir',
+                          Mock(return_value=outdir)), \
+                patch.object(slave_protocols, 'READ_LEN', 5), \
+                patch.object(slave_protocols.BuildServerProtocol,
+                             'encrypted_token', token):
+            server = await loop.create_server(
+                lambda: slave_protocols.BuildServerProtocol(loop),
+                '127.0.0.1', 0)
+            try:
+                self.slave.port = server.sockets[0].getsockname()[1]
+                self.slave.use_ssl = False
+                output = [o async for o in
+                          self.slave.get_step_output(step_uuid)]
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.assertEqual(len(output), 4)
+        self.assertEqual(''.join(output), 'some step output')
+
     @async_test
     async def test_healthcheck(self):
 
@@ -424,6 +466,7 @@ class SlaveTest(TestCase):
         self.assertEqual(b.steps[1].status, 'success')
         self.assertEqual(len(b.steps), 2)
         self.assertTrue(b.steps[1].total_time)
+        self.assertFalse(b.steps[1].output_truncated)
         self.assertTrue(build.notifications.publish.called)
 
     @patch.object(build.notifications, 'publish', AsyncMock(
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from unittest import TestCase
+
+from toxicbuild.poller import limiter
+
+from tests import async_test
+
+
+class PollLimiterTest(TestCase):
+
+    def setUp(self):
+        self.limiter = limiter.PollLimiter(3, per_host_limit=2)
+        self.running = []
+        self.max_running = 0
+        self.order = []
+
+    async def _poll(self, host):
+        async with self.limiter.slot(host):
+            self.order.append(host)
+            self.running.append(host)
+            self.max_running = max(self.max_running, len(self.running))
+            await asyncio.sleep(0.01)
+            self.running.remove(host)
+
+    @async_test
+    async def test_slot_limit(self):
+        await asyncio.gather(*[self._poll('h{}'.format(i))
+                               for i in range(6)])
+
+        self.assertEqual(self.max_running, 3)
+        self.assertEqual(self.limiter.running, 0)
+        self.assertEqual(self.limiter.waiting, 0)
+
+    @async_test
+    async def test_slot_per_host_limit(self):
+        await asyncio.gather(*[self._poll('github.com') for i in range(4)])
+
+        self.assertEqual(self.max_running, 2)
+
+    @async_test
+    async def test_slot_hosts_take_turns(self):
+        polls = [self._poll('github.com') for i in range(6)]
+        polls += [self._poll('gitlab.com'), self._poll('bitbucket.org')]
+
+        await asyncio.gather(*polls)
+
+        # the other hosts don't wait for all the github.com polls
+        self.assertLess(self.order.index('bitbucket.org'), 5)
+        self.assertLess(self.order.index('gitlab.com'), 5)
+
+    @async_test
+    async def test_slot_cancelled_while_waiting(self):
+        self.limiter = limiter.PollLimiter(1)
+        first = asyncio.ensure_future(self._poll('github.com'))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(self._poll('github.com'))
+        await asyncio.sleep(0)
+
+        second.cancel()
+        await first
+
+        self.assertEqual(self.order, ['github.com'])
+        self.assertEqual(self.limiter.running, 0)
+        self.assertEqual(self.limiter.waiting, 0)
+
+    @async_test
+    async def test_slot_exception(self):
+        async def poll():
+            async with self.limiter.slot('github.com'):
+                raise Exception('bla')
+
+        with self.assertRaises(Exception):
+            await poll()
+
+        self.assertEqual(self.limiter.running, 0)
@@ -136,9 +136,6 @@ class PollerTest(TestCase):
         self.assertFalse(r['with_clone'])
         self.assertEqual(len(self.poller.log.call_args_list), 1)
 
-    @patch.object(poller, 'read_file', AsyncMock(
-        spec=poller.read_file, side_effect=['config', FileNotFoundError]))
-    @patch('toxicbuild.core.vcs.Git.checkout', AsyncMock())
     @async_test
     async def test_process_changes(self):
         # now in the future, of course!a
@@ -156,10 +153,53 @@ class PollerTest(TestCase):
                          'author': 'jc', 'title': 'Our lord John Cleese'}]}
 
         self.poller.vcs.get_revisions = AsyncMock(return_value=revs)
+        self.poller.vcs.get_file_contents = AsyncMock(
+            return_value={'asdf213': 'config'})
+        self.poller.vcs.checkout = AsyncMock()
         r = await self.poller.process_changes()
         self.assertTrue(r)
         self.assertTrue(r[0]['config'])
         self.assertFalse(r[1]['config'])
+        self.assertEqual(self.poller.vcs.get_file_contents.call_args[0],
+                         ('toxicbuild.yml', ['asdf213', 'sdlfjslfer3']))
+        self.assertFalse(self.poller.vcs.checkout.called)
+
+    @async_test
+    async def test_process_changes_since_commits(self):
+        self.poller.since_commits = {'master': '123sdf'}
+        self.poller.vcs.get_revisions = AsyncMock(return_value={})
+
+        await self.poller.process_changes()
+
+        kw = self.poller.vcs.get_revisions.call_args[1]
+        self.assertEqual(kw['since_commits'], {'master': '123sdf'})
+        self.assertIn('max_count', kw)
+        self.assertIn('concurrency', kw)
+
+    @patch.object(poller, 'settings', Mock(SOURCE_CODE_DIR='.',
+                                           POLL_CONCURRENCY=3))
+    def test_concurrency_default(self):
+        p = poller.Poller('repo-id', 'https://repo.url/', {}, {}, [], 'git')
+        self.assertEqual(p.concurrency, 3)
+
+    @patch.object(poller, 'settings', Mock(SOURCE_CODE_DIR='.',
+                                           POLL_CONCURRENCY=3))
+    def test_concurrency_repo(self):
+        p = poller.Poller('repo-id', 'https://repo.url/', {}, {}, [], 'git',
+                          concurrency=8)
+        self.assertEqual(p.concurrency, 8)
+
+    @patch.object(poller, 'settings', Mock(MAX_REVISIONS_PER_BRANCH=10))
+    def test_get_max_count(self):
+        self.poller.branches_conf = {
+            'master': {'notify_only_latest': True},
+            'feature-*': {'notify_only_latest': False}}
+
+        max_count = self.poller._get_max_count()
+
+        self.assertEqual(max_count.get('master'), 1)
+        self.assertEqual(max_count.get('feature-bla'), 10)
+        self.assertEqual(max_count.get('other'), 1)
 
     @async_test
     async def test_process_changes_no_revisions(self):
@@ -173,9 +213,6 @@ class PollerTest(TestCase):
 
         self.assertFalse(r)
 
-    @patch.object(poller, 'read_file', AsyncMock(spec=poller.read_file,
-                                                 return_value='config'))
-    @patch('toxicbuild.core.vcs.Git.checkout', AsyncMock())
     @async_test
     async def test_process_changes_local_branch(self):
         now = datetime.datetime.now() + datetime.timedelta(100)
@@ -193,6 +230,8 @@ class PollerTest(TestCase):
                          'author': 'jc', 'title': 'Our lord John Cleese'}]}
 
         self.poller.vcs.get_local_revisions = AsyncMock(return_value=revs)
+        self.poller.vcs.get_file_contents = AsyncMock(
+            return_value={'asdf213': 'config'})
         r = await self.poller.process_changes()
         self.assertTrue(r)
         self.assertTrue(r[0]['config'])
@@ -17,6 +17,7 @@
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import gc
 from datetime import datetime
 from unittest import TestCase
 from unittest.mock import patch, Mock, AsyncMock
@@ -79,6 +80,31 @@ class PollerProtocolTest(TestCase):
 
         self.assertTrue(server.Poller.poll.called)
 
+    @patch.object(server, 'Poller', Mock(spec=server.Poller))
+    @patch('toxicbuild.poller.server.PollerProtocol.log', Mock())
+    @async_test
+    async def test_poll_repo_since_commits(self):
+        server.Poller.return_value.poll = AsyncMock()
+        self.poller_server.data = {
+            'body': {
+                'repo_id': 'some-id',
+                'url': 'https://some.where/repo',
+                'vcs_type': 'git',
+                'since_commits': {'master': '123asdf'},
+                'clone_options': {'depth': 10},
+                'poll_concurrency': 2,
+                'known_branches': ['master'],
+                'branches_conf': {'master': {'notify_only_latest': True}},
+            }
+        }
+
+        await self.poller_server.poll_repo()
+
+        kw = server.Poller.call_args[1]
+        self.assertEqual(kw['since_commits'], {'master': '123asdf'})
+        self.assertEqual(kw['clone_options'], {'depth': 10})
+        self.assertEqual(kw['concurrency'], 2)
+
     @patch.object(server.Poller, 'poll', AsyncMock(
         spec=server.Poller.poll))
     @patch('toxicbuild.poller.poller.settings', Mock(SOURCE_CODE_DIR='.'))
@@ -129,3 +155,140 @@ class PollerProtocolTest(TestCase):
         await self.poller_server.poll_repo()
 
         self.assertTrue(server.Poller.external_poll.called)
+
+    @patch('toxicbuild.poller.poller.settings', Mock(SOURCE_CODE_DIR='.'))
+    @patch('toxicbuild.poller.server.PollerProtocol.log', Mock())
+    @async_test
+    async def test_poll_repo_coalesced(self):
+        calls = []
+
+        async def poll(*a, **kw):
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'revisions': [{'commit': '123asdf'}]}
+
+        body = {'repo_id': 'some-id',
+                'url': 'https://some.where/repo',
+                'vcs_type': 'git',
+                'known_branches': ['master'],
+                'branches_conf': {'master': {'notify_only_latest': True}}}
+        protocols = []
+        for i in range(3):
+            protocol = server.PollerProtocol(self.loop)
+            protocol.data = {'body': body}
+            protocols.append(protocol)
+
+        with patch.object(server.Poller, 'poll', poll):
+            r = await asyncio.gather(*[p.poll_repo() for p in protocols])
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(r[0]['revisions']), 1)
+        self.assertFalse(r[1]['revisions'])
+        self.assertTrue(r[1]['coalesced'])
+        self.assertFalse(server._PENDING_POLLS)
+
+    @patch('toxicbuild.poller.poller.settings', Mock(SOURCE_CODE_DIR='.'))
+    @patch('toxicbuild.poller.server.PollerProtocol.log', Mock())
+    @async_test
+    async def test_poll_repo_after_poll_started(self):
+        calls = []
+
+        async def poll(*a, **kw):
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'revisions': [{'commit': '123asdf'}]}
+
+        body = {'repo_id': 'some-id',
+                'url': 'https://some.where/repo',
+                'vcs_type': 'git',
+                'known_branches': ['master'],
+                'branches_conf': {'master': {'notify_only_latest': True}}}
+        first = server.PollerProtocol(self.loop)
+        first.data = {'body': body}
+        second = server.PollerProtocol(self.loop)
+        second.data = {'body': body}
+
+        with patch.object(server.Poller, 'poll', poll):
+            t = asyncio.ensure_future(first.poll_repo())
+            await asyncio.sleep(0.001)
+            # the first one is running so this must poll again.
+            r = await second.poll_repo()
+            await t
+
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(r['revisions'])
+
+    def test_get_poll_key(self):
+        key = self.poller_server._get_poll_key(
+            {'repo_id': 'some-id', 'branches_conf': {'a': 1, 'b': 2},
+             'known_branches': ['a', 'b']})
+        other = self.poller_server._get_poll_key(
+            {'repo_id': 'some-id', 'branches_conf': {'b': 2, 'a': 1},
+             'known_branches': ['b', 'a']})
+
+        self.assertEqual(key, other)
+
+    def test_get_poll_key_different_state(self):
+        body = {'repo_id': 'some-id', 'branches_conf': {'a': 1},
+                'known_branches': ['a'], 'since_commits': {'a': '123'}}
+        key = self.poller_server._get_poll_key(body)
+        other = self.poller_server._get_poll_key(
+            dict(body, since_commits={'a': '456'}))
+
+        self.assertNotEqual(key, other)
+
+    @patch('toxicbuild.poller.poller.settings', Mock(SOURCE_CODE_DIR='.'))
+    @patch('toxicbuild.poller.server.PollerProtocol.log', Mock())
+    @async_test
+    async def test_poll_repo_not_coalesced_different_state(self):
+        calls = []
+
+        async def poll(*a, **kw):
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {'revisions': [{'commit': '123asdf'}]}
+
+        body = {'repo_id': 'some-id',
+                'url': 'https://some.where/repo',
+                'vcs_type': 'git',
+                'known_branches': ['master'],
+                'branches_conf': {'master': {'notify_only_latest': True}}}
+        first = server.PollerProtocol(self.loop)
+        first.data = {'body': body}
+        second = server.PollerProtocol(self.loop)
+        second.data = {'body': dict(body, known_branches=[])}
+
+        with patch.object(server.Poller, 'poll', poll):
+            r = await asyncio.gather(first.poll_repo(), second.poll_repo())
+
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(r[0]['revisions'])
+        self.assertTrue(r[1]['revisions'])
+
+    @patch('toxicbuild.poller.poller.settings', Mock(SOURCE_CODE_DIR='.'))
+    @patch('toxicbuild.poller.server.PollerProtocol.log', Mock())
+    @async_test
+    async def test_poll_repo_lock_removed(self):
+        self.poller_server.data = {
+            'body': {'repo_id': 'lock-id',
+                     'url': 'https://some.where/repo',
+                     'vcs_type': 'git',
+                     'known_branches': [],
+                     'branches_conf': {}}}
+
+        with patch.object(server.Poller, 'poll', AsyncMock(return_value={
+                'revisions': []})):
+            await self.poller_server.poll_repo()
+
+        gc.collect()
+        self.assertNotIn('lock-id', server._REPO_LOCKS)
+
+    @patch.object(server, '_LIMITER', None)
+    @patch.object(server, 'settings', Mock(MAX_CONCURRENT_POLLS=3,
+                                           MAX_CONCURRENT_POLLS_PER_HOST=1))
+    def test_get_limiter(self):
+        limiter = server.get_limiter()
+
+        self.assertEqual(limiter.limit, 3)
+        self.assertEqual(limiter.per_host_limit, 1)
+        self.assertIs(server.get_limiter(), limiter)
@@ -19,6 +19,8 @@
 
 import asyncio
 import os
+import shutil
+import tempfile
 from unittest import mock, TestCase
 from unittest.mock import AsyncMock
 import yaml
@@ -125,7 +127,7 @@ class BuilderTest(TestCase):
         self.builder.manager.send_info = send_info
         self.builder._current_step_output_index = 1
         await self.builder._send_step_output_info(step_info,
-                                                  0, 'some line' * 1024)
+                                                  0, ['some line' * 1024])
         self.assertTrue(send_mock.called)
 
     @async_test
@@ -139,7 +141,7 @@ class BuilderTest(TestCase):
 
         self.builder.manager.send_info = send_info
         await self.builder._send_step_output_info(step_info,
-                                                  0, 'some line' * 1024)
+                                                  0, ['some line' * 1024])
         self.assertTrue(send_mock.called)
 
     @async_test
@@ -154,9 +156,30 @@ class BuilderTest(TestCase):
         self.builder.STEP_OUTPUT_BUFF_LEN = 512
         self.builder.manager.send_info = send_info
         await self.builder._send_step_output_info(step_info,
-                                                  0, 'some line')
+                                                  0, ['some line'])
         self.assertFalse(send_mock.called)
 
+    @mock.patch.object(build, 'settings', mock.Mock())
+    def test_get_step_output_buffer(self):
+        output_dir = tempfile.mkdtemp()
+        build.settings.STEP_OUTPUT_DIR = output_dir
+        try:
+            output = self.builder._get_step_output_buffer('some-uuid')
+            self.assertEqual(output.spill_path,
+                             os.path.join(output_dir, 'some-uuid.log'))
+        finally:
+            shutil.rmtree(output_dir)
+
+    @mock.patch.object(build, 'remove_old_outputs', mock.Mock())
+    @mock.patch.object(build, 'settings', mock.Mock())
+    def test_remove_old_step_outputs(self):
+        build.settings.STEP_OUTPUT_DIR = '/some/dir'
+        build.settings.STEP_OUTPUT_MAX_AGE = 10
+
+        self.builder._remove_old_step_outputs()
+
+        build.remove_old_outputs.assert_called_with('/some/dir', 10)
+
     @async_test
     async def test_get_env_vars(self):
         pconfig = [{'name': 'python-venv', 'pyversion': '/usr/bin/python3.4'}]
@@ -274,6 +297,32 @@ class BuildStepTest(TestCase):
         status = await step.execute(cwd='.')
         self.assertEqual(status['status'], 'warning')
 
+    @async_test
+    async def test_step_output_truncated(self):
+        step = build.BuildStep(name='test', command='seq 1 10000')
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        output = build.OutputBuffer(head_len=10, tail_len=10,
+                                    spill_path=path)
+        try:
+            with output:
+                status = await step.execute(cwd='.', output_buffer=output)
+
+            with open(path) as fd:
+                full = fd.read()
+        finally:
+            os.remove(path)
+
+        self.assertTrue(status['output_truncated'])
+        self.assertLess(len(status['output']), 100)
+        self.assertEqual(full.splitlines()[-1], '10000')
+
+    @async_test
+    async def test_step_output_not_truncated(self):
+        step = build.BuildStep(name='test', command='ls')
+        status = await step.execute(cwd='.')
+        self.assertFalse(status['output_truncated'])
+
     def test_equal_with_other_object(self):
         """ Ensure that one step is not equal something that is not a step"""
 
@@ -294,3 +343,21 @@ class BuildStepTest(TestCase):
         status = await step.execute(cwd='.')
         self.assertEqual(status['status'], 'warning')
         await asyncio.sleep(1)
+
+
+class StepOutputPathTest(TestCase):
+
+    @mock.patch.object(build, 'settings', mock.Mock())
+    def test_get_step_output_path(self):
+        build.settings.STEP_OUTPUT_DIR = '/some/dir'
+
+        path = build.get_step_output_path('../../etc/passwd')
+
+        self.assertEqual(path, '/some/dir/passwd.log')
+
+    @mock.patch.object(build, 'settings', None)
+    def test_get_step_output_dir_default(self):
+        output_dir = build.get_step_output_dir()
+
+        self.assertEqual(os.path.basename(output_dir),
+                         'toxicbuild-step-output')
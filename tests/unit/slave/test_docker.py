@@ -113,17 +113,23 @@ class DockerContainerBuilderManagerTest(TestCase):
         self.assertFalse(self.container.rm_container.called)
         self.assertTrue(self.container.rm_from_container.called)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock(return_value='1'))
+    @patch.object(docker, 'exec_argv', AsyncMock(return_value=''))
     @async_test
     async def test_container_exisits_do_not_exist(self):
         exists = await self.container.container_exists()
         self.assertFalse(exists)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock(return_value='2'))
+    @patch.object(docker, 'exec_argv', AsyncMock(return_value='a1b2c3'))
     @async_test
     async def test_container_exisits(self):
         exists = await self.container.container_exists()
         self.assertTrue(exists)
+        called = docker.exec_argv.call_args[0][0]
+        self.assertEqual(called, ['docker', 'container', 'ps', '-a', '-q',
+                                  '--filter',
+                                  'name={}'.format(self.container.cname)])
+        self.assertIs(docker.exec_argv.call_args[1]['env'],
+                      self.container.host_env)
 
     @async_test
     async def test_is_running(self):
@@ -131,13 +137,13 @@ class DockerContainerBuilderManagerTest(TestCase):
         r = await self.container.is_running()
         self.assertTrue(r)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock(side_effect=Exception))
+    @patch.object(docker, 'exec_argv', AsyncMock(side_effect=Exception))
     @async_test
     async def test_service_is_up_false(self):
         r = await self.container.service_is_up()
         self.assertIs(r, False)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_service_is_up_true(self):
         r = await self.container.service_is_up()
@@ -162,38 +168,38 @@ class DockerContainerBuilderManagerTest(TestCase):
     def test_get_dind_opts_not_dind(self):
         self.container._is_dind = False
         opts = self.container._get_dind_opts()
-        self.assertFalse(opts.strip())
+        self.assertEqual(opts, [])
 
     def test_get_dind_opts_no_volume(self):
         self.container._is_dind = True
         self.container._dind_volume = False
         self.container.manager.repo_id = 'i'
         opts = self.container._get_dind_opts()
-        e = '--privileged '
+        e = ['--privileged']
         self.assertEqual(opts, e)
 
     def test_get_dind_opts(self):
         self.container._is_dind = True
         self.container.manager.repo_id = 'i'
         opts = self.container._get_dind_opts()
-        e = '--privileged --mount source=i-b1-volume,'\
-            'destination=/var/lib/docker/'
+        e = ['--privileged', '--mount',
+             'source=i-b1-volume,destination=/var/lib/docker/']
         self.assertEqual(opts, e)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_start_container_dont_exists(self):
         self.container.wait_start = AsyncMock()
         self.container.container_exists = AsyncMock(return_value=False)
-        expected = 'docker run -d -t   --name {} my-image'.format(
-            self.container.cname)
+        expected = ['docker', 'run', '-d', '-t', '--name',
+                    self.container.cname, 'my-image']
         await self.container.start_container()
-        called = docker.exec_cmd.call_args[0][0]
+        called = docker.exec_argv.call_args[0][0]
 
         self.assertEqual(expected, called)
         self.assertTrue(self.container.wait_start.called)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_start_container_dont_exists_privileged(self):
         self.container.wait_start = AsyncMock()
@@ -201,71 +207,71 @@ class DockerContainerBuilderManagerTest(TestCase):
         self.container._is_dind = True
         self.container.manager.repo_id = 'repo_id'
         self.container.container_exists = AsyncMock(return_value=False)
-        mount = '--mount source=repo_id-b1-volume,destination=/var/lib/docker/'
-        exp = 'docker run -d -t --privileged {} --name {} my-image'.format(
-            mount, self.container.cname)
+        mount = 'source=repo_id-b1-volume,destination=/var/lib/docker/'
+        exp = ['docker', 'run', '-d', '-t', '--privileged', '--mount', mount,
+               '--name', self.container.cname, 'my-image']
         await self.container.start_container()
-        called = docker.exec_cmd.call_args[0][0]
+        called = docker.exec_argv.call_args[0][0]
 
         self.assertEqual(exp, called)
         self.assertTrue(self.container.wait_start.called)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_start_container(self):
         self.container.container_exists = AsyncMock(return_value=True)
         self.container.wait_start = AsyncMock()
-        expected = 'docker start {}'.format(self.container.cname)
+        expected = ['docker', 'start', self.container.cname]
         await self.container.start_container()
-        called = docker.exec_cmd.call_args[0][0]
+        called = docker.exec_argv.call_args[0][0]
 
         self.assertEqual(expected, called)
         self.assertTrue(self.container.wait_start.called)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_kill_container(self):
-        expected = 'docker kill {}'.format(self.container.cname)
+        expected = ['docker', 'kill', self.container.cname]
         await self.container.kill_container()
-        called = docker.exec_cmd.call_args[0][0]
+        called = docker.exec_argv.call_args[0][0]
 
         self.assertEqual(expected, called)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_copy2container(self):
-        expected = 'docker cp source {}:/home/bla/src'.format(
-            self.container.cname)
+        expected = ['docker', 'cp', 'source',
+                    '{}:/home/bla/src'.format(self.container.cname)]
 
         src_dir = '/home/bla/src'
-        exp_chown = 'docker exec -u root -t {} chown -R bla:bla {}'.format(
-            self.container.cname, src_dir)
+        exp_chown = ['docker', 'exec', '-u', 'root', '-t',
+                     self.container.cname, 'chown', '-R', 'bla:bla', src_dir]
 
         await self.container.copy2container()
-        called = docker.exec_cmd.call_args_list[0][0][0]
-        called_chown = docker.exec_cmd.call_args_list[1][0][0]
+        called = docker.exec_argv.call_args_list[0][0][0]
+        called_chown = docker.exec_argv.call_args_list[1][0][0]
 
         self.assertEqual(expected, called)
         self.assertEqual(exp_chown, called_chown)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_rm_from_container(self):
         src_dir = '/home/bla/src'
-        expected_source = 'docker exec -u root {} rm -rf {}'.format(
-            self.container.cname, src_dir)
+        expected_source = ['docker', 'exec', '-u', 'root',
+                           self.container.cname, 'rm', '-rf', src_dir]
 
         await self.container.rm_from_container()
-        called_source = docker.exec_cmd.call_args_list[0][0][0]
+        called_source = docker.exec_argv.call_args_list[0][0][0]
 
         self.assertEqual(expected_source, called_source)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock())
+    @patch.object(docker, 'exec_argv', AsyncMock())
     @async_test
     async def test_rm_container(self):
-        expected = 'docker rm {}'.format(self.container.cname)
+        expected = ['docker', 'rm', self.container.cname]
         await self.container.rm_container()
-        called = docker.exec_cmd.call_args[0][0]
+        called = docker.exec_argv.call_args[0][0]
         self.assertEqual(expected, called)
 
     @patch.object(docker, 'settings', Mock())
@@ -293,7 +299,7 @@ class BuildStepDockerTest(TestCase):
         self.step = docker.BuildStepDocker('cmd', 'sh cmd.sh',
                                            container_name='container')
 
-    @patch.object(docker, 'exec_cmd', AsyncMock(return_value=DOCKER_ENV))
+    @patch.object(docker, 'exec_argv', AsyncMock(return_value=DOCKER_ENV))
     @async_test
     async def test_get_cmd_line_envvars(self):
         expected = 'export VAR=bla'
@@ -330,10 +336,15 @@ class BuildStepDockerTest(TestCase):
 
         self.assertEqual(docker_step.command, step.command)
 
-    @patch.object(docker, 'exec_cmd', AsyncMock(return_value=DOCKER_ENV))
+    @patch.object(docker, 'exec_argv', AsyncMock(return_value=DOCKER_ENV))
     @async_test
     async def test_get_docker_env(self):
         env = await self.step._get_docker_env()
 
+        called = docker.exec_argv.call_args[0][0]
+        self.assertEqual(called, ['docker', 'exec', '-u', 'bla', 'container',
+                                  '/bin/bash', '-c',
+                                  'cd /home/bla/src && env'])
+
         self.assertTrue(env['PATH'])
         self.assertFalse(env['PATH'].endswith('\r'))
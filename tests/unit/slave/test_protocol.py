@@ -18,6 +18,8 @@
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import os
+import tempfile
 from unittest import mock, TestCase
 from unittest.mock import AsyncMock
 from toxicbuild.slave import protocols
@@ -90,6 +92,13 @@ class ProtocolTest(TestCase):
         builder = await self.protocol.get_buildmanager()
         self.assertTrue(builder)
 
+    @async_test
+    async def test_get_buildmanager_clone_options(self):
+        self.protocol.data = await self.protocol.get_json_data()
+        self.protocol.data['body']['clone_options'] = {'depth': 10}
+        manager = await self.protocol.get_buildmanager()
+        self.assertEqual(manager.vcs.clone_options, {'depth': 10})
+
     @async_test
     async def test_get_buildmanager_with_bad_data(self):
         self.protocol.data = await self.protocol.get_json_data()
@@ -163,6 +172,41 @@ class ProtocolTest(TestCase):
 
         self.assertEqual(self.response, expected)
 
+    @async_test
+    async def test_step_output(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, b'some output')
+        os.close(fd)
+        self.protocol.data = {'body': {'step_uuid': 'some-uuid',
+                                       'offset': 5}}
+        try:
+            with mock.patch.object(protocols, 'get_step_output_path',
+                                   mock.Mock(return_value=path)):
+                await self.protocol.step_output()
+        finally:
+            os.remove(path)
+
+        expected = {'code': 0, 'body': {'output': 'output', 'offset': 11,
+                                        'size': 11}}
+        self.assertEqual(self.response, expected)
+
+    @mock.patch.object(protocols, 'get_step_output_path', mock.Mock(
+        return_value='/does/not/exist.log'))
+    @async_test
+    async def test_step_output_no_output(self):
+        self.protocol.data = {'body': {'step_uuid': 'some-uuid'}}
+
+        await self.protocol.step_output()
+
+        self.assertEqual(self.response['code'], 1)
+
+    @async_test
+    async def test_step_output_bad_data(self):
+        self.protocol.data = {'body': {}}
+
+        with self.assertRaises(protocols.BadData):
+            await self.protocol.step_output()
+
     @mock.patch.object(protocols, 'log', mock.Mock())
     @async_test
     async def test_client_connected_with_bad_data(self):
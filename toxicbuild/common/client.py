@@ -69,10 +69,33 @@ class HoleClient(BaseToxicClient, LoggerMixin):
         if action not in ['user-authenticate']:
             data['user_id'] = str(self.requester.id)
 
-        await self.write(data)
-        response = await self.get_response()
+        response = await self.send_request(data)
         return response['body'][action]
 
+    async def batch(self, requests):
+        """Performs many actions in only one request to the hole
+        server. Returns a list with the results of the actions in the
+        same order of the requests. When an action fails its exception
+        is returned in place of the result.
+
+        :param requests: A list of ``(action, body)`` tuples.
+        """
+
+        body = {'requests': [{'action': action, 'body': action_body}
+                             for action, action_body in requests]}
+        responses = await self.request2server('batch', body)
+
+        results = []
+        for (action, _), response in zip(requests, responses):
+            try:
+                self.check_response(response)
+            except Exception as e:
+                results.append(e)
+            else:
+                results.append(response['body'][action])
+
+        return results
+
     async def connect2stream(self, body):
         """Connects the client to the master's hole stream."""
 
@@ -82,9 +105,7 @@ class HoleClient(BaseToxicClient, LoggerMixin):
 
         await self.request2server(action, body)
 
-    async def get_response(self):
-        response = await self.read()
-
+    def check_response(self, response):
         excs = {1: ToxicClientException,
                 2: UserDoesNotExist,
                 3: NotEnoughPerms,
@@ -230,6 +230,21 @@ class BaseHoleInterface(BaseInterface):
         client = await get_hole_client(requester, **client_settings)
         return client
 
+    @classmethod
+    async def batch(cls, requester, requests):
+        """Performs many requests to the master in only one round
+        trip. Returns a list with the results in the same order of the
+        requests. A failed request has its exception in place of the
+        result.
+
+        :param requester: The user who is requesting the operations.
+        :param requests: A list of ``(action, body)`` tuples, ie:
+          ``[('repo-list', {}), ('slave-list', {})]``."""
+
+        with await cls.get_client(requester) as client:
+            results = await client.batch(requests)
+        return results
+
 
 class UserInterface(BaseHoleInterface):
     """A user created in the master"""
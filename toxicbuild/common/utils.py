@@ -59,6 +59,17 @@ def format_datetime(dt, dtformat, tzname=None):
     return datetime2string(dt, dtformat=dtformat)
 
 
+def get_connection_pool_settings(settings):
+    """Returns the named arguments for the connection pools used by the
+    clients. See :class:`~toxicbuild.core.client.ConnectionPool`."""
+
+    return {'max_size': getattr(settings, 'CONNECTION_POOL_MAX_SIZE', 10),
+            'idle_timeout': getattr(settings,
+                                    'CONNECTION_POOL_IDLE_TIMEOUT', 60),
+            'response_timeout': getattr(
+                settings, 'CONNECTION_POOL_RESPONSE_TIMEOUT', 300)}
+
+
 def get_hole_client_settings(settings):
     """Returns the settings that must be used by the hole client"""
     host = settings.HOLE_HOST
@@ -74,7 +85,11 @@ def get_hole_client_settings(settings):
     except AttributeError:
         validate_cert = False
 
+    use_pool = getattr(settings, 'USE_CONNECTION_POOL', False)
+
     return {'host': host, 'port': port,
             'use_ssl': use_ssl,
             'validate_cert': validate_cert,
+            'use_pool': use_pool,
+            'pool_kw': get_connection_pool_settings(settings),
             'hole_token': token}
@@ -18,16 +18,20 @@
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
-from collections import OrderedDict
-import json
+from asyncio import ensure_future
+from itertools import count
 import ssl
+import time
 import traceback
-from toxicbuild.core import utils
+from toxicbuild.core import codecs, compression, utils
 from toxicbuild.core.exceptions import ToxicClientException, BadJsonData
 
 
 __doc__ = """This module implements a base client for basic
-tcp communication, reading and writing json data.
+tcp communication, reading and writing json data. If both sides support
+a faster codec it is used instead of json. See
+:mod:`toxicbuild.core.codecs`. Big messages are compressed when the
+server supports it. See :mod:`toxicbuild.core.compression`.
 
 Usage:
 ``````
@@ -40,6 +44,19 @@ Usage:
         await client.write({'hello': 'world'})
         json_response = await client.get_response()
 
+Using a multiplexed connection many requests may be done concurrently
+through the same connection:
+
+.. code-block:: python
+
+    async with BaseToxicClient(host, port, multiplex=True) as client:
+        r = await asyncio.gather(
+            client.request2server('some-action', {}, token),
+            client.request2server('other-action', {}, token))
+
+With ``use_pool=True`` the client borrows a multiplexed connection from
+a :class:`~toxicbuild.core.client.ConnectionPool` when connecting and gives
+it back to the pool when disconnecting, so connections are reused.
 """
 
 
@@ -47,23 +64,50 @@ class BaseToxicClient(utils.LoggerMixin):
 
     """ Base client for communication with toxicbuild servers. """
 
+    # The max length of the messages sent by the server. None means
+    # no limit.
+    max_frame_len = None
+
     def __init__(self, host, port, use_ssl=False,
-                 validate_cert=True, **ssl_kw):
+                 validate_cert=True, multiplex=False, use_pool=False,
+                 pool_kw=None, **ssl_kw):
         """:para host: The host to connect
         :param port: The port that the server is listening.
         :param use_ssl: Indicates if we should use a secure connection.
         :param validate_cert: Indicates if we should validate the ssl cert
           used by the server.
+        :param multiplex: Indicates if the connection should stay open
+          and carry many concurrent requests. Streaming actions, the ones
+          that send more than one response, must not use multiplexed
+          connections.
+        :param use_pool: Indicates if the connection should be taken from
+          a :class:`~toxicbuild.core.client.ConnectionPool`. Pooled
+          connections are multiplexed so the same restrictions apply.
+        :param pool_kw: Named arguments to the
+          :class:`~toxicbuild.core.client.ConnectionPool` constructor
+          used when the pool is created.
         :param ssl_kw: Named arguments to ``ssl.create_default_context()``
         """
         self.host = host
         self.port = port
         self.use_ssl = use_ssl
         self.validate_cert = validate_cert
+        self.multiplex = multiplex
+        self.use_pool = use_pool
+        self.pool_kw = pool_kw or {}
         self.ssl_kw = ssl_kw
         self.reader = None
         self.writer = None
         self._connected = False
+        self._request_ids = count()
+        self._pending = {}
+        self._read_responses_future = None
+        self._write_lock = asyncio.Lock()
+        self._pool = None
+        self._pooled_conn = None
+        self.codec = codecs.JSON
+        self.compressor = None
+        self._codecs_sent = False
 
     def is_connected(self):
         return self._connected
@@ -93,13 +137,18 @@ class BaseToxicClient(utils.LoggerMixin):
             (aka ``async with``)
         """
 
-        if self.use_ssl:
-            ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH,
-                                                     **self.ssl_kw)
-            if not self.validate_cert:
-                ssl_context.check_hostname = False
-                ssl_context.verify_mode = ssl.CERT_NONE
+        if self.use_pool:
+            self._pool = ConnectionPool.get_pool(
+                self.host, self.port, use_ssl=self.use_ssl,
+                validate_cert=self.validate_cert, pool_kw=self.pool_kw,
+                **self.ssl_kw)
+            self._pooled_conn = await self._pool.acquire()
+            self._connected = True
+            return
 
+        if self.use_ssl:
+            ssl_context = ConnectionPool.get_ssl_context(
+                validate_cert=self.validate_cert, **self.ssl_kw)
             kw = {'ssl': ssl_context}
         else:
             kw = {}
@@ -107,23 +156,93 @@ class BaseToxicClient(utils.LoggerMixin):
         self.reader, self.writer = await asyncio.open_connection(
             self.host, self.port, **kw)
         self._connected = True
+        self.codec = codecs.JSON
+        self.compressor = None
+        self._codecs_sent = False
+        if self.multiplex:
+            self._read_responses_future = ensure_future(
+                self._read_responses())
 
     def disconnect(self):
         """Disconnects from the server"""
         self.log('disconecting...', level='debug')
+        self._connected = False
+        if self._pooled_conn:
+            self._pool.release(self._pooled_conn)
+            self._pooled_conn = None
+            return
+
         self.writer.close()
+        if self._read_responses_future:
+            self._read_responses_future.cancel()
+            self._read_responses_future = None
+        self._fail_pending(ToxicClientException('Disconnected'))
+
+    def _fail_pending(self, exc):
+        pending = self._pending
+        self._pending = {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(exc)
+
+    async def _read_responses(self):
+        """Reads the responses of a multiplexed connection and delivers
+        them to the requests waiting for them."""
+
+        try:
+            while self._connected:
+                response = await self.read()
+                if not response:
+                    break
+
+                request_id = response.get('request_id')
+                if request_id is None:
+                    # The server does not support multiplexing, the
+                    # responses for the other requests will never come.
+                    raise ToxicClientException(
+                        'The server does not support multiplexing')
+
+                future = self._pending.pop(request_id, None)
+                if future is None:
+                    self.log('Response for unknown request {}'.format(
+                        request_id), level='warning')
+                    continue
+
+                if not future.done():
+                    future.set_result(response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._connected = False
+            self._fail_pending(e)
+            return
+
         self._connected = False
+        self._fail_pending(ToxicClientException('Connection closed'))
 
     async def write(self, data, timeout=None):
         """ Writes ``data`` to the server.
 
         :param data: Data to be sent to the server. Will be converted to
-          json and enconded using utf-8.
+          json and enconded using utf-8, or encoded using the codec
+          agreed with the server.
         :param timeout: Timeout for the write operation. If None there is
           no timeout.
         """
-        data = json.dumps(data)
-        await utils.write_stream(self.writer, data, timeout=timeout)
+        if not self._codecs_sent:
+            # the first message says to the server which codecs
+            # and compressors we can decode.
+            self._codecs_sent = True
+            available = codecs.get_available_codecs()
+            if available != [codecs.JSON.name]:
+                data = dict(data, codecs=available)
+            data = dict(data,
+                        compression=compression.get_available_compressors())
+
+        data = self.codec.encode(data)
+        async with self._write_lock:
+            await utils.write_stream(self.writer, data, timeout=timeout,
+                                     compressor=self.compressor)
 
     async def read(self, timeout=None):
         """Reads data from the server. Expects a json.
@@ -133,26 +252,85 @@ class BaseToxicClient(utils.LoggerMixin):
         """
         # '{}' is decoded as an empty dict, so in json
         # context we can consider it as being a False json
-        data = await utils.read_stream(self.reader, timeout=timeout)
-        data = data.decode() or '{}'
+        data = await utils.read_stream(self.reader, timeout=timeout,
+                                       max_len=self.max_frame_len)
+        data = data or b'{}'
         try:
-            json_data = json.loads(data, object_pairs_hook=OrderedDict)
+            json_data = codecs.decode(data)
         except Exception:
             msg = traceback.format_exc()
             self.log(msg, level='error')
             raise BadJsonData(data)
 
+        if isinstance(json_data, dict):
+            codec = json_data.pop('codec', None)
+            if codec:
+                self.codec = codecs.get_codec(codec)
+            compressor = json_data.pop('compression', None)
+            if compressor:
+                self.compressor = compression.get_compressor(compressor)
+
         return json_data
 
     async def get_response(self, timeout=None):
         """Reads data from the server and raises and exception in case of
         error"""
         response = await self.read(timeout=timeout)
+        return self.check_response(response)
+
+    def check_response(self, response):
+        """Raises an exception if the response is an error response.
+        Returns the response otherwise.
+
+        :param response: A response sent by the server."""
 
         if 'code' in response and int(response['code']) != 0:
             raise ToxicClientException(response['body']['error'])
         return response
 
+    async def send_request(self, data, timeout=None):
+        """Sends a request to the server and returns its response.
+        In a multiplexed connection a ``request_id`` is added to
+        ``data`` and the response is the one sent for it.
+
+        :param data: The request data.
+        :param timeout: Timeout for the operation. If None there is
+          no timeout, except for pooled connections that use the
+          ``response_timeout`` of the pool.
+        """
+        if self._pooled_conn:
+            if timeout is None:
+                timeout = self._pool.response_timeout
+            response = await self._pooled_conn.send_multiplexed(
+                data, timeout=timeout)
+        elif self.multiplex:
+            response = await self.send_multiplexed(data, timeout=timeout)
+        else:
+            await self.write(data)
+            return await self.get_response(timeout=timeout)
+
+        return self.check_response(response)
+
+    async def send_multiplexed(self, data, timeout=None):
+        """Sends a request through a multiplexed connection and returns
+        the response sent for it, without checking for errors.
+
+        :param data: The request data.
+        :param timeout: Timeout for the operation. If None there is
+          no timeout.
+        """
+        request_id = next(self._request_ids)
+        data['request_id'] = request_id
+        future = asyncio.get_event_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            await self.write(data, timeout=timeout)
+            response = await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+        return response
+
     async def request2server(self, action, body, token, timeout=None):
         """Performs a request to a toxicbuild server and
         server returns the response.
@@ -163,6 +341,182 @@ class BaseToxicClient(utils.LoggerMixin):
         """
         data = {'action': action, 'body': body,
                 'token': token}
-        await self.write(data)
-        response = await self.get_response(timeout=timeout)
+        response = await self.send_request(data, timeout=timeout)
         return response['body'][action]
+
+
+class ConnectionPool(utils.LoggerMixin):
+    """A pool of multiplexed connections to a toxicbuild server. The
+    connections are shared by the clients using the pool, a new
+    connection is only opened when all connections are in use and the
+    pool is not full.
+
+    There is one pool for each (host, port, use_ssl, validate_cert, ssl_kw).
+    Use :meth:`~toxicbuild.core.client.ConnectionPool.get_pool` to get it.
+    """
+
+    _pools = {}
+    _ssl_contexts = {}
+
+    def __init__(self, host, port, use_ssl=False, validate_cert=True,
+                 max_size=10, idle_timeout=60, response_timeout=300,
+                 **ssl_kw):
+        """:param host: The host to connect.
+        :param port: The port that the server is listening.
+        :param use_ssl: Indicates if we should use a secure connection.
+        :param validate_cert: Indicates if we should validate the ssl cert
+          used by the server.
+        :param max_size: The maximum number of connections in the pool.
+        :param idle_timeout: How long, in seconds, a connection not used
+          by anyone is kept open.
+        :param response_timeout: How long, in seconds, a request waits
+          for its response. None means no timeout.
+        :param ssl_kw: Named arguments to ``ssl.create_default_context()``
+        """
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.validate_cert = validate_cert
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.response_timeout = response_timeout
+        self.ssl_kw = ssl_kw
+        # connection: number of clients using it
+        self._conns = {}
+        self._last_used = {}
+        self._lock = asyncio.Lock()
+        self._prune_handle = None
+
+    @classmethod
+    def get_pool(cls, host, port, use_ssl=False, validate_cert=True,
+                 pool_kw=None, **ssl_kw):
+        """Returns the pool for the server. Creates the pool if it
+        does not exist yet.
+
+        :param host: The host to connect.
+        :param port: The port that the server is listening.
+        :param use_ssl: Indicates if we should use a secure connection.
+        :param validate_cert: Indicates if we should validate the ssl cert
+          used by the server.
+        :param pool_kw: Named arguments passed to the pool constructor
+          when the pool is created.
+        :param ssl_kw: Named arguments to ``ssl.create_default_context()``
+        """
+        key = (host, port, use_ssl, validate_cert,
+               tuple(sorted(ssl_kw.items())))
+        pool = cls._pools.get(key)
+        if pool is None:
+            pool = cls(host, port, use_ssl=use_ssl,
+                       validate_cert=validate_cert, **(pool_kw or {}),
+                       **ssl_kw)
+            cls._pools[key] = pool
+        return pool
+
+    @classmethod
+    def get_ssl_context(cls, validate_cert=True, **ssl_kw):
+        """Returns a ssl context for client connections. The contexts
+        are cached so the certificates are loaded only once.
+
+        :param validate_cert: Indicates if we should validate the ssl cert
+          used by the server.
+        :param ssl_kw: Named arguments to ``ssl.create_default_context()``
+        """
+        key = (validate_cert, tuple(sorted(ssl_kw.items())))
+        ssl_context = cls._ssl_contexts.get(key)
+        if ssl_context is None:
+            ssl_context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH,
+                                                     **ssl_kw)
+            if not validate_cert:
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+            cls._ssl_contexts[key] = ssl_context
+
+        return ssl_context
+
+    @classmethod
+    def close_all(cls):
+        """Closes the connections of all pools."""
+        for pool in cls._pools.values():
+            pool.close()
+        cls._pools = {}
+
+    def __len__(self):
+        return len(self._conns)
+
+    def _is_healthy(self, conn):
+        return conn.is_connected() and not conn.writer.is_closing()
+
+    def _discard(self, conn):
+        self._conns.pop(conn, None)
+        self._last_used.pop(conn, None)
+        if conn.is_connected():
+            conn.disconnect()
+
+    def _prune(self):
+        """Discards the broken connections and the ones idle for too
+        long."""
+        limit = time.monotonic() - self.idle_timeout
+        for conn, users in list(self._conns.items()):
+            idle = users == 0 and self._last_used[conn] < limit
+            if idle or not self._is_healthy(conn):
+                self._discard(conn)
+
+    async def _create_connection(self):
+        conn = BaseToxicClient(self.host, self.port, use_ssl=self.use_ssl,
+                               validate_cert=self.validate_cert,
+                               multiplex=True, **self.ssl_kw)
+        await conn.connect()
+        self.log('New connection to {}:{}'.format(self.host, self.port),
+                 level='debug')
+        return conn
+
+    async def acquire(self):
+        """Returns a healthy connection from the pool. The least used
+        connection is returned unless all connections are in use and the
+        pool is not full, in which case a new connection is opened."""
+
+        async with self._lock:
+            self._prune()
+            conn = None
+            if self._conns:
+                conn = min(self._conns, key=self._conns.get)
+
+            if conn is None or (self._conns[conn] > 0 and
+                                len(self._conns) < self.max_size):
+                conn = await self._create_connection()
+                self._conns[conn] = 0
+
+            self._conns[conn] += 1
+            self._last_used[conn] = time.monotonic()
+            return conn
+
+    def release(self, conn):
+        """Gives back a connection to the pool.
+
+        :param conn: A connection returned by
+          :meth:`~toxicbuild.core.client.ConnectionPool.acquire`."""
+
+        if conn not in self._conns:
+            return
+
+        self._conns[conn] -= 1
+        self._last_used[conn] = time.monotonic()
+        if not self._is_healthy(conn):
+            self._discard(conn)
+        elif self._conns[conn] == 0:
+            self._schedule_prune()
+
+    def _schedule_prune(self):
+        if self._prune_handle:
+            self._prune_handle.cancel()
+        loop = asyncio.get_event_loop()
+        self._prune_handle = loop.call_later(self.idle_timeout + 1,
+                                             self._prune)
+
+    def close(self):
+        """Closes all connections in the pool."""
+        if self._prune_handle:
+            self._prune_handle.cancel()
+            self._prune_handle = None
+        for conn in list(self._conns):
+            self._discard(conn)
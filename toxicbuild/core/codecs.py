@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""This module implements the codecs used to serialize the messages
+exchanged by the toxicbuild components.
+
+The json codec is always available and it is the one used unless
+both sides of a connection agree on other codec. When `orjson` is
+installed it is used by the json codec. When `msgpack` is installed
+the msgpack codec is available.
+
+A client willing to use other codec sends a ``codecs`` key, with the
+names of the codecs it can decode, in the first message of a
+connection. A server that knows some of these codecs chooses one, uses
+it in its responses and says which one in a ``codec`` key in the
+first response. The messages are decoded based on its first byte so it
+does not matter when each side starts using the codec.
+
+Usage:
+``````
+
+.. code-block:: python
+
+    from toxicbuild.core import codecs
+
+    codec = codecs.get_codec('msgpack')
+    data = codec.encode({'some': 'thing'})
+    codecs.decode(data)
+"""
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma no cover
+    msgpack = None
+
+
+class JSONCodec:
+    """Encodes the messages as utf-8 encoded json."""
+
+    name = 'json'
+
+    def is_available(self):
+        return True
+
+    def encode(self, obj):
+        if orjson:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(obj).encode('utf-8')
+
+    def decode(self, data):
+        if orjson:
+            return orjson.loads(data)
+        return json.loads(data.decode())
+
+
+class MsgpackCodec:
+    """Encodes the messages using msgpack."""
+
+    name = 'msgpack'
+
+    def is_available(self):
+        return msgpack is not None
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+    def decode(self, data):
+        # Maps with keys that are not strings are accepted, like
+        # the json codec does.
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+
+JSON = JSONCodec()
+
+# The codecs in order of preference.
+CODECS = {'msgpack': MsgpackCodec(),
+          'json': JSON}
+
+
+def get_codec(name):
+    """Returns a codec by its name. If the codec is unknown or
+    not available the json codec is returned.
+
+    :param name: The name of the codec."""
+
+    codec = CODECS.get(name)
+    if codec is None or not codec.is_available():
+        return JSON
+    return codec
+
+
+def get_available_codecs():
+    """Returns the names of the available codecs in order of preference."""
+
+    return [n for n, c in CODECS.items() if c.is_available()]
+
+
+def choose_codec(names):
+    """Chooses the preferred available codec among ``names``.
+
+    :param names: A list of codec names."""
+
+    for name in get_available_codecs():
+        if name in names:
+            return CODECS[name]
+    return JSON
+
+
+def _is_msgpack_map(data):
+    # fixmap, map16 and map32
+    first = data[0] if data else None
+    return first is not None and (0x80 <= first <= 0x8f or
+                                  first in (0xde, 0xdf))
+
+
+def decode(data):
+    """Decodes a message encoded by any of the codecs. The messages
+    are always maps, json maps start with ``{`` and msgpack
+    maps start with one of its map markers.
+
+    :param data: The encoded message."""
+
+    if _is_msgpack_map(data):
+        return get_codec('msgpack').decode(data)
+
+    return JSON.decode(data)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""This module implements the compression of the messages exchanged
+by the toxicbuild components.
+
+Compression is negotiated like the codecs (see
+:mod:`toxicbuild.core.codecs`): the client sends a ``compression`` key
+with the names of the compressors it knows in the first message of a
+connection and the server says which one it chose using a
+``compression`` key in its first response. After that messages bigger
+than :const:`COMPRESSION_THRESHOLD` are compressed. A compressed message
+has a flag after the length in the message header, ie: ``123z\\n``
+for a message compressed with zlib.
+
+zlib is always available. zstd is available when `zstandard` is
+installed.
+"""
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import zlib
+
+from toxicbuild.core.exceptions import FrameTooLarge
+
+try:
+    import zstandard
+except ImportError:  # pragma no cover
+    zstandard = None
+
+# Messages smaller than this are not compressed.
+COMPRESSION_THRESHOLD = 8192
+
+
+class ZlibCompressor:
+    """Compresses the messages using zlib."""
+
+    name = 'zlib'
+    flag = b'z'
+    level = 1
+
+    def is_available(self):
+        return True
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data, max_len=None):
+        """Decompresses ``data``. Raises
+        :class:`~toxicbuild.core.exceptions.FrameTooLarge` if the
+        decompressed data is bigger than ``max_len``."""
+
+        d = zlib.decompressobj()
+        if max_len is None:
+            return d.decompress(data) + d.flush()
+
+        r = d.decompress(data, max_len + 1)
+        if len(r) > max_len or d.unconsumed_tail:
+            raise FrameTooLarge('Decompressed message bigger than {}'.format(
+                max_len))
+        return r + d.flush()
+
+
+class ZstdCompressor:
+    """Compresses the messages using zstd."""
+
+    name = 'zstd'
+    flag = b's'
+    level = 3
+
+    def is_available(self):
+        return zstandard is not None
+
+    def compress(self, data):
+        return zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data, max_len=None):
+        """Decompresses ``data``. Raises
+        :class:`~toxicbuild.core.exceptions.FrameTooLarge` if the
+        decompressed data is bigger than ``max_len``."""
+
+        d = zstandard.ZstdDecompressor()
+        if max_len is None:
+            return d.decompressobj().decompress(data)
+
+        # We read at most max_len + 1 bytes so we don't decompress
+        # a huge message only to find out it is too big.
+        chunks = []
+        size = 0
+        with d.stream_reader(data) as reader:
+            while size <= max_len:
+                chunk = reader.read(max_len + 1 - size)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+
+        if size > max_len:
+            raise FrameTooLarge('Decompressed message bigger than {}'.format(
+                max_len))
+        return b''.join(chunks)
+
+
+# The compressors in order of preference
+COMPRESSORS = {'zstd': ZstdCompressor(),
+               'zlib': ZlibCompressor()}
+
+
+def get_compressor(name):
+    """Returns a compressor by its name. Returns None if the compressor
+    is unknown or not available.
+
+    :param name: The name of the compressor."""
+
+    compressor = COMPRESSORS.get(name)
+    if compressor is None or not compressor.is_available():
+        return None
+    return compressor
+
+
+def get_compressor_by_flag(flag):
+    """Returns the compressor for the flag used in the message header.
+    Raises ValueError if there is no available compressor for the flag.
+
+    :param flag: The flag in the message header."""
+
+    for compressor in COMPRESSORS.values():
+        if compressor.flag == flag and compressor.is_available():
+            return compressor
+
+    raise ValueError('Unknown compression flag {!r}'.format(flag))
+
+
+def get_available_compressors():
+    """Returns the names of the available compressors in order of
+    preference."""
+
+    return [n for n, c in COMPRESSORS.items() if c.is_available()]
+
+
+def choose_compressor(names):
+    """Chooses the preferred available compressor among ``names``.
+    Returns None if none of them is available.
+
+    :param names: A list of compressor names."""
+
+    for name in get_available_compressors():
+        if name in names:
+            return COMPRESSORS[name]
+    return None
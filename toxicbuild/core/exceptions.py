@@ -42,5 +42,9 @@ class BadJsonData(Exception):
     pass
 
 
+class FrameTooLarge(Exception):
+    pass
+
+
 class PluginNotFound(Exception):
     pass
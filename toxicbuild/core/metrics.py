@@ -0,0 +1,288 @@
+# -*- coding: utf-8 -*-
+"""This module implements the metrics collected by the toxicbuild servers.
+
+For each server (a :class:`~toxicbuild.core.protocol.BaseToxicProtocol`
+subclass) we record:
+
+* A histogram with the time spent handling each action.
+* The number of requests being handled for each action.
+* The number of bytes received and sent.
+* The number of authentication failures.
+
+The metrics are available through the ``metrics`` action of any server
+and, if a ``metrics_port`` is used, in the prometheus text format
+through http.
+
+Usage:
+``````
+
+.. code-block:: python
+
+    from toxicbuild.core.metrics import registry
+
+    registry.observe('UIHole', 'repo-list', 0.2)
+    registry.to_prometheus()
+"""
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from bisect import bisect_left
+from collections import defaultdict
+
+from toxicbuild.core.utils import LoggerMixin
+
+# The upper bounds, in seconds, of the request duration buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0, float('inf'))
+
+
+class Histogram:
+    """A cumulative histogram like the prometheus ones."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """:param buckets: The upper bounds of the buckets. The last one
+          must be ``float('inf')``."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Records a value in the histogram.
+
+        :param value: The value to record."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Returns a list of (upper_bound, count) with the number of
+        values less or equal than each upper bound."""
+        total = 0
+        r = []
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            r.append((bound, total))
+        return r
+
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(k, _escape(v))
+                    for k, v in labels.items())
+
+
+class MetricsRegistry:
+    """Keeps the metrics of the servers running in this process."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """:param buckets: The buckets for the request duration
+          histograms."""
+        self.buckets = buckets
+        self.clear()
+
+    def clear(self):
+        """Resets all metrics."""
+        # {(server, action): Histogram}
+        self.histograms = {}
+        self.in_flight = defaultdict(int)
+        self.bytes_in = defaultdict(int)
+        self.bytes_out = defaultdict(int)
+        self.auth_failures = defaultdict(int)
+
+    def request_started(self, server, action):
+        """Informs that a server started to handle an action.
+
+        :param server: The name of the server.
+        :param action: The action requested."""
+        self.in_flight[(server, action)] += 1
+
+    def request_finished(self, server, action, duration):
+        """Informs that a server finished to handle an action.
+
+        :param server: The name of the server.
+        :param action: The action requested.
+        :param duration: How long, in seconds, it took to handle the
+          action."""
+        self.in_flight[(server, action)] -= 1
+        self.observe(server, action, duration)
+
+    def observe(self, server, action, duration):
+        """Records the duration of a request.
+
+        :param server: The name of the server.
+        :param action: The action requested.
+        :param duration: How long, in seconds, it took to handle the
+          action."""
+        key = (server, action)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(duration)
+
+    def add_bytes_in(self, server, n):
+        """Records bytes received by a server.
+
+        :param server: The name of the server.
+        :param n: The number of bytes."""
+        self.bytes_in[server] += n
+
+    def add_bytes_out(self, server, n):
+        """Records bytes sent by a server.
+
+        :param server: The name of the server.
+        :param n: The number of bytes."""
+        self.bytes_out[server] += n
+
+    def add_auth_failure(self, server):
+        """Records an authentication failure.
+
+        :param server: The name of the server."""
+        self.auth_failures[server] += 1
+
+    def to_dict(self):
+        """Returns the metrics as a serializable dict."""
+
+        requests = defaultdict(dict)
+        for (server, action), histogram in self.histograms.items():
+            requests[server][action] = {
+                'count': histogram.count,
+                'sum': histogram.sum,
+                'buckets': [[_format_bound(b), c]
+                            for b, c in histogram.cumulative()],
+                'in_flight': self.in_flight.get((server, action), 0)}
+
+        for (server, action), n in self.in_flight.items():
+            if action not in requests[server]:
+                requests[server][action] = {'count': 0, 'sum': 0.0,
+                                            'buckets': [], 'in_flight': n}
+
+        return {'requests': dict(requests),
+                'bytes_in': dict(self.bytes_in),
+                'bytes_out': dict(self.bytes_out),
+                'auth_failures': dict(self.auth_failures)}
+
+    def to_prometheus(self):
+        """Returns the metrics in the prometheus text format."""
+
+        lines = [
+            '# HELP toxicbuild_request_duration_seconds Time spent '
+            'handling requests.',
+            '# TYPE toxicbuild_request_duration_seconds histogram']
+        name = 'toxicbuild_request_duration_seconds'
+        for (server, action), histogram in sorted(self.histograms.items()):
+            for bound, count in histogram.cumulative():
+                labels = _labels(server=server, action=action,
+                                 le=_format_bound(bound))
+                lines.append('{}_bucket{{{}}} {}'.format(name, labels, count))
+            labels = _labels(server=server, action=action)
+            lines.append('{}_sum{{{}}} {}'.format(name, labels,
+                                                  histogram.sum))
+            lines.append('{}_count{{{}}} {}'.format(name, labels,
+                                                    histogram.count))
+
+        lines += [
+            '# HELP toxicbuild_requests_in_flight Requests being handled.',
+            '# TYPE toxicbuild_requests_in_flight gauge']
+        for (server, action), n in sorted(self.in_flight.items()):
+            lines.append('toxicbuild_requests_in_flight{{{}}} {}'.format(
+                _labels(server=server, action=action), n))
+
+        counters = (
+            ('toxicbuild_received_bytes_total', 'Bytes received.',
+             self.bytes_in),
+            ('toxicbuild_sent_bytes_total', 'Bytes sent.', self.bytes_out),
+            ('toxicbuild_auth_failures_total', 'Authentication failures.',
+             self.auth_failures))
+
+        for name, help_text, values in counters:
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} counter'.format(name))
+            for server, n in sorted(values.items()):
+                lines.append('{}{{{}}} {}'.format(
+                    name, _labels(server=server), n))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsHTTPServer(LoggerMixin):
+    """A minimal http server that serves the metrics in the prometheus
+    text format at ``/metrics``."""
+
+    # Timeout to read the request headers.
+    read_timeout = 10
+
+    def __init__(self, addr, port, registry=registry):
+        """:param addr: The address to listen.
+        :param port: The port to listen.
+        :param registry: The :class:`MetricsRegistry` to serve."""
+        self.addr = addr
+        self.port = port
+        self.registry = registry
+        self.server = None
+
+    async def start(self):
+        """Starts to listen for connections."""
+        self.server = await asyncio.start_server(self.handle, self.addr,
+                                                 self.port)
+        self.log('Serving metrics at {}'.format(self.port))
+
+    def close(self):
+        """Stops the server."""
+        if self.server is not None:
+            self.server.close()
+
+    async def handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'),
+                                             self.read_timeout)
+            request_line = request.split(b'\r\n', 1)[0].decode()
+            method, path = request_line.split()[:2]
+        except Exception as e:
+            self.log('Bad metrics request: {!r}'.format(e), level='debug')
+            writer.close()
+            return
+
+        if method != 'GET' or path.split('?')[0] != '/metrics':
+            status = '404 Not Found'
+            body = b'Not found\n'
+        else:
+            status = '200 OK'
+            body = self.registry.to_prometheus().encode('utf-8')
+
+        header = ('HTTP/1.0 {}\r\n'
+                  'Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                  'Content-Length: {}\r\n'
+                  'Connection: close\r\n\r\n').format(status, len(body))
+        writer.write(header.encode('utf-8') + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
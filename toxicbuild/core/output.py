@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""Bounded capture of the output of commands.
+
+:class:`OutputBuffer` keeps only the head and the tail of an output in
+memory. When the output is bigger than that the whole output is spilled
+to a file so it still can be read later using :func:`read_output_file`.
+"""
+
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+from collections import deque
+import os
+import tempfile
+import time
+
+# How many characters of the begining of the output are kept in memory.
+HEAD_LEN = 64 * 1024
+# How many characters of the end of the output are kept in memory.
+TAIL_LEN = 192 * 1024
+# Max length of the pieces returned by read_output_file.
+READ_LEN = 1024 * 1024
+
+
+class OutputBuffer:
+    """Keeps the head and the tail of an output in memory. When the output
+    is bigger than ``head_len + tail_len`` the whole output is written to
+    a file.
+
+    Usage:
+
+    .. code-block:: python
+
+        with OutputBuffer(spill_path='/tmp/some.log') as output:
+            output.write('some text')
+
+        summary = output.getvalue()
+    """
+
+    def __init__(self, head_len=HEAD_LEN, tail_len=TAIL_LEN, spill_path=None):
+        """:param head_len: How many characters of the begining of the
+          output are kept in memory.
+        :param tail_len: How many characters of the end of the output are
+          kept in memory.
+        :param spill_path: The path of the file where the output is written
+          when it is too big. If None a temporary file is used.
+        """
+        self.head_len = head_len
+        self.tail_len = tail_len
+        self.spill_path = spill_path
+        self.size = 0
+        self._head = []
+        self._head_size = 0
+        self._tail = deque()
+        self._tail_size = 0
+        self._spill_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def truncated(self):
+        """Indicates if the output does not fit in memory."""
+        return self.size > self.head_len + self.tail_len
+
+    @property
+    def path(self):
+        """The path of the file with the full output. None if the output
+        was not spilled to a file."""
+        if self._spill_file is None:
+            return None
+        return self._spill_file.name
+
+    def write(self, text):
+        """Adds ``text`` to the output.
+
+        :param text: A string with part of the output."""
+
+        if self._spill_file is None and \
+           self.size + len(text) > self.head_len + self.tail_len:
+            self._spill()
+
+        if self._spill_file is not None:
+            self._spill_file.write(text)
+
+        self.size += len(text)
+
+        if self._head_size < self.head_len:
+            piece = text[:self.head_len - self._head_size]
+            self._head.append(piece)
+            self._head_size += len(piece)
+            text = text[len(piece):]
+
+        if not text:
+            return
+
+        self._tail.append(text)
+        self._tail_size += len(text)
+        while self._tail_size - len(self._tail[0]) >= self.tail_len:
+            self._tail_size -= len(self._tail.popleft())
+
+    def getvalue(self):
+        """Returns the output. If the output was truncated returns its head
+        and tail with a note about the omitted part in the middle."""
+
+        head = ''.join(self._head)
+        tail = ''.join(self._tail)
+        if not self.truncated:
+            return head + tail
+
+        tail = tail[-self.tail_len:]
+        omitted = self.size - len(head) - len(tail)
+        return '{}\n\n[... {} characters omitted ...]\n\n{}'.format(
+            head, omitted, tail)
+
+    def close(self):
+        """Closes the spill file, if any."""
+
+        if self._spill_file is not None:
+            self._spill_file.close()
+
+    def _spill(self):
+        if self.spill_path:
+            self._spill_file = open(self.spill_path, 'w', encoding='utf-8')
+        else:
+            self._spill_file = tempfile.NamedTemporaryFile(
+                'w', encoding='utf-8', prefix='toxicbuild-output-',
+                suffix='.log', delete=False)
+
+        # Until now everything fitted in memory.
+        self._spill_file.writelines(self._head)
+        self._spill_file.writelines(self._tail)
+
+
+def read_output_file(path, offset=0, length=READ_LEN):
+    """Reads part of an output file. Returns a tuple
+    ``(text, next_offset, size)``. ``offset``, ``next_offset`` and ``size``
+    are in bytes. The returned text never ends in the middle of a
+    character.
+
+    :param path: The path of the output file.
+    :param offset: Where to start reading.
+    :param length: How many bytes to read. At most :const:`READ_LEN`.
+    """
+
+    length = min(length, READ_LEN)
+    with open(path, 'rb') as fd:
+        size = os.fstat(fd.fileno()).st_size
+        fd.seek(offset)
+        data = fd.read(length)
+
+    if offset + len(data) < size:
+        data = _trim_incomplete_char(data)
+
+    return data.decode('utf-8', errors='replace'), offset + len(data), size
+
+
+def _trim_incomplete_char(data):
+    # Looks for the start of the last char in the last 4 bytes. If the char
+    # is not complete it is removed.
+    for i in range(1, min(4, len(data)) + 1):
+        byte = data[-i]
+        if byte & 0xC0 == 0x80:
+            # continuation byte
+            continue
+
+        if byte & 0xE0 == 0xC0:
+            char_len = 2
+        elif byte & 0xF0 == 0xE0:
+            char_len = 3
+        elif byte & 0xF8 == 0xF0:
+            char_len = 4
+        else:
+            char_len = 1
+
+        if char_len > i:
+            return data[:-i]
+        break
+
+    return data
+
+
+def remove_old_outputs(directory, max_age):
+    """Removes the output files older than ``max_age`` from ``directory``.
+
+    :param directory: The directory with the output files.
+    :param max_age: Max age of the files in seconds.
+    """
+
+    if not os.path.isdir(directory):
+        return
+
+    limit = time.time() - max_age
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.stat().st_mtime < limit:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:  # pragma no cover
+                pass
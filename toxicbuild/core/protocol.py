@@ -20,10 +20,10 @@
 import asyncio
 from asyncio import ensure_future
 from collections import OrderedDict
-import json
+import copy
 import time
 import traceback
-from toxicbuild.core import utils
+from toxicbuild.core import codecs, compression, metrics, utils
 
 
 class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
@@ -40,10 +40,25 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
              r = await fn(**self.data)
              self.send_response({'some': 'thing'})
 
+    If the first message sent by the client has a ``request_id`` key
+    the connection is multiplexed: it is not closed after the response
+    and the client may send more requests through it, each one with its
+    own ``request_id``. The requests are handled concurrently and the
+    responses carry the ``request_id`` of the request so they can
+    arrive out of order. Only the first message needs the auth token.
+
+    Every server answers to the ``metrics`` action with the metrics
+    collected in the process. See :mod:`toxicbuild.core.metrics`.
     """
 
     # This is the token used to authenticate incomming requests.
     encrypted_token = None
+    # The id of the request in a multiplexed connection. None means the
+    # connection is not multiplexed.
+    request_id = None
+    # The max length of the messages sent by the client. None means
+    # no limit. The servers use the ``MAX_FRAME_LEN`` setting.
+    max_frame_len = None
 
     def __init__(self, loop, connection_lost_cb=None):
         """:param loop: An asyncio loop.
@@ -62,6 +77,16 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
         self.peername = None
         self._transport = None
         self._writer_lock = asyncio.Lock()
+        # The protocol that owns the connection when this instance
+        # is handling a request in a multiplexed connection.
+        self._parent = None
+        self._request_futures = set()
+        # The codec used to encode the responses. See
+        # :mod:`toxicbuild.core.codecs`.
+        self.codec = codecs.JSON
+        # The compressor used for big responses. See
+        # :mod:`toxicbuild.core.compression`.
+        self.compressor = None
 
         self._reader = asyncio.StreamReader(loop=loop)
         super().__init__(self._reader, loop=loop)
@@ -118,16 +143,28 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
         if not token:
             msg = 'No auth token'
             self.log(msg, level='warning')
+            metrics.registry.add_auth_failure(self.metrics_name)
             await self.send_response(code=2, body={'error': msg})
             return self.close_connection()
 
-        if not utils.compare_bcrypt_string(token, self.encrypted_token):
+        if not await utils.verify_token(token, self.encrypted_token):
             msg = 'Bad auth token'
             self.log(msg, level='warning')
+            metrics.registry.add_auth_failure(self.metrics_name)
             await self.send_response(code=3, body={'error': msg})
             return self.close_connection()
 
+        client_codecs = self.data.get('codecs')
+        if client_codecs:
+            self.codec = codecs.choose_codec(client_codecs)
+
+        client_compressors = self.data.get('compression')
+        if client_compressors:
+            self.compressor = compression.choose_compressor(
+                client_compressors)
+
         self.action = self.data.get('action')
+        self.request_id = self.data.get('request_id')
 
         if not self.action:
             msg = 'No action found!'
@@ -135,6 +172,16 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
             await self.send_response(code=1, body=msg)
             return self.close_connection()
 
+    @property
+    def metrics_name(self):
+        """The name of the server in the metrics."""
+        return type(self).__name__
+
+    @property
+    def is_multiplexed(self):
+        """Informs if the connection carries many requests."""
+        return self.request_id is not None
+
     async def client_connected(self):  # pragma no cover
         """ Coroutine that handles connections. You must implement this
         in your sub-classes. When this method is called, ``self.data``,
@@ -145,9 +192,14 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
         raise NotImplementedError
 
     def close_connection(self):
-        """ Closes the connection with the client
+        """ Closes the connection with the client. When handling a request
+        in a multiplexed connection this does nothing, the connection is
+        closed by the client.
         """
 
+        if self._parent is not None:
+            return
+
         if self._stream_writer:
             self._stream_writer.close()
         self._connected = False
@@ -165,7 +217,15 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
         response = OrderedDict()
         response['code'] = code
         response['body'] = body
-        data = json.dumps(response)
+        if self.request_id is not None:
+            response['request_id'] = self.request_id
+        if isinstance(self.data, dict) and self.data.get('codecs'):
+            # the client asked for a codec so we say which one is used.
+            response['codec'] = self.codec.name
+        if isinstance(self.data, dict) and self.data.get('compression'):
+            response['compression'] = getattr(self.compressor, 'name', None)
+        data = self.codec.encode(response)
+        metrics.registry.add_bytes_out(self.metrics_name, len(data))
 
         # drain() cannot be called concurrently by multiple coroutines:
         # http://bugs.python.org/issue29930. Remove this lock when no
@@ -173,25 +233,29 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
         # patch by @RemiCardona for websockets on github.
         async with self._writer_lock:
             await utils.write_stream(self._stream_writer, data,
-                                     timeout=timeout)
+                                     timeout=timeout,
+                                     compressor=self.compressor)
 
     async def get_raw_data(self, timeout=None):
         """ Returns the raw data sent by the client
         :param timeout: Timeout for the operation. If None there is no timeout
         """
-        r = await utils.read_stream(self._stream_reader, timeout=timeout)
+        r = await utils.read_stream(self._stream_reader, timeout=timeout,
+                                    max_len=self.max_frame_len)
+        metrics.registry.add_bytes_in(self.metrics_name, len(r))
         return r
 
     async def get_json_data(self, timeout=None):
-        """Returns the json sent by the client.
+        """Returns the json (or other codec) data sent by the client.
         :param timeout: Timeout for the operation. If None there is no timeout
         """
 
         data = await self.get_raw_data(timeout=timeout)
-        data = data.decode()
+        return self._decode_data(data)
 
+    def _decode_data(self, data):
         try:
-            data = json.loads(data)
+            data = codecs.decode(data)
         except Exception:
             msg = '{}\n{}'.format(traceback.format_exc(), data)
             self.log(msg, level='error')
@@ -206,17 +270,111 @@ class BaseToxicProtocol(asyncio.StreamReaderProtocol, utils.LoggerMixin):
             self.log('Not connected', level='warning')
             return
 
+        if future.cancelled() or future.exception():
+            self.log('Error checking data', level='warning')
+            self.close_connection()
+            return
+
+        if self.is_multiplexed:
+            coro = self._handle_multiplexed()
+        else:
+            coro = self._logged_client_connected()
+
+        self._client_connected_future = ensure_future(coro)
+
+    async def _logged_client_connected(self):
         # wrapping it to log it.
-        async def logged_cb():
-            init = (time.time() * 1e3)
-            try:
-                status = await self.client_connected()
-            except ConnectionResetError:
-                status = 1
-                msg = 'Connection reset'
-                self.log(msg, level='debug')
+        if self.action == 'metrics':
+            return await self._send_metrics()
 
+        name, action = self.metrics_name, self.action
+        metrics.registry.request_started(name, action)
+        init = (time.time() * 1e3)
+        try:
+            status = await self.client_connected()
+        except ConnectionResetError:
+            status = 1
+            msg = 'Connection reset'
+            self.log(msg, level='debug')
+        finally:
             end = (time.time() * 1e3)
-            self.log('{}: {} {}'.format(self.action, status, (end - init)))
+            metrics.registry.request_finished(name, action,
+                                              (end - init) / 1e3)
+
+        self.log('{}: {} {}'.format(self.action, status, (end - init)))
+        return status
+
+    async def _send_metrics(self):
+        """Sends the metrics collected in this process. If the body of
+        the request has ``format: prometheus`` the metrics are sent in
+        the prometheus text format."""
 
-        self._client_connected_future = ensure_future(logged_cb())
+        body = self.data.get('body') or {}
+        if body.get('format') == 'prometheus':
+            r = metrics.registry.to_prometheus()
+        else:
+            r = metrics.registry.to_dict()
+
+        await self.send_response(code=0, body={'metrics': r})
+        self.close_connection()
+        return 0
+
+    def _get_request_protocol(self, data):
+        """Returns a copy of this protocol to handle one request of
+        a multiplexed connection.
+
+        :param data: The data of the request."""
+
+        req = copy.copy(self)
+        req._parent = self
+        req._request_futures = set()
+        req.data = data
+        req.action = data.get('action')
+        req.request_id = data.get('request_id')
+        return req
+
+    def _dispatch_request(self, data):
+        req = self._get_request_protocol(data)
+        f = ensure_future(req._logged_client_connected())
+        self._request_futures.add(f)
+        f.add_done_callback(self._request_futures.discard)
+        return f
+
+    async def _handle_multiplexed(self):
+        """Handles the requests of a multiplexed connection until the
+        client closes it."""
+
+        self._dispatch_request(self.data)
+        while self._connected:
+            try:
+                raw = await self.get_raw_data()
+            except Exception as e:
+                # ie: the connection was closed, a message too big
+                # or a bad message length.
+                self.log('Error reading data: {!r}'.format(e),
+                         level='warning')
+                break
+
+            if not raw:
+                break
+
+            data = self._decode_data(raw)
+            if not isinstance(data, dict) or \
+               data.get('request_id') is None:
+                msg = 'Something wrong with your data {!r}'.format(raw)
+                self.log(msg, level='warning')
+                await self.send_response(code=1, body={'error': msg})
+                break
+
+            if not data.get('action'):
+                req = self._get_request_protocol(data)
+                await req.send_response(code=1,
+                                        body={'error': 'No action found!'})
+                continue
+
+            self._dispatch_request(data)
+
+        if self._request_futures:
+            await asyncio.gather(*self._request_futures,
+                                 return_exceptions=True)
+        self.close_connection()
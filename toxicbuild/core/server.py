@@ -17,9 +17,15 @@
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import os
 import signal
+import socket
 import ssl
+import time
+import traceback
 
+from .exceptions import ConfigError
+from .metrics import MetricsHTTPServer
 from .protocol import BaseToxicProtocol
 from .utils import LoggerMixin
 
@@ -28,31 +34,68 @@ class ToxicServer(LoggerMixin):
 
     PROTOCOL_CLS = BaseToxicProtocol
 
-    def __init__(self, addr, port, loop=None, use_ssl=False, **ssl_kw):
+    def __init__(self, addr, port, loop=None, use_ssl=False,
+                 metrics_port=None, workers=1, **ssl_kw):
         """:param addr: Address from which the server is allowed to receive
         requests. If ``0.0.0.0``, receives requests from all addresses.
         :param port: The port for the slave to listen.
         :param loop: A main loop. If none, ``asyncio.get_event_loop()``
           will be used.
         :param use_ssl: Indicates is the connection uses ssl or not.
+        :param metrics_port: A port to serve the metrics in the prometheus
+          text format over http. If None the metrics are not served over
+          http.
+        :param workers: The number of processes handling requests. If
+          bigger than 1 ``start()`` forks the workers, each one with its
+          own loop listening in the same port using ``SO_REUSEPORT``,
+          and supervises them. When using workers each one serves its
+          metrics at ``metrics_port + worker_index``.
         :param ssl_kw: Named arguments passed to
           ``ssl.SSLContext.load_cert_chain()``
         """
-        self.loop = loop or asyncio.get_event_loop()
         self.addr = addr
         self.port = port
-        if use_ssl:
+        self.use_ssl = use_ssl
+        self.metrics_port = metrics_port
+        self.workers = workers
+        self.ssl_kw = ssl_kw
+        self.server = None
+        self.metrics_server = None
+
+        if self.workers > 1:
+            if not hasattr(socket, 'SO_REUSEPORT'):  # pragma no cover
+                raise ConfigError(
+                    'workers need SO_REUSEPORT, not available here')
+            # the workers create their own loops and listen when they
+            # are started.
+            self.loop = loop
+            return
+
+        self.loop = loop or asyncio.get_event_loop()
+        self._listen()
+
+    def _listen(self, reuse_port=False, metrics_port=None):
+        if self.use_ssl:
             ssl_context = ssl.create_default_context(
                 ssl.Purpose.CLIENT_AUTH)
-            ssl_context.load_cert_chain(**ssl_kw)
+            ssl_context.load_cert_chain(**self.ssl_kw)
             kw = {'ssl': ssl_context}
         else:
             kw = {}
 
-        coro = self.loop.create_server(self.get_protocol_instance, addr, port,
-                                       **kw)
+        if reuse_port:
+            kw['reuse_port'] = True
+
+        coro = self.loop.create_server(self.get_protocol_instance, self.addr,
+                                       self.port, **kw)
         self.server = self.loop.run_until_complete(coro)
-        signal.signal(signal.SIGTERM, self.sync_shutdown)
+
+        metrics_port = metrics_port or self.metrics_port
+        if metrics_port:
+            self.metrics_server = MetricsHTTPServer(self.addr, metrics_port)
+            self.loop.run_until_complete(self.metrics_server.start())
+
+        self.loop.add_signal_handler(signal.SIGTERM, self.stop)
 
     def get_protocol_instance(self):
         """Returns an instance of
@@ -65,19 +108,129 @@ class ToxicServer(LoggerMixin):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.server is None:
+            # the supervisor of the workers does not listen.
+            return
+
+        if self.metrics_server:
+            self.metrics_server.close()
         self.server.close()
         self.loop.run_until_complete(self.server.wait_closed())
         self.loop.close()
 
     def start(self):
         """Starts the build server."""
+        if self.workers > 1:
+            supervisor = WorkersSupervisor(self.run_worker, self.workers)
+            return supervisor.run()
+
         try:
             self.loop.run_forever()
         finally:
             self.sync_shutdown()
 
+    def run_worker(self, index):
+        """Runs the server in a worker process. Called by
+        :class:`~toxicbuild.core.server.WorkersSupervisor` in the forked
+        process.
+
+        :param index: The index of the worker."""
+
+        self.workers = 1
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        metrics_port = self.metrics_port + index if self.metrics_port \
+            else None
+        self._listen(reuse_port=True, metrics_port=metrics_port)
+        self.log('Worker {} listening at {}'.format(index, self.port))
+        with self:
+            self.start()
+
+    def stop(self):
+        """Stops the loop started by ``start()``. ``shutdown()`` is
+        called after the loop stops."""
+        self.loop.stop()
+
     async def shutdown(self):
         """Overwrite this to handle the shutdown of your server"""
 
     def sync_shutdown(self):  # pragma no cover
         return self.loop.run_until_complete(self.shutdown())
+
+
+class WorkersSupervisor(LoggerMixin):
+    """Forks the worker processes and restarts the ones that die. On
+    SIGTERM or SIGINT sends SIGTERM to the workers and waits for them
+    to finish."""
+
+    # Seconds to wait before restarting a worker, so a worker that
+    # dies right after it starts does not make we fork like crazy.
+    restart_delay = 1
+
+    def __init__(self, target, workers):
+        """:param target: A callable that runs a worker. Receives the index
+          of the worker as parameter.
+        :param workers: How many workers to run."""
+        self.target = target
+        self.workers = workers
+        # pid: worker index
+        self.pids = {}
+        self._stopping = False
+
+    def spawn(self, index):
+        """Forks a new worker process.
+
+        :param index: The index of the worker."""
+        pid = os.fork()
+        if pid == 0:  # pragma no cover
+            # the worker. It never returns from here.
+            exit_code = 0
+            try:
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                self.target(index)
+            except BaseException:
+                self.log(traceback.format_exc(), level='error')
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+
+        self.log('Worker {} started with pid {}'.format(index, pid),
+                 level='debug')
+        self.pids[pid] = index
+        return pid
+
+    def run(self):
+        """Starts the workers and waits for them. Returns when all
+        workers exit after a SIGTERM or SIGINT."""
+
+        signal.signal(signal.SIGTERM, self.terminate)
+        signal.signal(signal.SIGINT, self.terminate)
+
+        for index in range(self.workers):
+            self.spawn(index)
+
+        while self.pids:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+
+            index = self.pids.pop(pid, None)
+            if index is None or self._stopping:
+                continue
+
+            msg = 'Worker {} (pid {}) died with status {}. Restarting'
+            self.log(msg.format(index, pid, status), level='warning')
+            time.sleep(self.restart_delay)
+            if not self._stopping:
+                self.spawn(index)
+
+    def terminate(self, signum=None, frame=None):
+        """Sends SIGTERM to all workers."""
+
+        self._stopping = True
+        for pid in list(self.pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.pids.pop(pid, None)
@@ -20,16 +20,21 @@
 
 import asyncio
 from asyncio import ensure_future
-from asyncio.exceptions import LimitOverrunError, IncompleteReadError
+from asyncio.exceptions import IncompleteReadError
 import base64
+from codecs import getincrementaldecoder
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
-import copy
 from datetime import datetime, timezone, timedelta
 import fnmatch
+import functools
+import hashlib
+import hmac
 import importlib
 import logging
 import os
 import random
+import re
 import subprocess
 import tempfile
 import string
@@ -37,16 +42,33 @@ import sys
 import time
 import bcrypt
 from mongomotor.monkey import MonkeyPatcher
-from toxicbuild.core.exceptions import ExecCmdError, ConfigError
+from toxicbuild.core import compression
+from toxicbuild.core.exceptions import (ExecCmdError, ConfigError,
+                                        FrameTooLarge)
+
+try:
+    import uvloop
+except ImportError:  # pragma no cover
+    uvloop = None
 
 
 DTFORMAT = '%w %m %d %H:%M:%S %Y %z'
 
 
 _THREAD_EXECUTOR = ThreadPoolExecutor()
+# How many threads are used for file i/o.
+FILE_IO_WORKERS = 4
+_FILE_EXECUTOR = ThreadPoolExecutor(max_workers=FILE_IO_WORKERS)
+
+# Messages up to this length are written with the length header
+# in a single write.
+SMALL_MESSAGE_LEN = 4096
 
-WRITE_CHUNK_LEN = 4096
-READ_CHUNK_LEN = 1024
+# How much of the output of a command is read at once.
+OUTPUT_CHUNK_LEN = 2 ** 16
+# How many chunks of output may be waiting for the out_fn of exec_cmd.
+OUTPUT_QUEUE_LEN = 64
+_LINE_END_RE = re.compile(r'(?<=\n)')
 
 logger = logging.getLogger('toxicbuild')
 
@@ -104,7 +126,7 @@ def get_envvars(envvars, use_local_envvars=True):
     and the values passed as parameters. """
 
     if use_local_envvars:
-        newvars = copy.copy(os.environ)
+        newvars = dict(os.environ)
     else:
         newvars = {}
     newvars = interpolate_dict_values(newvars, envvars, os.environ)
@@ -122,7 +144,30 @@ async def _create_cmd_proc(cmd, cwd, **envvars):
 
     proc = await asyncio.create_subprocess_shell(
         cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd,
-        env=envvars, preexec_fn=os.setsid)
+        env=envvars, start_new_session=True)
+
+    return proc
+
+
+async def _create_argv_proc(args, cwd, env=None, stdin=None):
+    """Creates a process that will execute a command without a shell.
+
+    :param args: A list with the program and its arguments.
+    :param cwd: Directory to execute the command.
+    :param env: The environment for the command. If None the current
+      environment is used.
+    :param stdin: The stdin for the process, ie: ``subprocess.PIPE``.
+      If None the stdin of the current process is inherited.
+    """
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdin=stdin, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, cwd=cwd, env=env,
+            start_new_session=True)
+    except (FileNotFoundError, PermissionError) as e:
+        # the same error we have when a shell can't execute a command.
+        raise ExecCmdError(str(e))
 
     return proc
 
@@ -131,90 +176,203 @@ async def _kill_group(process):
     """Kills all processes of the group which a process belong.
 
     :param process: A process that belongs to the group you want to kill.
+      The process must be the leader of its group, what is true for
+      all the processes we create.
     """
 
-    def fn():
-        try:
-            pgid = os.getpgid(process.pid)
-            os.killpg(pgid, 9)
-        except ProcessLookupError:  # pragma no cover
-            pass
+    # It is a process group leader, so its pid is the group id and
+    # we don't need to look for it. This way we still can kill the
+    # group after the process is gone.
+    try:
+        os.killpg(process.pid, 9)
+    except ProcessLookupError:
+        pass
 
-    await run_in_thread(fn)
 
+def _split_lines(text):
+    """Splits ``text`` in lines, keeping the line endings. Returns
+    a tuple ``(lines, rest)`` where ``rest`` is the last line if it is
+    not complete yet.
 
-async def _try_readline(stream):
-    sep = b'\n'
-    try:
-        r = await stream.readuntil(sep)
-    except LimitOverrunError:
-        sep = b'\r'
-        r = await stream.readuntil(sep)
+    :param text: The text to split.
+    """
 
-    return r
+    # Only \n ends a line. str.splitlines would split on other
+    # characters too, ie: \x0c, \x85 or \u2028.
+    lines = _LINE_END_RE.split(text)
+    rest = lines.pop()
+
+    if len(rest) > OUTPUT_CHUNK_LEN:
+        lines.append(rest)
+        rest = ''
+
+    return lines, rest
 
 
-async def _readline(stream):
-    """Reads a line from the stream buffer. Tries to read a line
-    ending in '\n'. If no new line found, try to find '\r'.
+async def _deliver_output(queue, out_fn):
+    """Calls ``out_fn`` with the lines in ``queue``, one batch at a time,
+    until a None is found in the queue.
+
+    :param queue: An asyncio.Queue with ``(line_index, lines)`` tuples.
+    :param out_fn: A coroutine that receives the lines of the output.
+    """
+
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+
+        try:
+            await out_fn(*item)
+        except Exception as e:
+            log('Error delivering output: {}'.format(e), level='error')
+
+
+async def _read_output(stream, write, out_fn=None, timeout=None):
+    """Reads the output of a command in chunks until the end of
+    the stream. The chunks are decoded incrementally and passed
+    to ``write``. ``out_fn``, if any, is called with the complete lines
+    of each chunk, in order. When ``out_fn`` can't keep up with the
+    output the reading is paused until it does.
 
     :param stream: The StreamReader to read from.
+    :param write: A callable that receives the decoded chunks.
+    :param out_fn: A coroutine that receives the lines of the output.
+    :param timeout: How long we wait for each chunk. When it expires
+      ``asyncio.TimeoutError`` is raised.
     """
 
-    # basically taken from asyncio.streams.StreamReader.readline
-    lf, cr = b'\n', b'\r'
-    seplen = 1
+    decoder = getincrementaldecoder('utf-8')(errors='replace')
+    rest = ''
+    line_index = 0
+    eof = False
+    if out_fn:
+        queue = asyncio.Queue(maxsize=OUTPUT_QUEUE_LEN)
+        consumer = ensure_future(_deliver_output(queue, out_fn))
+
     try:
-        line = await _try_readline(stream)
-    except IncompleteReadError as e:
-        return e.partial
-    except LimitOverrunError as e:
-        if stream._buffer.startswith(lf, e.consumed) or \
-           stream._buffer.startswith(cr, e.consumed):
-            del stream._buffer[:e.consumed + seplen]
-        else:
-            stream._buffer.clear()
+        while not eof:
+            chunk = await asyncio.wait_for(stream.read(OUTPUT_CHUNK_LEN),
+                                           timeout)
+            eof = not chunk
+            text = decoder.decode(chunk, final=eof)
+            if text:
+                write(text)
+
+            if not out_fn:
+                continue
+
+            lines, rest = _split_lines(rest + text)
+            if eof and rest:
+                lines.append(rest)
+
+            if lines:
+                # blocks when the queue is full so we stop reading
+                # the pipe and the command waits for us.
+                await queue.put((line_index, lines))
+                line_index += len(lines)
 
-        stream._maybe_resume_transport()
-        raise ValueError(e.args[0])
-    return line
+        if out_fn:
+            await queue.put(None)
+            await consumer
+    finally:
+        if out_fn and not consumer.done():
+            consumer.cancel()
 
 
-async def exec_cmd(cmd, cwd, timeout=3600, out_fn=None, **envvars):
+async def exec_cmd(cmd, cwd, timeout=3600, out_fn=None, output=None,
+                   **envvars):
     """ Executes a shell command. Raises with the command output
     if return code > 0.
 
     :param cmd: command to run.
     :param cwd: Directory to execute the command.
-    :param timeout: How long we should wait some output. Default
-      is 3600.
-    :param out_fn: A coroutine that receives each line of the step
-      output. The coroutine signature must be in the form:
-      mycoro(line_index, line).
+    :param timeout: How long we wait for some output. Default
+      is 3600. When the timeout expires the command is killed and
+      ``asyncio.TimeoutError`` is raised.
+    :param out_fn: A coroutine that receives the lines of the
+      output as they arrive. The coroutine signature must be in the
+      form: mycoro(line_index, lines), where ``line_index`` is
+      the index of the first line in ``lines``. The calls are done
+      in order, one at a time, and exec_cmd only returns after all
+      the output was delivered.
+    :param output: A :class:`~toxicbuild.core.output.OutputBuffer`
+      to capture the output. If None the whole output is kept in memory.
+      If an output buffer is used the returned output (and the one in the
+      ExecCmdError) is the value of the buffer.
     :param envvars: Environment variables to be used in the command.
     """
 
     proc = await _create_cmd_proc(cmd, cwd, **envvars)
-    out = []
+    out = await _wait_cmd_proc(proc, timeout, out_fn, output)
+    return out
+
+
+async def exec_argv(args, cwd, timeout=3600, out_fn=None, output=None,
+                    env=None, input=None):
+    """Executes a command without a shell. Raises with the command
+    output if return code > 0. This is cheaper than :func:`exec_cmd`
+    so use it for the commands we create. The build steps, written
+    by the users, are executed with :func:`exec_cmd`.
+
+    :param args: A list with the program and its arguments,
+      ie: ``['git', 'fetch']``.
+    :param cwd: Directory to execute the command.
+    :param timeout: How long we wait for some output.
+    :param out_fn: A coroutine that receives the lines of the
+      output. See :func:`exec_cmd`.
+    :param output: An :class:`~toxicbuild.core.output.OutputBuffer`.
+      See :func:`exec_cmd`.
+    :param env: The environment for the command. It is used as is,
+      so build it only once. If None the current environment is used.
+    :param input: A string written to the stdin of the command.
+    """
+
+    if input is None:
+        proc = await _create_argv_proc(args, cwd, env=env)
+        out = await _wait_cmd_proc(proc, timeout, out_fn, output)
+        return out
+
+    proc = await _create_argv_proc(args, cwd, env=env, stdin=subprocess.PIPE)
+    # The input is written while we read the output so the command
+    # does not get stuck writing to a full pipe.
+    writer = asyncio.ensure_future(_write_input(proc.stdin, input))
+    try:
+        out = await _wait_cmd_proc(proc, timeout, out_fn, output)
+    finally:
+        writer.cancel()
+    return out
 
-    line_index = 0
-    while proc.returncode is None or not out:
-        outline = await asyncio.wait_for(_readline(proc.stdout), timeout)
-        outline = outline.decode()
-        if out_fn:
-            ensure_future(out_fn(line_index, outline))
 
-        line_index += 1
-        out.append(outline)
+async def _write_input(stdin, input):
+    try:
+        stdin.write(input.encode())
+        await stdin.drain()
+        stdin.close()
+    except (BrokenPipeError, ConnectionResetError):
+        # the command exited without reading all its input.
+        pass
+
+
+async def _wait_cmd_proc(proc, timeout, out_fn, output):
+    out = []
+    write = out.append if output is None else output.write
 
-    output = ''.join(out).strip('\n')
-    # we must ensure that all process started by our command are
-    # dead.
-    await _kill_group(proc)
+    try:
+        await _read_output(proc.stdout, write, out_fn, timeout=timeout)
+        # The output is closed but the command may still be running.
+        await asyncio.wait_for(proc.wait(), timeout)
+    finally:
+        # we must ensure that all process started by our command are
+        # dead.
+        await _kill_group(proc)
+
+    out = ''.join(out) if output is None else output.getvalue()
+    out = out.strip('\n')
     if int(proc.returncode) > 0:
-        raise ExecCmdError(output)
+        raise ExecCmdError(out)
 
-    return output
+    return out
 
 
 def load_module_from_content(module_content):
@@ -278,6 +436,24 @@ def log(msg, level='info'):
     log(msg)
 
 
+def set_event_loop_policy(settings):
+    """Uses uvloop for the event loops if the ``USE_UVLOOP`` setting is
+    True and uvloop is installed. Must be called before the event loop
+    is created. Returns True if uvloop is used.
+
+    :param settings: The settings of the component."""
+
+    if not getattr(settings, 'USE_UVLOOP', False):
+        return False
+
+    if uvloop is None:
+        log('USE_UVLOOP is set but uvloop is not installed', level='warning')
+        return False
+
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
 class LoggerMixin:
 
     """A simple mixin to use log on a class."""
@@ -397,69 +573,89 @@ def inherit_docs(cls):
     return cls
 
 
-async def read_stream(reader, timeout=None):
+async def _read_frame(reader, max_len=None):
+    try:
+        len_data = await reader.readuntil(b'\n')
+    except IncompleteReadError as e:
+        # connection closed before a new message
+        if not e.partial.strip():
+            return b''
+        raise
+
+    len_data = len_data.strip()
+    if not len_data:
+        return b''
+
+    compressor = None
+    flag = len_data[-1:]
+    if flag.isalpha():
+        # compressed message. See :mod:`toxicbuild.core.compression`.
+        compressor = compression.get_compressor_by_flag(flag)
+        len_data = len_data[:-1]
+
+    len_data = int(len_data)
+    if max_len is not None and len_data > max_len:
+        raise FrameTooLarge('Message with {} bytes. Max is {}'.format(
+            len_data, max_len))
+
+    data = await reader.readexactly(len_data)
+    if compressor is not None:
+        data = compressor.decompress(data, max_len=max_len)
+    return data
+
+
+async def read_stream(reader, timeout=None, max_len=None):
     """ Reads the input stream. First reads the bytes until the first "\\n".
-    These first bytes are the length of the full message.
+    These first bytes are the length of the full message, optionally
+    followed by a compression flag.
 
     :param reader: An instance of :class:`asyncio.StreamReader`
-    :param timeout: Timeout for the operation. If None there is no timeout
+    :param timeout: Timeout for the operation. If None there is no timeout.
+      The timeout is for the whole message, not for each read.
+    :param max_len: The max length of the message. If the message is
+      bigger than it :class:`~toxicbuild.core.exceptions.FrameTooLarge`
+      is raised. If None there is no limit. For compressed messages
+      the limit is checked for the compressed and the decompressed data.
     """
 
-    async def do_read(qbytes):
-        r = await asyncio.wait_for(reader.read(qbytes), timeout)
-        return r
+    return await asyncio.wait_for(_read_frame(reader, max_len), timeout)
 
-    data = await do_read(1)
-    if not data or data == b'\n':
-        raw_data = b''
-        raw_data_list = [b'']
-    else:
-        char = None
-        while char != b'\n' and char != b'':
-            char = await do_read(1)
-            data += char
-
-        len_data = int(data)
-        if len_data <= READ_CHUNK_LEN:
-            raw_data = await do_read(len_data)
-        else:
-            raw_data = await do_read(READ_CHUNK_LEN)
-
-        raw_data_len = len(raw_data)
-        raw_data_list = [raw_data]
-        while raw_data_len < len_data:
-            left = len_data - raw_data_len
-            next_chunk = left if left < READ_CHUNK_LEN else READ_CHUNK_LEN
-            new_data = await do_read(next_chunk)
-            raw_data_len += len(new_data)
-            raw_data_list.append(new_data)
-
-    return b''.join(raw_data_list)
-
-
-async def write_stream(writer, data, timeout=None):
+
+async def write_stream(writer, data, timeout=None, compressor=None):
     """ Writes ``data`` to output. Encodes data to utf-8 and prepend the
     lenth of the data before sending it.
 
     :param writer: An instance of asyncio.StreamWriter
-    :param data: String data to be sent.
+    :param data: String or bytes data to be sent.
     :param timeout: Timeout for the write operation. If None there is
       no timeout
+    :param compressor: A compressor from
+      :mod:`toxicbuild.core.compression`. If not None, messages bigger than
+      :const:`~toxicbuild.core.compression.COMPRESSION_THRESHOLD` are
+      compressed.
     """
 
     if writer is None:
         return False
 
-    data = data.encode('utf-8')
-    data = '{}\n'.format(len(data)).encode('utf-8') + data
-    init = 0
-    chunk = data[:WRITE_CHUNK_LEN]
-    while chunk:
-        writer.write(chunk)
-        await asyncio.wait_for(writer.drain(), timeout)
-        init += WRITE_CHUNK_LEN
-        chunk = data[init: init + WRITE_CHUNK_LEN]
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    flag = b''
+    if compressor is not None and \
+       len(data) > compression.COMPRESSION_THRESHOLD:
+        data = compressor.compress(data)
+        flag = compressor.flag
 
+    header = str(len(data)).encode('utf-8') + flag + b'\n'
+    if len(data) <= SMALL_MESSAGE_LEN:
+        writer.write(header + data)
+    else:
+        # big messages are not copied to join the header.
+        writer.write(header)
+        writer.write(memoryview(data))
+
+    await asyncio.wait_for(writer.drain(), timeout)
     return True
 
 
@@ -484,6 +680,97 @@ def compare_bcrypt_string(original, encrypted):
     return bcrypt.checkpw(original.encode(), encrypted.encode())
 
 
+class VerifiedTokenCache:
+    """A bounded cache for tokens that were successfully compared to
+    a bcrypt encrypted token. The tokens themselves are not stored, the
+    keys are a HMAC of the token and the encrypted token, using a random
+    key created when the cache is created.
+    """
+
+    def __init__(self, max_size=1024, ttl=300):
+        """:param max_size: The maximum number of tokens in the cache.
+          When the cache is full the oldest token is discarded.
+        :param ttl: For how long, in seconds, a token is kept in the cache.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._key = os.urandom(32)
+        self._tokens = OrderedDict()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def get_key(self, token, encrypted):
+        msg = '{}\n{}'.format(token, encrypted).encode()
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def has(self, token, encrypted):
+        """Informs if ``token`` was already verified against ``encrypted``.
+
+        :param token: The un-encrypted token.
+        :param encrypted: The bcrypt encrypted token."""
+
+        key = self.get_key(token, encrypted)
+        expires = self._tokens.get(key)
+        if expires is None:
+            return False
+
+        if expires < time.monotonic():
+            del self._tokens[key]
+            return False
+
+        return True
+
+    def add(self, token, encrypted):
+        """Adds a verified token to the cache.
+
+        :param token: The un-encrypted token.
+        :param encrypted: The bcrypt encrypted token."""
+
+        key = self.get_key(token, encrypted)
+        self._tokens.pop(key, None)
+        self._tokens[key] = time.monotonic() + self.ttl
+        while len(self._tokens) > self.max_size:
+            self._tokens.popitem(last=False)
+
+    def clear(self):
+        self._tokens.clear()
+
+
+_VERIFIED_TOKENS = VerifiedTokenCache()
+_VERIFYING_TOKENS = {}
+
+
+async def verify_token(token, encrypted):
+    """Compares an auth token with a bcrypt encrypted token. The
+    comparison runs in a thread so the loop is not blocked and
+    the successfully verified tokens are cached.
+
+    :param token: The un-encrypted token.
+    :param encrypted: The bcrypt encrypted token."""
+
+    if _VERIFIED_TOKENS.has(token, encrypted):
+        return True
+
+    # the same token is checked only once even if it arrives in
+    # many connections at the same time.
+    key = _VERIFIED_TOKENS.get_key(token, encrypted)
+    future = _VERIFYING_TOKENS.get(key)
+    if future is None:
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(_THREAD_EXECUTOR,
+                                      compare_bcrypt_string, token,
+                                      encrypted)
+        _VERIFYING_TOKENS[key] = future
+        future.add_done_callback(lambda f: _VERIFYING_TOKENS.pop(key, None))
+
+    verified = await asyncio.shield(future)
+    if verified:
+        _VERIFIED_TOKENS.add(token, encrypted)
+
+    return verified
+
+
 def create_random_string(length):
     valid_chars = string.ascii_letters + string.digits
     random_str = ''.join([l for i in range(length)
@@ -580,7 +867,8 @@ class MatchKeysDict(dict):
 
 
 async def run_in_thread(fn, *args, **kwargs):
-    """Runs a callable in a background thread.
+    """Runs a callable in a background thread. Returns the result
+    of the callable.
 
     :param fn: A callable to be executed in a thread.
     :param args: Positional arguments to ``fn``
@@ -592,23 +880,65 @@ async def run_in_thread(fn, *args, **kwargs):
 
         r = await run_in_thread(call, 1, bla='a')
 """
-    f = _THREAD_EXECUTOR.submit(fn, *args, **kwargs)
-    return f
+    loop = asyncio.get_event_loop()
+    r = await loop.run_in_executor(
+        _THREAD_EXECUTOR, functools.partial(fn, *args, **kwargs))
+    return r
 
 
-async def read_file(filename):
-    """Reads the contents of a file asynchronously.
+async def _run_file_io(fn, *args):
+    # file i/o has its own executor so lots of big files being read
+    # do not starve the other things running in threads.
+    loop = asyncio.get_event_loop()
+    r = await loop.run_in_executor(_FILE_EXECUTOR, fn, *args)
+    return r
+
+
+def _read(filename, mode):
+    with open(filename, mode) as fd:
+        contents = fd.read()
+    return contents
 
-    :param filename: The path of the file."""
 
-    def _read(filename):
-        with open(filename) as fd:
-            contents = fd.read()
-        return contents
+def _write(filename, contents, mode):
+    with open(filename, mode) as fd:
+        fd.write(contents)
 
-    contents = (await run_in_thread(_read, filename)).result()
+
+async def read_file(filename, binary=False):
+    """Reads the contents of a file without blocking the event loop.
+
+    :param filename: The path of the file.
+    :param binary: If True returns bytes, otherwise returns a string."""
+
+    mode = 'rb' if binary else 'r'
+    contents = await _run_file_io(_read, filename, mode)
     return contents
 
+
+async def write_file(filename, contents, append=False):
+    """Writes ``contents`` to a file without blocking the event loop.
+
+    :param filename: The path of the file.
+    :param contents: A string or bytes to be written.
+    :param append: If True appends the contents to the file instead
+      of overwriting it."""
+
+    mode = 'a' if append else 'w'
+    if isinstance(contents, bytes):
+        mode += 'b'
+    await _run_file_io(_write, filename, contents, mode)
+
+
+async def stat_file(filename):
+    """Returns the ``os.stat_result`` for a file without blocking the
+    event loop.
+
+    :param filename: The path of the file."""
+
+    r = await _run_file_io(os.stat, filename)
+    return r
+
 # Sorry, but not willing to test  a daemonizer.
 
 
@@ -18,11 +18,91 @@
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
 from abc import ABCMeta, abstractmethod
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timezone
+import hashlib
 import os
+import re
+from urllib.parse import urlparse
+
+try:
+    import pygit2
+except ImportError:  # pragma no cover
+    pygit2 = None
+
 from toxicbuild.core.exceptions import VCSError, ExecCmdError
-from toxicbuild.core.utils import (exec_cmd, inherit_docs, string2datetime,
-                                   datetime2string, utc2localtime,
-                                   localtime2utc, LoggerMixin, match_string)
+from toxicbuild.core.utils import (exec_cmd, exec_argv, inherit_docs,
+                                   string2datetime, datetime2string,
+                                   utc2localtime, localtime2utc, LoggerMixin,
+                                   match_string, get_envvars, run_in_thread)
+
+# How many file contents are kept in memory by Git.get_file_contents.
+BLOB_CACHE_LEN = 1024
+# The contents of files read from git in the format {blob_sha: contents}.
+# A blob sha identifies the contents so this is valid for every repo.
+_BLOB_CACHE = OrderedDict()
+# How many branches have their revisions read at the same time.
+REVISIONS_CONCURRENCY = 4
+# Locks for the mirrors being updated in the format {mirror_path: lock}.
+_MIRROR_LOCKS = {}
+# user@host:path/to/repo
+_SCP_URL_RE = re.compile(r'^(?:[^@/]+@)?([^:/]+):(?!//)(.*)$')
+
+
+def normalize_url(url):
+    """Returns a normalized version of a repository url, so different
+    urls for the same repository, ie: with or without credentials, ssh or
+    https, with or without .git, are the same.
+
+    :param url: The repository url."""
+
+    host, path = _split_url(url)
+    path = path.strip('/')
+    if path.endswith('.git'):
+        path = path[:-4]
+
+    return '{}/{}'.format(host, path) if host else path
+
+
+def _get_cached_blob(blob_id):
+    # Returns the contents of a blob in the cache or None.
+    # The cache is only used in the event loop, not in threads.
+    content = _BLOB_CACHE.pop(blob_id, None)
+    if content is not None:
+        # the most recently used goes to the end.
+        _BLOB_CACHE[blob_id] = content
+    return content
+
+
+def _cache_blob(blob_id, content):
+    _BLOB_CACHE[blob_id] = content
+    while len(_BLOB_CACHE) > BLOB_CACHE_LEN:
+        _BLOB_CACHE.popitem(last=False)
+
+
+def get_url_host(url):
+    """Returns the host of a repository url in lower case. For local
+    repositories returns an empty string.
+
+    :param url: The repository url."""
+
+    return _split_url(url)[0]
+
+
+def _split_url(url):
+    # Returns (host, path) for a repository url.
+    url = url.strip()
+    scp_match = _SCP_URL_RE.match(url)
+    if '://' in url:
+        parsed = urlparse(url)
+        host, path = (parsed.hostname or ''), parsed.path
+    elif scp_match:
+        host, path = scp_match.groups()
+    else:
+        # a local repository
+        host, path = '', os.path.abspath(url)
+    return host.lower(), path
 
 
 class VCS(LoggerMixin, metaclass=ABCMeta):
@@ -31,24 +111,59 @@ class VCS(LoggerMixin, metaclass=ABCMeta):
     """
     vcsbin = None
 
-    def __init__(self, workdir):
+    def __init__(self, workdir, mirrors_dir=None, clone_options=None):
         """:param workdir: Directory where repository will be cloned and
         all action will happen.
+        :param mirrors_dir: Directory where the mirrors of the repositories
+          are kept. The objects of a mirror are shared by all the clones
+          of its repository in this host. If None mirrors are not used.
+        :param clone_options: A dict with options for the clone in the
+          format ``{'depth': 2, 'filter': 'blob:none',
+          'sparse_paths': ['some/dir']}``. ``depth`` is the depth of
+          a shallow clone, None for the default depth and 0 for a full
+          clone. ``filter`` is a filter for a partial clone and
+          ``sparse_paths`` are the directories checked out in a sparse
+          checkout. All are optional.
         """
         self.workdir = workdir
-
-    async def exec_cmd(self, cmd, cwd=None):
-        """ Executes a shell command. If ``cwd`` is None ``self.workdir``
+        self.mirrors_dir = mirrors_dir
+        self.clone_options = clone_options or {}
+        # The environment for the commands is built only once as we
+        # execute lots of commands.
+        self.env = get_envvars({})
+
+    async def exec_cmd(self, cmd, cwd=None, input=None):
+        """ Executes a command. If ``cwd`` is None ``self.workdir``
         will be used.
 
+        :param cmd: The command to execute. If it is a list with the
+          program and its arguments the command is executed without a
+          shell. If it is a string it is executed in a shell.
         :param cwd: Directory where the command will be executed.
+        :param input: A string written to the stdin of the command. Only
+          for commands executed without a shell.
         """
         if cwd is None:
             cwd = self.workdir
 
-        ret = await exec_cmd(cmd, cwd)
+        if isinstance(cmd, str):
+            ret = await exec_cmd(cmd, cwd)
+        else:
+            ret = await exec_argv(cmd, cwd, env=self.env, input=input)
         return ret
 
+    def get_mirror_path(self, url):
+        """Returns the path for the mirror of a repository or None if
+        mirrors are not used.
+
+        :param url: The repository url."""
+
+        if not self.mirrors_dir:
+            return None
+
+        key = hashlib.sha1(normalize_url(url).encode()).hexdigest()
+        return os.path.join(self.mirrors_dir, key)
+
     def workdir_exists(self):
         """ Informs if the workdir for this vcs exists
         """
@@ -142,7 +257,9 @@ class VCS(LoggerMixin, metaclass=ABCMeta):
         :param branch_name: The name of the branch to check."""
 
     @abstractmethod  # pragma no branch
-    async def get_revisions(self, since=None, branches=None):
+    async def get_revisions(self, since=None, branches=None,
+                            since_commits=None, max_count=None,
+                            concurrency=None):
         """Returns the newer revisions ``since`` for ``branches`` from
         the default remote repository.
 
@@ -151,10 +268,22 @@ class VCS(LoggerMixin, metaclass=ABCMeta):
         :param branches: A list of branches to look for new revisions. If
           ``branches`` is None all remote branches will be used. You can use
           wildcards in branches to filter the remote branches.
+        :param since_commits: dictionary in the format
+          {branch_name: commit}. ``commit`` is the last known commit
+          of the branch. When present it is used instead of ``since``.
+        :param max_count: dictionary in the format {branch_name: count}
+          with how many revisions at most are returned for a branch.
+          Use a :class:`~toxicbuild.core.utils.MatchKeysDict` for
+          wildcards in the branch names. For new branches, the ones
+          not in ``since`` nor in ``since_commits``, only the latest
+          revision is returned.
+        :param concurrency: How many branches are read at the same time.
+          If None :const:`REVISIONS_CONCURRENCY` is used.
         """
 
     @abstractmethod  # pragma no branch
-    async def get_local_revisions(self, since=None, branches=None):
+    async def get_local_revisions(self, since=None, branches=None,
+                                  concurrency=None):
         """Returns the newer revisions ``since`` for ``branches`` in the
         local repository
 
@@ -163,15 +292,25 @@ class VCS(LoggerMixin, metaclass=ABCMeta):
         :param branches: A list of branches to look for new revisions. If
           ``branches`` is None all remote branches will be used. You can use
           wildcards in branches to filter the local branches.
+        :param concurrency: How many branches are read at the same time.
+          If None :const:`REVISIONS_CONCURRENCY` is used.
         """
 
     @abstractmethod  # pragma no branch
-    async def get_revisions_for_branch(self, branch, since=None):
+    async def get_revisions_for_branch(self, branch, since=None, ref=None,
+                                       since_commit=None, max_count=None):
         """ Returns the revisions for ``branch`` since ``since``.
         If ``since`` is None, all revisions will be returned.
 
         :param branch: branch name
         :param since: datetime
+        :param ref: A ref to read the revisions from. If None the
+          revisions are read from the current checkout.
+        :param since_commit: The last known commit of the branch. If
+          not None only the revisions after it are returned and
+          ``since`` is only used if ``since_commit`` is not found.
+        :param max_count: How many revisions at most are returned. The
+          latest ones are returned. If None there is no limit.
         """
 
     @abstractmethod  # pragma no branch
@@ -179,6 +318,16 @@ class VCS(LoggerMixin, metaclass=ABCMeta):
         """ Returns a list of the remote branches available.
         """
 
+    @abstractmethod  # pragma no branch
+    async def get_file_contents(self, path, commits):
+        """Returns the contents of a file in some commits without
+        touching the working tree. The return is a dict in the format
+        {commit: contents}. Commits without the file are not in the dict.
+
+        :param path: The path of the file relative to the repo root.
+        :param commits: A list of commits.
+        """
+
     def _filter_remote_branches(self, remote_branches, branch_filters):
         """Filters the remote branches based in filters for the branches'
         names."""
@@ -197,43 +346,113 @@ class Git(VCS):
     # some date
     date_format = '%a %b %d %H:%M:%S %Y'
     _commit_separator = '<end-toxiccommit>'
+    # depth of the clones when no depth is set in the clone options.
+    default_depth = 2
 
     async def _set_remote_origin_config(self):
         # when we do a shallow clone of a repo, we need to
         # set the remote origins to * otherwise we will not
         # be able to fetch all remote branches.
         remote = '+refs/heads/*:refs/remotes/origin/*'
-        cmd = '{} config remote.origin.fetch {}'.format(self.vcsbin,
-                                                        remote)
+        cmd = [self.vcsbin, 'config', 'remote.origin.fetch', remote]
         await self.exec_cmd(cmd, cwd=self.workdir)
 
     async def clone(self, url):
 
-        cmd = '%s clone --depth=2 %s %s --recursive' % (
-            self.vcsbin, url, self.workdir)
+        cmd = [self.vcsbin, 'clone']
+        mirror = await self.update_mirror(url)
+        if mirror:
+            # With the objects from the mirror we don't need a shallow
+            # clone. Only the missing objects are downloaded.
+            cmd.extend(['--reference-if-able', mirror])
+        else:
+            depth = self.clone_options.get('depth')
+            depth = self.default_depth if depth is None else depth
+            if depth:
+                cmd.append('--depth={}'.format(depth))
+
+        clone_filter = self.clone_options.get('filter')
+        if clone_filter:
+            # The filter is saved in the repo config and is used in
+            # the fetches too.
+            cmd.append('--filter={}'.format(clone_filter))
+
+        sparse_paths = self.clone_options.get('sparse_paths')
+        if sparse_paths:
+            cmd.append('--sparse')
+
+        cmd.extend([url, self.workdir, '--recursive'])
         # we can't go to self.workdir while we do not clone the repo
         await self.exec_cmd(cmd, cwd='.')
         await self._set_remote_origin_config()
 
+        if sparse_paths:
+            # The paths are written to stdin so they are never taken
+            # as options.
+            cmd = [self.vcsbin, 'sparse-checkout', 'set', '--stdin']
+            await self.exec_cmd(cmd, input='\n'.join(sparse_paths) + '\n')
+
+    def _get_depth_opts(self):
+        # If the clone is shallow and we have a depth in the options
+        # we keep it shallow in the fetches. Otherwise the fetches of
+        # new branches download their whole history.
+        depth = self.clone_options.get('depth')
+        shallow = os.path.exists(
+            os.path.join(self.workdir, '.git', 'shallow'))
+        if depth and shallow:
+            return ['--depth={}'.format(depth)]
+        return []
+
+    async def update_mirror(self, url):
+        """Creates or updates the mirror of a repository. Returns the path
+        of the mirror or None if mirrors are not used or the mirror could
+        not be updated.
+
+        :param url: The repository url."""
+
+        path = self.get_mirror_path(url)
+        if path is None:
+            return None
+
+        lock = _MIRROR_LOCKS.setdefault(path, asyncio.Lock())
+        async with lock:
+            try:
+                if not os.path.exists(path):
+                    cmd = [self.vcsbin, 'init', '--bare', '--quiet', path]
+                    await self.exec_cmd(cmd, cwd='.')
+                    # Other repositories use the objects here so they
+                    # must never be removed.
+                    cmd = [self.vcsbin, 'config', 'gc.auto', '0']
+                    await self.exec_cmd(cmd, cwd=path)
+
+                # The url is not saved in the mirror because it may
+                # have credentials.
+                cmd = [self.vcsbin, 'fetch', '--quiet', '--tags', url,
+                       '+refs/heads/*:refs/heads/*']
+                await self.exec_cmd(cmd, cwd=path)
+            except ExecCmdError as e:
+                msg = 'Error updating mirror {}. {}'.format(path, str(e))
+                self.log(msg, level='warning')
+                return None
+
+        return path
+
     async def set_remote(self, url, remote_name='origin'):
-        cmd = '{} remote set-url {} {}'.format(self.vcsbin, remote_name, url)
+        cmd = [self.vcsbin, 'remote', 'set-url', remote_name, url]
         await self.exec_cmd(cmd)
 
     async def get_remote(self, remote_name='origin'):
-        cmd = '{} remote -v | grep -m1 {} | sed -e \'s/{}\s*//g\' '
-        cmd += '-e \'s/(.*)//g\''
-        cmd = cmd.format(self.vcsbin, remote_name, remote_name)
+        cmd = [self.vcsbin, 'remote', 'get-url', remote_name]
         remote = await self.exec_cmd(cmd)
         return remote
 
     async def add_remote(self, remote_url, remote_name):
-        cmd = '{} remote add {} {}'.format(self.vcsbin,
-                                           remote_name, remote_url)
+        cmd = [self.vcsbin, 'remote', 'add', remote_name, remote_url]
         r = await self.exec_cmd(cmd)
         return r
 
     async def rm_remote(self, remote_name):
-        cmd = '{} remote rm {}'.format(self.vcsbin, remote_name)
+        cmd = [self.vcsbin, 'remote', 'rm', remote_name]
         r = await self.exec_cmd(cmd)
         return r
 
@@ -245,7 +464,7 @@ class Git(VCS):
             await self.set_remote(url, remote_name)
 
     async def fetch(self):
-        cmd = '%s %s' % (self.vcsbin, 'fetch')
+        cmd = [self.vcsbin, 'fetch'] + self._get_depth_opts()
 
         fetched = await self.exec_cmd(cmd)
         return fetched
@@ -253,25 +472,25 @@ class Git(VCS):
     async def create_local_branch(self, branch_name, base_name):
 
         await self.checkout(base_name)
-        cmd = '{} branch {}'.format(self.vcsbin, branch_name)
+        cmd = [self.vcsbin, 'branch', branch_name]
         r = await self.exec_cmd(cmd)
         return r
 
     async def delete_local_branch(self, branch_name):
         await self.checkout('master')
-        cmd = '{} branch -D {}'.format(self.vcsbin, branch_name)
+        cmd = [self.vcsbin, 'branch', '-D', branch_name]
         r = await self.exec_cmd(cmd)
         return r
 
     async def checkout(self, named_tree):
 
-        cmd = '{} checkout {}'.format(self.vcsbin, named_tree)
+        cmd = [self.vcsbin, 'checkout', named_tree]
         await self.exec_cmd(cmd)
 
     async def pull(self, branch_name, remote_name='origin'):
 
-        cmd = '{} pull --no-edit {} {}'.format(self.vcsbin, remote_name,
-                                               branch_name)
+        cmd = [self.vcsbin, 'pull', '--no-edit'] + self._get_depth_opts()
+        cmd.extend([remote_name, branch_name])
 
         ret = await self.exec_cmd(cmd)
         return ret
@@ -292,7 +511,7 @@ class Git(VCS):
         await self.rm_remote(external_name)
 
     async def branch_exists(self, branch_name):
-        cmd = '{} rev-parse --verify {}'.format(self.vcsbin, branch_name)
+        cmd = [self.vcsbin, 'rev-parse', '--verify', branch_name]
         try:
             await self.exec_cmd(cmd)
             exists = True
@@ -302,64 +521,118 @@ class Git(VCS):
         return exists
 
     async def update_submodule(self):
-        cmd = '{} submodule init'.format(self.vcsbin)
+        cmd = [self.vcsbin, 'submodule', 'init']
         await self.exec_cmd(cmd)
-        cmd = '{} submodule update'.format(self.vcsbin)
+        cmd = [self.vcsbin, 'submodule', 'update']
         ret = await self.exec_cmd(cmd)
         return ret
 
-    async def get_local_revisions(self, since=None, branches=None):
+    async def get_local_revisions(self, since=None, branches=None,
+                                  concurrency=None):
         since = since or {}
         branches = branches or []
-        revisions = {}
-        for branch in branches:
-            try:
-                await self.checkout(branch)
-                since_date = since.get(branch)
-                revs = await self.get_revisions_for_branch(branch, since_date)
-                if revs:
-                    revisions[branch] = revs
-            except Exception as e:
-                msg = 'Error fetching local changes on branch {}. {}'.format(
-                    branch, str(e))
-                self.log(msg, level='error')
+
+        async def get_branch_revisions(branch):
+            since_date = since.get(branch)
+            # No checkout so we can read many branches at the same time.
+            ref = 'refs/heads/{}'.format(branch)
+            revs = await self.get_revisions_for_branch(branch, since_date,
+                                                       ref=ref)
+            return revs
+
+        revisions = await self._get_branches_revisions(
+            branches, get_branch_revisions, concurrency,
+            'Error fetching local changes on branch {}. {}')
         return revisions
 
-    async def get_revisions(self, since=None, branches=None):
+    async def get_revisions(self, since=None, branches=None,
+                            since_commits=None, max_count=None,
+                            concurrency=None):
 
         since = since or {}
-        # this must be called everytime so we sync our repo
-        # with the remote repo and then we can see new branches
-        await self.fetch()
-        remote_branches = await self.get_remote_branches()
+        since_commits = since_commits or {}
+        max_count = max_count or {}
+        # Most of the times nothing changed, so we first check the heads
+        # in the remote repo and only fetch if some of them differ from
+        # the ones we already have.
+        remote_heads = await self.get_remote_heads()
+        local_heads = await self._get_remote_tracking_heads()
+        if remote_heads != local_heads:
+            # get_remote_branches fetches the remote repo so here we have
+            # the remote refs up to date and can see the new branches.
+            remote_branches = await self.get_remote_branches()
+        else:
+            self.log('No changes in remote heads', level='debug')
+            remote_branches = set(remote_heads.keys())
+
         if branches:
             remote_branches = self._filter_remote_branches(
                 remote_branches, branches)
 
-        revisions = {}
-        for branch in remote_branches:
-            try:
-                await self.checkout(branch)
-                await self.pull(branch)
-                since_date = since.get(branch)
-
-                revs = await self.get_revisions_for_branch(branch,
-                                                           since_date)
-                if revs:
-                    revisions[branch] = revs
-            except Exception as e:
-                msg = 'Error fetching changes on branch {}. {}'.format(
-                    branch, str(e))
-                self.log(msg, level='error')
-
+        async def get_branch_revisions(branch):
+            since_date = since.get(branch)
+            since_commit = since_commits.get(branch)
+            if since_date or since_commit:
+                count = max_count.get(branch)
+            else:
+                # A new branch. Only the latest revision is used
+                # so we don't need to walk its whole history.
+                count = 1
+            # We read the revisions straight from the remote-tracking
+            # ref so we don't need to checkout and pull every branch.
+            ref = 'refs/remotes/origin/{}'.format(branch)
+            revs = await self.get_revisions_for_branch(
+                branch, since_date, ref=ref, since_commit=since_commit,
+                max_count=count)
+            return revs
+
+        revisions = await self._get_branches_revisions(
+            remote_branches, get_branch_revisions, concurrency,
+            'Error fetching changes on branch {}. {}')
         return revisions
 
-    async def get_revisions_for_branch(self, branch, since=None):
-        # hash | commit date | author | title
-        commit_fmt = "%H | %ad | %an | %s | %+b {}".format(
-            self._commit_separator)
-        cmd = '{} log --pretty=format:"{}" '.format(
-            self.vcsbin, commit_fmt)
+    async def _get_branches_revisions(self, branches, get_branch_revisions,
+                                      concurrency, error_msg):
+        """Reads the revisions of many branches at the same time.
+        Returns a dict {branch: revisions} with the branches that
+        have new revisions.
+
+        :param branches: The names of the branches.
+        :param get_branch_revisions: A coroutine function that receives
+          a branch name and returns its revisions.
+        :param concurrency: How many branches are read at the same time.
+        :param error_msg: Message logged when we can't read a branch.
+          Formated with the branch name and the error.
+        """
+        sem = asyncio.Semaphore(concurrency or REVISIONS_CONCURRENCY)
+
+        async def get(branch):
+            async with sem:
+                try:
+                    revs = await get_branch_revisions(branch)
+                except Exception as e:
+                    self.log(error_msg.format(branch, str(e)), level='error')
+                    revs = None
+            return branch, revs
+
+        results = await asyncio.gather(*[get(b) for b in branches])
+        return {branch: revs for branch, revs in results if revs}
+
+    async def get_revisions_for_branch(self, branch, since=None, ref=None,
+                                       since_commit=None, max_count=None):
+        if since_commit:
+            try:
+                revisions = await self._get_revisions_since_commit(
+                    branch, since_commit, ref, max_count)
+                return revisions
+            except ExecCmdError as e:
+                # The commit may not exist here anymore, ie: a new clone,
+                # so we fallback to the date.
+                msg = 'Commit {} not found for branch {}. {}'.format(
+                    since_commit, branch, str(e))
+                self.log(msg, level='warning')
+
+        cmd = self._get_log_cmd()
         if since:
             # Here we change the time to localtime since we can't get
             # utc time in git commits unless we are using git 2.7+
@@ -368,11 +641,42 @@ class Git(VCS):
             self.log('get revisions for branch {} since {}'.format(branch,
                                                                    date),
                      level='debug')
-            cmd += '--since="%s" ' % date
+            cmd.append('--since={}'.format(date))
+
+        cmd.append('--date=local')
+        if max_count:
+            # one more because the first one is dropped
+            cmd.append('--max-count={}'.format(max_count + 1))
+
+        if ref:
+            cmd.extend([ref, '--'])
+
+        revisions = await self._get_revisions(branch, cmd)
+        # The thing here is that the first revision in the list
+        # is the last one consumed on last time
+        return revisions[1:]
+
+    async def _get_revisions_since_commit(self, branch, since_commit,
+                                          ref=None, max_count=None):
+        # Here git walks only the commits after since_commit, not the
+        # whole history like --since does.
+        cmd = self._get_log_cmd()
+        cmd.append('--date=local')
+        if max_count:
+            cmd.append('--max-count={}'.format(max_count))
+        cmd.extend(['{}..{}'.format(since_commit, ref or 'HEAD'), '--'])
+        revisions = await self._get_revisions(branch, cmd)
+        return revisions
 
-        cmd += '--date=local'
+    def _get_log_cmd(self):
+        # hash | commit date | author | title
+        commit_fmt = "%H | %ad | %an | %s | %+b {}".format(
+            self._commit_separator)
+        return [self.vcsbin, 'log', '--pretty=format:{}'.format(commit_fmt)]
+
+    async def _get_revisions(self, branch, cmd):
         msg = 'Getting revisions for branch {} with command {}'.format(
-            branch, cmd)
+            branch, ' '.join(cmd))
         self.log(msg, level='debug')
         last_revs = [r for r in (await self.exec_cmd(cmd)).split(
             self._commit_separator + '\n') if r]
@@ -389,14 +693,13 @@ class Git(VCS):
             revisions.append({'commit': rev_uuid.strip(), 'commit_date': date,
                               'author': author, 'title': title, 'body': body})
 
-        # The thing here is that the first revision in the list
-        # is the last one consumed on last time
-        return revisions[1:]
+        return revisions
 
     async def get_remote_branches(self):
-        await self.fetch()
+        # remote update --prune fetches the remote and removes the
+        # deleted branches, so no need to fetch again.
         await self._update_remote_prune()
-        cmd = '%s branch -r' % self.vcsbin
+        cmd = [self.vcsbin, 'branch', '-r']
 
         out = await self.exec_cmd(cmd)
         msg = 'Remote branches: {}'.format(out)
@@ -411,16 +714,266 @@ class Git(VCS):
 
         return set([b.strip().split('/', 1)[1] for b in remote_branches])
 
+    async def get_file_contents(self, path, commits):
+        blobs = await self._get_blob_ids(path, commits)
+        # the same blob may be in many commits.
+        blob_ids = list(dict.fromkeys(blobs.values()))
+        contents = {}
+        missing = []
+        for blob in blob_ids:
+            content = _get_cached_blob(blob)
+            if content is None:
+                missing.append(blob)
+            else:
+                contents[blob] = content
+
+        if missing:
+            read = await self._read_blobs(missing)
+            for blob, content in read.items():
+                _cache_blob(blob, content)
+                contents[blob] = content
+
+        return {commit: contents[blob] for commit, blob in blobs.items()
+                if blob in contents}
+
+    async def _read_blobs(self, blob_ids):
+        # Returns the contents of the blobs in the format
+        # {blob_id: contents}
+        contents = {}
+        for blob in blob_ids:
+            cmd = [self.vcsbin, 'cat-file', 'blob', blob]
+            contents[blob] = await self.exec_cmd(cmd)
+        return contents
+
+    async def _get_blob_ids(self, path, commits):
+        # Returns the ids of the blobs for path in the commits
+        # using only one command.
+        if not commits:
+            return {}
+
+        cmd = [self.vcsbin, 'cat-file', '--batch-check']
+        input = ''.join('{}:{}\n'.format(c, path) for c in commits)
+        out = await self.exec_cmd(cmd, input=input)
+        blobs = {}
+        # The output has one line for each line of the input, like
+        # <sha> blob <size> or <object> missing
+        for commit, line in zip(commits, out.splitlines()):
+            parts = line.split()
+            if len(parts) == 3 and parts[1] == 'blob':
+                blobs[commit] = parts[0]
+        return blobs
+
+    async def get_remote_heads(self, remote_name='origin'):
+        """Returns the heads of the branches in the remote repository
+        in the format {branch_name: commit}. Nothing is fetched.
+
+        :param remote_name: The name of the remote."""
+
+        cmd = [self.vcsbin, 'ls-remote', '--heads', remote_name]
+        out = await self.exec_cmd(cmd)
+        return self._parse_heads(out, 'refs/heads/')
+
+    async def _get_remote_tracking_heads(self, remote_name='origin'):
+        # The heads of the remote branches we got in the last fetch.
+        prefix = 'refs/remotes/{}/'.format(remote_name)
+        cmd = [self.vcsbin, 'for-each-ref',
+               '--format=%(objectname)\t%(refname)', prefix]
+        out = await self.exec_cmd(cmd)
+        heads = self._parse_heads(out, prefix)
+        # origin/HEAD is not a branch
+        heads.pop('HEAD', None)
+        return heads
+
+    def _parse_heads(self, out, prefix):
+        heads = {}
+        for line in out.splitlines():
+            try:
+                commit, ref = line.split('\t', 1)
+            except ValueError:
+                continue
+            if ref.startswith(prefix):
+                heads[ref[len(prefix):]] = commit
+        return heads
+
     async def _update_remote_prune(self):
         """Updates remote branches list, prunning deleted branches."""
 
-        cmd = '{} remote update --prune'.format(self.vcsbin)
+        depth_opts = self._get_depth_opts()
+        if depth_opts:
+            # remote update does not know about depth.
+            cmd = [self.vcsbin, 'fetch', '--prune'] + depth_opts + ['origin']
+        else:
+            cmd = [self.vcsbin, 'remote', 'update', '--prune']
         msg = 'Updating --prune remote'
         self.log(msg, level='debug')
         await self.exec_cmd(cmd)
 
 
-VCS_TYPES = {'git': Git}
+@inherit_docs
+class LibGit2(Git):
+    """An interface to git that reads refs, commits and blobs in-process
+    using pygit2 so no command is executed for these. The network
+    operations (clone, fetch, etc...) still use the git command.
+
+    If pygit2 is not installed (pip install toxicbuild[fast]) it works
+    the same as :class:`~toxicbuild.core.vcs.Git`.
+    """
+
+    async def get_revisions_for_branch(self, branch, since=None, ref=None,
+                                       since_commit=None, max_count=None):
+        if pygit2 is None:  # pragma no cover
+            r = await super().get_revisions_for_branch(
+                branch, since=since, ref=ref, since_commit=since_commit,
+                max_count=max_count)
+            return r
+
+        ref = ref or 'HEAD'
+        if since_commit:
+            try:
+                revisions = await run_in_thread(
+                    self._walk, ref, hide=since_commit, max_count=max_count)
+                return revisions
+            except (KeyError, ValueError) as e:
+                # The commit may not exist here anymore, ie: a new clone,
+                # so we fallback to the date.
+                msg = 'Commit {} not found for branch {}. {}'.format(
+                    since_commit, branch, str(e))
+                self.log(msg, level='warning')
+
+        since_ts = None
+        if since:
+            if since.tzinfo is None:
+                # naive datetimes here are utc.
+                since = since.replace(tzinfo=timezone.utc)
+            since_ts = since.timestamp()
+
+        # one more because the first one is dropped
+        max_count = max_count + 1 if max_count else None
+        revisions = await run_in_thread(self._walk, ref, since_ts=since_ts,
+                                        max_count=max_count)
+        # The thing here is that the first revision in the list
+        # is the last one consumed on last time
+        return revisions[1:]
+
+    def _walk(self, ref, hide=None, since_ts=None, max_count=None):
+        # Returns the commits reachable from ref, the older first.
+        # Runs in a thread.
+        repo = pygit2.Repository(self.workdir)
+        start = repo.revparse_single(ref).peel(pygit2.Commit)
+        # parents always after their children, even with the same time.
+        walker = repo.walk(start.id,
+                           pygit2.GIT_SORT_TOPOLOGICAL | pygit2.GIT_SORT_TIME)
+        if hide:
+            walker.hide(repo.revparse_single(hide).peel(pygit2.Commit).id)
+
+        revisions = []
+        for commit in walker:
+            if since_ts is not None and commit.commit_time < since_ts:
+                break
+
+            revisions.append(self._commit2dict(commit))
+            if max_count and len(revisions) >= max_count:
+                break
+
+        revisions.reverse()
+        return revisions
+
+    def _commit2dict(self, commit):
+        # The title is the first paragraph of the message, like
+        # git log %s, and the body is the rest.
+        parts = commit.message.strip().split('\n\n', 1)
+        title = ' '.join(parts[0].splitlines())
+        body = parts[1] if len(parts) > 1 else ''
+        date = datetime.fromtimestamp(commit.author.time, tz=timezone.utc)
+        return {'commit': str(commit.id), 'commit_date': date,
+                'author': commit.author.name, 'title': title, 'body': body}
+
+    async def _get_blob_ids(self, path, commits):
+        if pygit2 is None:  # pragma no cover
+            r = await super()._get_blob_ids(path, commits)
+            return r
+
+        r = await run_in_thread(self._read_blob_ids, path, commits)
+        return r
+
+    def _read_blob_ids(self, path, commits):
+        # Runs in a thread.
+        repo = pygit2.Repository(self.workdir)
+        blobs = {}
+        for commit in commits:
+            try:
+                tree = repo.revparse_single(commit).peel(pygit2.Tree)
+                entry = tree[path]
+            except (KeyError, ValueError):
+                continue
+
+            if entry.type_str == 'blob':
+                blobs[commit] = str(entry.id)
+        return blobs
+
+    async def _read_blobs(self, blob_ids):
+        if pygit2 is None:  # pragma no cover
+            r = await super()._read_blobs(blob_ids)
+            return r
+
+        contents = await run_in_thread(self._read_local_blobs, blob_ids)
+        # In a partial clone the blobs may not be here. The git command
+        # downloads them.
+        missing = [b for b in blob_ids if b not in contents]
+        if missing:
+            contents.update(await super()._read_blobs(missing))
+        return contents
+
+    def _read_local_blobs(self, blob_ids):
+        # Runs in a thread.
+        repo = pygit2.Repository(self.workdir)
+        contents = {}
+        for blob_id in blob_ids:
+            try:
+                blob = repo[blob_id]
+            except KeyError:
+                continue
+            contents[blob_id] = blob.data.decode(errors='replace')
+        return contents
+
+    async def get_remote_branches(self):
+        if pygit2 is None:  # pragma no cover
+            r = await super().get_remote_branches()
+            return r
+
+        await self._update_remote_prune()
+        heads = await self._get_remote_tracking_heads()
+        return set(heads.keys())
+
+    async def _get_remote_tracking_heads(self, remote_name='origin'):
+        if pygit2 is None:  # pragma no cover
+            r = await super()._get_remote_tracking_heads(remote_name)
+            return r
+
+        r = await run_in_thread(self._read_remote_heads, remote_name)
+        return r
+
+    def _read_remote_heads(self, remote_name):
+        # Runs in a thread.
+        repo = pygit2.Repository(self.workdir)
+        prefix = 'refs/remotes/{}/'.format(remote_name)
+        heads = {}
+        for name in repo.references:
+            if not name.startswith(prefix):
+                continue
+
+            ref = repo.references[name]
+            # origin/HEAD is a symbolic ref, not a branch. The target of
+            # symbolic refs is the name of other ref.
+            if not isinstance(ref.target, pygit2.Oid):
+                continue
+
+            heads[name[len(prefix):]] = str(ref.target)
+        return heads
+
+
+VCS_TYPES = {'git': Git,
+             'libgit2': LibGit2}
 
 
 def get_vcs(vcs_type):
@@ -25,7 +25,8 @@ import shutil
 import sys
 
 from toxicbuild.core.cmd import command, main
-from toxicbuild.core.utils import changedir, SettingsPatcher
+from toxicbuild.core.utils import (changedir, SettingsPatcher,
+                                   set_event_loop_policy)
 
 from . import ensure_indexes, create_settings
 
@@ -122,6 +123,7 @@ def start(workdir, daemonize=False, stdout=LOGFILE, stderr=LOGFILE,
         from . import settings
 
         SettingsPatcher().patch_pyro_settings(settings)
+        set_event_loop_policy(settings)
 
         def setup_fn():
             from toxicbuild.master import (create_settings_and_connect,
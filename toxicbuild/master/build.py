@@ -32,7 +32,8 @@ from mongoengine.queryset import queryset_manager
 from mongomotor import Document, EmbeddedDocument
 from mongomotor.fields import (StringField, ListField, EmbeddedDocumentField,
                                ReferenceField, DateTimeField, UUIDField,
-                               IntField, EmbeddedDocumentListField)
+                               IntField, EmbeddedDocumentListField,
+                               BooleanField)
 from toxicbuild.core.build_config import list_builders_from_config
 from toxicbuild.core.utils import (now, datetime2string, MatchKeysDict,
                                    format_timedelta, LoggerMixin,
@@ -205,6 +206,11 @@ class BuildStep(EmbeddedDocument):
     output = StringField()
     """The output of the step"""
 
+    output_truncated = BooleanField(default=False)
+    """Indicates if ``output`` has only the begining and the end of the
+    output. The full output is kept by the slave and can be fetched
+    with :meth:`~toxicbuild.master.slave.Slave.get_step_output`."""
+
     started = DateTimeField(default=None)
     """When the step stated. It msut be in UTC."""
 
@@ -229,6 +235,7 @@ class BuildStep(EmbeddedDocument):
 
         if output:
             objdict['output'] = self.output
+            objdict['output_truncated'] = self.output_truncated
 
         if not self.started:
             objdict['started'] = None
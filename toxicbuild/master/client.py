@@ -17,6 +17,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
+from toxicbuild.common.utils import get_connection_pool_settings
 from toxicbuild.core import BaseToxicClient
 from toxicbuild.core.exceptions import ToxicClientException
 from toxicbuild.core.utils import LoggerMixin, datetime2string
@@ -102,7 +103,8 @@ class BuildClient(BaseToxicClient, LoggerMixin):
                          'builder_name': builder_name,
                          'config_type': self.config_type,
                          'config_filename': self.config_filename,
-                         'builders_from': build.builders_from}}
+                         'builders_from': build.builders_from,
+                         'clone_options': repository.get_clone_options()}}
         if build.external:
             data['body']['external'] = build.external.to_dict()
 
@@ -115,6 +117,22 @@ class BuildClient(BaseToxicClient, LoggerMixin):
             build_info = r.get('body')
             yield build_info
 
+    async def get_step_output(self, step_uuid, offset=0):
+        """Asks the build server for part of the full output of a step.
+        Returns a dict with ``output``, the ``offset`` for the next
+        request and the ``size`` of the output.
+
+        :param step_uuid: The uuid of the step.
+        :param offset: From where the output should be read.
+        """
+        data = {'action': 'step_output',
+                'token': self.slave.token,
+                'body': {'step_uuid': step_uuid,
+                         'offset': offset}}
+        await self.write(data)
+        response = await self.get_response()
+        return response['body']
+
 
 async def get_build_client(slave, addr, port, use_ssl=True,
                            validate_cert=True):
@@ -159,6 +177,7 @@ class PollerClient(BaseToxicClient):
         dbrevisions = await self.repo.get_latest_revisions()
         since = dict((branch, datetime2string(r.commit_date)) for branch, r
                      in dbrevisions.items() if r)
+        since_commits = await self.repo.get_latest_commits()
 
         branches_conf = branches_conf or {
             b.name: {'notify_only_latest': b.notify_only_latest}
@@ -170,9 +189,12 @@ class PollerClient(BaseToxicClient):
             'vcs_type': self.repo.vcs_type,
             'known_branches': await self.repo.get_known_branches(),
             'since': since,
+            'since_commits': since_commits,
             'branches_conf': branches_conf,
             'external': external,
             'conffile': self.repo.config_filename,
+            'clone_options': self.repo.get_clone_options(),
+            'poll_concurrency': self.repo.poll_concurrency,
         }
         url = self.repo.get_url()
         self.log('Updating code with url {}'.format(url),
@@ -191,8 +213,11 @@ def get_poller_client(repo):
     port = settings.POLLER_PORT
     use_ssl = settings.POLLER_USES_SSL
     validate_cert = settings.VALIDATE_CERT_POLLER
+    use_pool = getattr(settings, 'USE_CONNECTION_POOL', False)
+    pool_kw = get_connection_pool_settings(settings)
     client = PollerClient(repo, host, port, use_ssl=use_ssl,
-                          validate_cert=validate_cert)
+                          validate_cert=validate_cert, use_pool=use_pool,
+                          pool_kw=pool_kw)
     return client
 
 
@@ -253,6 +278,9 @@ def get_secrets_client():
     port = settings.SECRETS_PORT
     use_ssl = settings.SECRETS_USES_SSL
     validate_cert = settings.VALIDATE_CERT_SECRETS
+    use_pool = getattr(settings, 'USE_CONNECTION_POOL', False)
+    pool_kw = get_connection_pool_settings(settings)
     client = SecretsClient(host, port, use_ssl=use_ssl,
-                           validate_cert=validate_cert)
+                           validate_cert=validate_cert, use_pool=use_pool,
+                           pool_kw=pool_kw)
     return client
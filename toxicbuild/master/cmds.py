@@ -29,7 +29,8 @@ import shutil
 from toxicbuild.common import common_setup
 from toxicbuild.core.cmd import command, main
 from toxicbuild.core.utils import (daemonize as daemon,
-                                   bcrypt_string, changedir, set_loglevel, log)
+                                   bcrypt_string, changedir, set_loglevel, log,
+                                   set_event_loop_policy)
 from . import (
     ENVVAR,
     DEFAULT_SETTINGS,
@@ -220,6 +221,8 @@ def run(loglevel):
 
     from . import settings
 
+    set_event_loop_policy(settings)
+
     hole_host = settings.HOLE_ADDR
     hole_port = settings.HOLE_PORT
     try:
@@ -239,6 +242,7 @@ def run(loglevel):
 
     server = HoleServer(hole_host, hole_port,
                         use_ssl=use_ssl,
+                        metrics_port=getattr(settings, 'METRICS_PORT', None),
                         certfile=certfile,
                         keyfile=keyfile)
 
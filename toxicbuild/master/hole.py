@@ -33,6 +33,7 @@ from bson.objectid import ObjectId
 from mongoengine.errors import NotUniqueError
 from toxicbuild.common.exchanges import ui_notifications
 from toxicbuild.core import BaseToxicProtocol
+from toxicbuild.core.metrics import MetricsHTTPServer
 from toxicbuild.core.utils import (LoggerMixin, datetime2string,
                                    now, localtime2utc)
 from toxicbuild.master import settings
@@ -52,10 +53,22 @@ from toxicbuild.master.signals import (step_started, step_finished,
                                        buildset_added, build_preparing)
 from toxicbuild.master.users import User, Organization, ResetUserPasswordToken
 
+# How many requests may be sent in one batch.
+MAX_BATCH_REQUESTS = 100
+
+# maps the exceptions raised by the actions to the codes sent
+# to the clients.
+ERROR_STATUSES = {User.DoesNotExist: 2,
+                  NotEnoughPerms: 3,
+                  ResetUserPasswordToken.DoesNotExist: 4,
+                  NotUniqueError: 5,
+                  Repository.DoesNotExist: 6}
+
 
 class UIHole(BaseToxicProtocol, LoggerMixin):
 
     encrypted_token = settings.ACCESS_TOKEN
+    max_frame_len = getattr(settings, 'MAX_FRAME_LEN', None)
     _shutting_down = False
 
     def __init__(self, *args, **kwargs):
@@ -82,11 +95,6 @@ class UIHole(BaseToxicProtocol, LoggerMixin):
             return None
 
         data = self.data.get('body') or {}
-        statuses = {User.DoesNotExist: 2,
-                    NotEnoughPerms: 3,
-                    ResetUserPasswordToken.DoesNotExist: 4,
-                    NotUniqueError: 5,
-                    Repository.DoesNotExist: 6}
 
         if self.action != 'user-authenticate':
             # when we are authenticating we don't need (and we can't have)
@@ -114,7 +122,7 @@ class UIHole(BaseToxicProtocol, LoggerMixin):
 
         except Exception as e:
             msg = traceback.format_exc()
-            status = statuses.get(type(e), 1)
+            status = ERROR_STATUSES.get(type(e), 1)
             await self.send_response(code=status, body={'error': msg})
             self.close_connection()
 
@@ -162,6 +170,7 @@ class HoleHandler:
     * `user-authenticate`
     * `user-get`
     * `user-exists`
+    * `batch`
     """
 
     def __init__(self, data, action, protocol):
@@ -171,18 +180,62 @@ class HoleHandler:
 
     async def handle(self):
 
-        attrname = self.action.replace('-', '_')
+        r = await self._run_action(self.action, self.data)
+
+        await self.protocol.send_response(code=0, body=r)
+        self.protocol.close_connection()
+
+    async def _run_action(self, action, data):
+        attrname = action.replace('-', '_')
         try:
             func = getattr(self, attrname)
         except AttributeError:
-            raise UIFunctionNotFound(self.action)
+            raise UIFunctionNotFound(action)
 
-        r = func(**self.data)
+        r = func(**data)
         if asyncio.coroutines.iscoroutine(r):
             r = await r
+        return r
 
-        await self.protocol.send_response(code=0, body=r)
-        self.protocol.close_connection()
+    async def _run_batch_entry(self, request):
+        try:
+            if not isinstance(request, dict) or \
+               set(request.keys()) - {'action', 'body'}:
+                raise ValueError('Bad batch request {!r}'.format(request))
+
+            action = request.get('action') or ''
+            body = request.get('body') or {}
+            # Only the actions listed in list-funcs, but no nested batches.
+            attrname = action.replace('-', '_')
+            if attrname == 'batch' or \
+               attrname not in self._get_action_methods():
+                raise UIFunctionNotFound(action)
+
+            r = await self._run_action(action, body)
+            response = {'code': 0, 'body': r}
+        except Exception as e:
+            status = ERROR_STATUSES.get(type(e), 1)
+            response = {'code': status,
+                        'body': {'error': traceback.format_exc()}}
+        return response
+
+    async def batch(self, requests):
+        """Runs many actions concurrently with the permissions of
+        the requester. Returns a list with one response, with
+        ``code`` and ``body``, for each request in the same
+        order of the requests. A failed action does not affect
+        the others.
+
+        :param requests: A list of dicts with ``action`` and ``body``.
+          At most :const:`MAX_BATCH_REQUESTS` requests."""
+
+        if len(requests) > MAX_BATCH_REQUESTS:
+            raise ValueError('Max {} requests in a batch'.format(
+                MAX_BATCH_REQUESTS))
+
+        responses = await asyncio.gather(
+            *[self._run_batch_entry(r) for r in requests])
+        return {'batch': responses}
 
     def _get_method_signature(self, method):
         sig = inspect.signature(method)
@@ -1141,13 +1194,16 @@ class HoleServer(LoggerMixin):
     protocol."""
 
     def __init__(self, addr='127.0.0.1', port=6666, loop=None, use_ssl=False,
-                 **ssl_kw):
+                 metrics_port=None, **ssl_kw):
         """:param addr: Address from which the server is allowed to receive
         requests. If ``0.0.0.0``, receives requests from all addresses.
         :param port: The port for the master to listen.
         :param loop: A main loop. If none, ``asyncio.get_event_loop()``
           will be used.
         :param use_ssl: Indicates is the connection uses ssl or not.
+        :param metrics_port: A port to serve the metrics in the prometheus
+          text format over http. If None the metrics are not served over
+          http.
         :param ssl_kw: Named arguments passed to
           ``ssl.SSLContext.load_cert_chain()``
         """
@@ -1156,6 +1212,7 @@ class HoleServer(LoggerMixin):
         self.addr = addr
         self.port = port
         self.use_ssl = use_ssl
+        self.metrics_port = metrics_port
         self.ssl_kw = ssl_kw
         signal.signal(signal.SIGTERM, self.sync_shutdown)
 
@@ -1173,6 +1230,10 @@ class HoleServer(LoggerMixin):
 
         ensure_future(coro)
 
+        if self.metrics_port:
+            metrics_server = MetricsHTTPServer(self.addr, self.metrics_port)
+            ensure_future(metrics_server.start())
+
     async def shutdown(self):
         self.log('Shutting down')
         self.protocol.set_shutting_down()
@@ -154,6 +154,23 @@ class Repository(OwnedDocument, utils.LoggerMixin):
     latest_buildset = EmbeddedDocumentField(LatestBuildSet)
     """The most recent buildset for a repository."""
 
+    clone_depth = IntField()
+    """The depth used to clone the repository. If None a shallow clone
+    with depth 2 is done. If 0 the whole history is cloned. When set,
+    the fetches keep the repository shallow."""
+
+    clone_filter = StringField()
+    """A filter for a partial clone, ie: ``blob:none``. The objects
+    filtered are downloaded only when needed."""
+
+    sparse_paths = ListField(StringField())
+    """Directories checked out in a sparse checkout. If empty the whole
+    tree is checked out."""
+
+    poll_concurrency = IntField()
+    """How many branches have their revisions read at the same time
+    when polling. If None the poller default is used."""
+
     meta = {
         'ordering': ['name'],
     }
@@ -259,11 +276,20 @@ class Repository(OwnedDocument, utils.LoggerMixin):
                  'branches': [b.to_dict() for b in self.branches],
                  'slaves': [s.to_dict(id_as_str=True) for s in slaves],
                  'parallel_builds': self.parallel_builds,
-                 'envvars': self.envvars}
+                 'envvars': self.envvars,
+                 'clone_options': self.get_clone_options()}
             )
 
         return my_dict
 
+    def get_clone_options(self):
+        """Returns the options for clones of the repository in the
+        format used by :class:`~toxicbuild.core.vcs.VCS`."""
+
+        return {'depth': self.clone_depth,
+                'filter': self.clone_filter,
+                'sparse_paths': list(self.sparse_paths)}
+
     async def get_status(self):
         """Returns the status for the repository. The status is the
         status of the last buildset created for this repository that is
@@ -524,6 +550,22 @@ class Repository(OwnedDocument, utils.LoggerMixin):
 
         return revs
 
+    async def get_latest_commits(self):
+        """ Returns the last commit seen for all known branches in the
+        format {branch_name: commit}.
+        """
+        # ordered by id, not commit date, so we get the last one
+        # added here, no matter the clock of who commited.
+        pipeline = [
+            {'$sort': {'_id': -1}},
+            {'$group': {'_id': '$branch',
+                        'commit': {'$first': '$commit'}}},
+        ]
+        qs = RepositoryRevision.objects.filter(repository=self)
+        docs = await qs.aggregate(pipeline).to_list(None)
+        commits = {doc['_id']: doc['commit'] for doc in docs}
+        return commits
+
     async def get_known_branches(self):
         """ Returns the names for the branches that already have some
         revision here.
@@ -337,6 +337,23 @@ class Slave(OwnedDocument, LoggerMixin):
 
         return list(builder_instnces)
 
+    async def get_step_output(self, step_uuid):
+        """Fetches the full output of a step from the build server.
+        This is an asynchronous generator that yields the output in
+        pieces.
+
+        :param step_uuid: The uuid of the step which output was truncated.
+        """
+        offset = 0
+        size = None
+        while size is None or offset < size:
+            # The build server closes the connection after each
+            # response so each piece needs a new client.
+            with (await self.get_client()) as client:
+                r = await client.get_step_output(str(step_uuid), offset)
+            offset, size = r['offset'], r['size']
+            yield r['output']
+
     async def _finish_build_start_exception(self, build, repo, exc_out):
         build.status = 'exception'
         build.steps = [BuildStep(repository=repo, name='Exception',
@@ -463,6 +480,8 @@ class Slave(OwnedDocument, LoggerMixin):
                     else requested_step.output + output
             else:
                 requested_step.output = output
+            requested_step.output_truncated = step_info.get(
+                'output_truncated', False)
             requested_step.finished = string2datetime(finished)
             requested_step.total_time = step_info['total_time']
             await build.update()
@@ -29,7 +29,8 @@ from uuid import uuid4
 from toxicbuild.common import common_setup
 from toxicbuild.core.cmd import command, main
 from toxicbuild.core.utils import (changedir, log, daemonize as daemon,
-                                   SettingsPatcher, set_loglevel)
+                                   SettingsPatcher, set_loglevel,
+                                   set_event_loop_policy)
 from toxicbuild.integrations import (
     create_settings as create_settings_integrations)
 
@@ -89,6 +90,7 @@ def start(workdir, daemonize=False, stdout=LOGFILE, stderr=LOGFILE,
         from . import settings
 
         SettingsPatcher().patch_pyro_settings(settings)
+        set_event_loop_policy(settings)
 
         from pyrocumulus.commands.base import get_command
 
@@ -33,7 +33,8 @@ from toxicbuild.core.utils import (
     set_loglevel,
     changedir,
     bcrypt_string,
-    daemonize as daemon
+    daemonize as daemon,
+    set_event_loop_policy
 )
 from . import create_settings, DEFAULT_SETTINGS
 
@@ -115,6 +116,8 @@ def start(workdir, daemonize=False, stdout=LOGFILE, stderr=LOGFILE,
     ToxicZKClient.settings = settings
     BaseInterface.settings = settings
 
+    set_event_loop_policy(settings)
+
     addr = settings.ADDR
     port = settings.PORT
     try:
@@ -190,8 +193,11 @@ def restart(workdir, pidfile=PIDFILE, loglevel='info'):
 def poller_init(addr, port, use_ssl, certfile, keyfile, loglevel):
 
     from toxicbuild.poller.server import run_server
+    from . import settings
     set_loglevel(loglevel)
     run_server(addr, port, use_ssl=use_ssl,
+               metrics_port=getattr(settings, 'METRICS_PORT', None),
+               workers=getattr(settings, 'WORKERS', 1),
                certfile=certfile, keyfile=keyfile)
 
 
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# Copyright 2023 Juca Crispim <juca@poraodojuca.net>
+
+# This file is part of toxicbuild.
+
+# toxicbuild is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# toxicbuild is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU Affero General Public License
+# along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+
+from toxicbuild.core.utils import LoggerMixin
+
+
+class PollLimiter(LoggerMixin):
+    """Limits how many polls run at the same time. The polls waiting
+    for a slot are grouped by host and the hosts are served in turns,
+    so a lot of polls for one host do not delay the polls for the
+    other hosts.
+
+    .. code-block:: python
+
+       async with limiter.slot('github.com'):
+           await poller.poll()
+    """
+
+    def __init__(self, limit, per_host_limit=None):
+        """:param limit: How many polls run at the same time.
+        :param per_host_limit: How many polls for the same host run at
+          the same time. If None only ``limit`` is used.
+        """
+        self.limit = limit
+        self.per_host_limit = per_host_limit or limit
+        self.running = 0
+        self._running_hosts = defaultdict(int)
+        # {host: deque([waiter, ...])} in the order the hosts are served.
+        self._waiting = OrderedDict()
+
+    @property
+    def waiting(self):
+        """How many polls are waiting for a slot."""
+        return sum(len(w) for w in self._waiting.values())
+
+    @asynccontextmanager
+    async def slot(self, host):
+        """Waits for a slot to poll a repository in ``host``.
+
+        :param host: The host of the repository."""
+
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiting.setdefault(host, deque()).append(waiter)
+        self._wakeup()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # We may have got the slot right before the cancellation.
+            if waiter.done() and not waiter.cancelled():
+                self._release(host)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(host)
+
+    def _release(self, host):
+        self.running -= 1
+        self._running_hosts[host] -= 1
+        if not self._running_hosts[host]:
+            del self._running_hosts[host]
+        self._wakeup()
+
+    def _wakeup(self):
+        # Gives the free slots to the waiters, one host at a time.
+        served = True
+        while served and self.running < self.limit:
+            served = False
+            for host in list(self._waiting.keys()):
+                if self.running >= self.limit:
+                    break
+
+                if self._running_hosts.get(host, 0) >= self.per_host_limit:
+                    continue
+
+                waiters = self._waiting[host]
+                waiter = waiters.popleft()
+                if waiters:
+                    # Goes to the end of the line so the other hosts
+                    # are served first.
+                    self._waiting.move_to_end(host)
+                else:
+                    del self._waiting[host]
+
+                served = True
+                if waiter.done():
+                    # cancelled while waiting
+                    continue
+
+                self.running += 1
+                self._running_hosts[host] += 1
+                waiter.set_result(None)
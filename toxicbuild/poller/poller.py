@@ -27,11 +27,12 @@ from toxicbuild.core.utils import (
     LoggerMixin,
     MatchKeysDict,
     datetime2string,
-    read_file
 )
 from toxicbuild.poller import settings
 
 POLLER_TIMEOUT = 60  # secs
+# How many revisions at most are returned for a branch in one poll.
+MAX_REVISIONS_PER_BRANCH = 100
 
 
 class Poller(LoggerMixin):
@@ -41,7 +42,8 @@ class Poller(LoggerMixin):
     """
 
     def __init__(self, repo_id, url, branches_conf, since, known_branches,
-                 vcs_type, conffile='toxicbuild.yml'):
+                 vcs_type, conffile='toxicbuild.yml', since_commits=None,
+                 clone_options=None, concurrency=None):
         """Constructor for Poller.
 
         :param repo_id: The id of the repository that will update or clone
@@ -54,17 +56,31 @@ class Poller(LoggerMixin):
           a revision.
         :param vcs_type: Vcs type for :func:`toxicbuild.core.vcs.get_vcs`.
         :param conffile: The name of the build config file.
+        :param since_commits: A dict in the format {'branch-name': commit}
+          with the last known commit for the branch. When we know the
+          last commit of a branch it is used instead of ``since``.
+        :param clone_options: The options for the clone of the repository.
+          See :class:`~toxicbuild.core.vcs.VCS`.
+        :param concurrency: How many branches have their revisions read
+          at the same time. If None the ``POLL_CONCURRENCY`` setting is
+          used.
         """
         self.repo_id = repo_id
         self.url = url
         self.branches_conf = branches_conf
         self.known_branches = known_branches
         self.since = since
+        self.since_commits = since_commits or {}
         self.vcs_type = vcs_type
-        self.vcs = get_vcs(self.vcs_type)(self.workdir)
+        self.vcs = get_vcs(self.vcs_type)(
+            self.workdir,
+            mirrors_dir=getattr(settings, 'GIT_MIRRORS_DIR', None),
+            clone_options=clone_options)
         self.external_info = None
         self.local_branch = False
         self.conffile = conffile
+        self.concurrency = concurrency or getattr(
+            settings, 'POLL_CONCURRENCY', None)
         self._lock = None
 
     @property
@@ -168,11 +184,15 @@ class Poller(LoggerMixin):
 
         if self.local_branch:
             newer_revisions = await self.vcs.get_local_revisions(
-                since=self.since, branches=branches)
+                since=self.since, branches=branches,
+                concurrency=self.concurrency)
 
         else:
             newer_revisions = await self.vcs.get_revisions(
-                since=self.since, branches=branches)
+                since=self.since, branches=branches,
+                since_commits=self.since_commits,
+                max_count=self._get_max_count(),
+                concurrency=self.concurrency)
 
         revisions = []
         for branch, revs in newer_revisions.items():
@@ -197,9 +217,31 @@ class Poller(LoggerMixin):
                                                  builders_fallback,
                                                  revisions)
 
+        # The configs for all revisions are read at once from the
+        # repository objects. No need to checkout.
+        configs = await self.vcs.get_file_contents(
+            self.conffile, [rev['commit'] for rev in revisions])
+        for rev in revisions:
+            rev['config'] = configs.get(rev['commit'], '')
+
         self.log('Processing changes done!', level='debug')
         return revisions
 
+    def _get_max_count(self):
+        """Returns how many revisions we need for the branches. When
+        we notify only the latest revision that is the only one we need.
+        """
+        limit = getattr(settings, 'MAX_REVISIONS_PER_BRANCH',
+                        MAX_REVISIONS_PER_BRANCH)
+        max_count = MatchKeysDict(
+            **{name: 1 if conf.get('notify_only_latest') else limit
+               for name, conf in self.branches_conf.items()})
+        # Branches without config notify only the latest revision.
+        # This must be the last one so it does not match before
+        # the configured branches.
+        max_count.setdefault('*', 1)
+        return max_count
+
     async def _process_branch_revisions(self, branch, revisions,
                                         notify_only_latest, builders_fallback,
                                         to_notify):
@@ -214,7 +256,6 @@ class Poller(LoggerMixin):
             rev['external'] = self.external_info
             rev['builders_fallback'] = builders_fallback
             rev['commit_date'] = datetime2string(rev['commit_date'])
-            rev['config'] = await self._get_config(rev['commit'])
 
             to_notify.append(rev)
             # branch_revs just for logging
@@ -223,15 +264,3 @@ class Poller(LoggerMixin):
         msg = '{} new revisions for {} on branch {} added'
         self.log(msg.format(len(branch_revs), self.url,
                             branch))
-
-    async def _get_config(self, commit):
-        await self.vcs.checkout(commit)
-        path = os.path.join(self.vcs.workdir, self.conffile)
-        try:
-            config = await read_file(path)
-        except FileNotFoundError:
-            r = ''
-        else:
-            r = config
-
-        return r
@@ -16,14 +16,46 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 from functools import partial
+import json
+import weakref
 
 from toxicbuild.core.protocol import BaseToxicProtocol
 from toxicbuild.core.server import ToxicServer
 from toxicbuild.core.utils import log, string2datetime
+from toxicbuild.core.vcs import get_url_host
 from toxicbuild.poller import settings
+from toxicbuild.poller.limiter import PollLimiter
 from toxicbuild.poller.poller import Poller
 
+# How many polls run at the same time in a poller process.
+MAX_CONCURRENT_POLLS = 20
+# How many polls for repositories in the same host run at the same time.
+MAX_CONCURRENT_POLLS_PER_HOST = 5
+
+# Polls requested but not started yet in the format {poll_key: task}.
+# Equal requests wait for the same poll.
+_PENDING_POLLS = {}
+# Only one poll for a repository runs at a time in the format
+# {repo_id: lock}. The locks are gone when no poll uses them.
+_REPO_LOCKS = weakref.WeakValueDictionary()
+_LIMITER = None
+
+
+def get_limiter():
+    """Returns the :class:`~toxicbuild.poller.limiter.PollLimiter` shared
+    by all polls in this process."""
+
+    global _LIMITER
+
+    if _LIMITER is None:
+        _LIMITER = PollLimiter(
+            getattr(settings, 'MAX_CONCURRENT_POLLS', MAX_CONCURRENT_POLLS),
+            getattr(settings, 'MAX_CONCURRENT_POLLS_PER_HOST',
+                    MAX_CONCURRENT_POLLS_PER_HOST))
+    return _LIMITER
+
 
 class PollerProtocol(BaseToxicProtocol):
 
@@ -31,6 +63,10 @@ class PollerProtocol(BaseToxicProtocol):
     def encrypted_token(self):  # pragma no cover
         return settings.ACCESS_TOKEN
 
+    @property
+    def max_frame_len(self):
+        return getattr(settings, 'MAX_FRAME_LEN', None)
+
     async def client_connected(self):
         assert self.action == 'poll', 'Bad Action'
         self.log('client polling', level='debug')
@@ -49,12 +85,30 @@ class PollerProtocol(BaseToxicProtocol):
             since = {k: string2datetime(v) for k, v in body['since'].items()}
         else:
             since = {}
+        since_commits = body.get('since_commits') or {}
         known_branches = body['known_branches']
         branches_conf = body['branches_conf']
         external = body.get('external')
         conffile = body.get('conffile', 'toxicbuild.yml')
+        clone_options = body.get('clone_options')
+        concurrency = body.get('poll_concurrency')
+
+        key = self._get_poll_key(body)
+        poll = _PENDING_POLLS.get(key)
+        if poll is not None:
+            # The same poll, with the same known state of the repo, was
+            # requested and did not start yet, so we wait for it instead
+            # of polling again.
+            self.log('Joining the poll for {}'.format(url), level='debug')
+            r = await asyncio.shield(poll)
+            # The requests are the same so only one of them receives the
+            # revisions, otherwise they would be added more than once.
+            r = dict(r, revisions=[], coalesced=True)
+            return r
+
         poller = Poller(repo_id, url, branches_conf, since, known_branches,
-                        vcs_type, conffile)
+                        vcs_type, conffile, since_commits=since_commits,
+                        clone_options=clone_options, concurrency=concurrency)
         if external:
             external_url = external.get('url')
             external_name = external.get('name')
@@ -65,7 +119,39 @@ class PollerProtocol(BaseToxicProtocol):
         else:
             pollfn = poller.poll
 
-        r = await pollfn()
+        poll = asyncio.ensure_future(
+            self._run_poll(key, repo_id, get_url_host(url), pollfn))
+        _PENDING_POLLS[key] = poll
+        r = await asyncio.shield(poll)
+
+        return r
+
+    def _get_poll_key(self, body):
+        # Requests with the same key are the same poll. All the body is
+        # used so requests with a different known state for the repo,
+        # ie: since or known_branches, are not the same poll.
+        body = dict(body, known_branches=sorted(body['known_branches']))
+        return (body['repo_id'], json.dumps(body, sort_keys=True))
+
+    async def _run_poll(self, key, repo_id, host, pollfn):
+        # Waits for the poll running for the repository and for a
+        # slot in the limiter and then polls.
+        task = asyncio.current_task()
+        lock = _REPO_LOCKS.get(repo_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            _REPO_LOCKS[repo_id] = lock
+        try:
+            async with lock:
+                async with get_limiter().slot(host):
+                    # From here the requests start a new poll so they
+                    # don't miss the changes pushed during this one.
+                    if _PENDING_POLLS.get(key) is task:
+                        del _PENDING_POLLS[key]
+                    r = await pollfn()
+        finally:
+            if _PENDING_POLLS.get(key) is task:
+                del _PENDING_POLLS[key]
 
         return r
 
@@ -76,7 +162,8 @@ class PollerServer(ToxicServer):
 
 
 def run_server(addr='0.0.0.0', port=1234, loop=None, use_ssl=False,
-               **ssl_kw):  # pragma no cover
+               metrics_port=None, workers=1, **ssl_kw):  # pragma no cover
     log('Serving at {}'.format(port))
-    with PollerServer(addr, port, loop, use_ssl, **ssl_kw) as server:
+    with PollerServer(addr, port, loop, use_ssl, metrics_port=metrics_port,
+                      workers=workers, **ssl_kw) as server:
         server.start()
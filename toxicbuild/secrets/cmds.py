@@ -31,7 +31,8 @@ from toxicbuild.core.utils import (
     set_loglevel,
     changedir,
     bcrypt_string,
-    daemonize as daemon
+    daemonize as daemon,
+    set_event_loop_policy
 )
 from . import create_settings, DEFAULT_SETTINGS
 
@@ -132,6 +133,8 @@ def start(workdir, daemonize=False, stdout=LOGFILE, stderr=LOGFILE,
     create_settings()
     from . import settings
 
+    set_event_loop_policy(settings)
+
     addr = settings.ADDR
     port = settings.PORT
     try:
@@ -208,9 +211,12 @@ def secrets_init(addr, port, use_ssl, certfile, keyfile, loglevel):
 
     from toxicbuild.secrets.server import run_server
     from toxicbuild.secrets.crypto import Secret
+    from . import settings
     Secret.ensure_indexes()
     set_loglevel(loglevel)
     run_server(addr, port, use_ssl=use_ssl,
+               metrics_port=getattr(settings, 'METRICS_PORT', None),
+               workers=getattr(settings, 'WORKERS', 1),
                certfile=certfile, keyfile=keyfile)
 
 
@@ -37,6 +37,10 @@ class SecretsProtocol(BaseToxicProtocol):
     def encrypted_token(self):  # pragma no cover
         return settings.ACCESS_TOKEN
 
+    @property
+    def max_frame_len(self):
+        return getattr(settings, 'MAX_FRAME_LEN', None)
+
     async def client_connected(self):
         assert self.action in type(self).actions, 'Bad Action'
         fname = self.action.replace('-', '_')
@@ -91,7 +95,8 @@ class SecretsServer(ToxicServer):
 
 
 def run_server(addr='0.0.0.0', port=1234, loop=None, use_ssl=False,
-               **ssl_kw):  # pragma no cover
+               metrics_port=None, workers=1, **ssl_kw):  # pragma no cover
     log('Serving at {}'.format(port))
-    with SecretsServer(addr, port, loop, use_ssl, **ssl_kw) as server:
+    with SecretsServer(addr, port, loop, use_ssl, metrics_port=metrics_port,
+                       workers=workers, **ssl_kw) as server:
         server.start()
@@ -21,13 +21,35 @@ import asyncio
 from copy import copy
 import functools
 import os
+import tempfile
 from uuid import uuid4
 from toxicbuild.core.exceptions import ExecCmdError
+from toxicbuild.core.output import OutputBuffer, remove_old_outputs
 from toxicbuild.core.utils import (exec_cmd, LoggerMixin, datetime2string,
                                    now, string2datetime, localtime2utc)
+from toxicbuild.slave import settings
 from toxicbuild.slave.exceptions import BadPluginConfig
 
 
+def get_step_output_dir():
+    """Returns the directory where the full output of the steps
+    is written when it is too big to be kept in memory."""
+
+    default = os.path.join(tempfile.gettempdir(), 'toxicbuild-step-output')
+    return getattr(settings, 'STEP_OUTPUT_DIR', None) or default
+
+
+def get_step_output_path(step_uuid):
+    """Returns the path of the file with the full output of a step.
+
+    :param step_uuid: The uuid of the step."""
+
+    # the uuid comes from the clients so we don't let it go
+    # somewhere else in the file system.
+    name = os.path.basename(str(step_uuid))
+    return os.path.join(get_step_output_dir(), '{}.log'.format(name))
+
+
 class Builder(LoggerMixin):
 
     """ A builder executes build steps. Builders are configured in
@@ -137,6 +159,7 @@ class Builder(LoggerMixin):
                       'finished': None, 'info_type': 'build_info'}
 
         await self.manager.send_info(build_info)
+        self._remove_old_step_outputs()
         last_step_status = None
         last_step_output = None
         last_step_finished = None
@@ -163,10 +186,12 @@ class Builder(LoggerMixin):
 
             out_fn = functools.partial(self._send_step_output_info, step_info)
 
-            step_exec_output = await step.execute(
-                cwd=self._get_tmp_dir(), out_fn=out_fn,
-                last_step_status=last_step_status,
-                last_step_output=last_step_output, **envvars)
+            with self._get_step_output_buffer(step_info['uuid']) as output:
+                step_exec_output = await step.execute(
+                    cwd=self._get_tmp_dir(), out_fn=out_fn,
+                    last_step_status=last_step_status,
+                    last_step_output=last_step_output,
+                    output_buffer=output, **envvars)
             step_info.update(step_exec_output)
             await self._flush_step_output_buff(step_info['uuid'])
 
@@ -203,14 +228,23 @@ class Builder(LoggerMixin):
 
         return build_info
 
+    def _get_step_output_buffer(self, step_uuid):
+        output_dir = get_step_output_dir()
+        os.makedirs(output_dir, exist_ok=True)
+        return OutputBuffer(spill_path=get_step_output_path(step_uuid))
+
+    def _remove_old_step_outputs(self):
+        max_age = getattr(settings, 'STEP_OUTPUT_MAX_AGE', 7 * 24 * 3600)
+        remove_old_outputs(get_step_output_dir(), max_age)
+
     def _clear_step_output_buff(self):
         self._step_output_buff = []
         self._current_step_output_index = None
         self._current_step_output_buff_len = 0
 
-    async def _send_step_output_info(self, step_info, line_index, line):
-        self._step_output_buff.append(line)
-        self._current_step_output_buff_len += len(line)
+    async def _send_step_output_info(self, step_info, line_index, lines):
+        self._step_output_buff.extend(lines)
+        self._current_step_output_buff_len += sum(len(line) for line in lines)
 
         if not self._current_step_output_buff_len > self.STEP_OUTPUT_BUFF_LEN:
             return
@@ -292,23 +326,28 @@ class BuildStep:
 
         return self.command == other.command
 
-    async def exec_cmd(self, cmd, cwd, timeout, out_fn, **envvars):
+    async def exec_cmd(self, cmd, cwd, timeout, out_fn, output_buffer=None,
+                       **envvars):
         output = await exec_cmd(cmd, cwd=cwd,
                                 timeout=self.timeout,
-                                out_fn=out_fn, **envvars)
+                                out_fn=out_fn, output=output_buffer,
+                                **envvars)
         return output
 
     async def execute(self, cwd, out_fn=None, last_step_status=None,
-                      last_step_output=None, **envvars):
+                      last_step_output=None, output_buffer=None, **envvars):
         """Executes the step command.
 
         :param cwd: Directory where the command will be executed.
-        :param out_fn: Function used to handle each line of the
+        :param out_fn: Function used to handle the lines of the
           command output.
         :param last_step_status: The status of the step before this one
           in the build.
         :param last_step_output: The output of the step before this one
           in the build.
+        :param output_buffer: A :class:`~toxicbuild.core.output.OutputBuffer`
+          to capture the output of the command. If None the whole output
+          is kept in memory.
         :param envvars: Environment variables to be used on execution.
 
         .. note::
@@ -324,7 +363,9 @@ class BuildStep:
             cmd = await self.get_command()
             output = await self.exec_cmd(cmd, cwd=cwd,
                                          timeout=self.timeout,
-                                         out_fn=out_fn, **envvars)
+                                         out_fn=out_fn,
+                                         output_buffer=output_buffer,
+                                         **envvars)
             status = 'success'
         except ExecCmdError as e:
             status = 'fail'
@@ -339,5 +380,9 @@ class BuildStep:
 
         step_status['status'] = status
         step_status['output'] = output
+        # When the output is truncated the full output can be
+        # fetched using the step_output action.
+        step_status['output_truncated'] = bool(
+            output_buffer and output_buffer.truncated)
 
         return step_status
@@ -27,7 +27,8 @@ from time import sleep
 
 from toxicbuild.core.cmd import command, main
 from toxicbuild.core.utils import (daemonize as daemon, bcrypt_string,
-                                   changedir, set_loglevel)
+                                   changedir, set_loglevel,
+                                   set_event_loop_policy)
 
 from . import create_settings
 
@@ -72,6 +73,8 @@ def start(workdir, daemonize=False, stdout=LOGFILE,
 
     from . import settings
 
+    set_event_loop_policy(settings)
+
     addr = settings.ADDR
     port = settings.PORT
     try:
@@ -207,9 +210,11 @@ def create(root_dir, no_token=False):
 
 def slave_init(addr, port, use_ssl, certfile, keyfile, loglevel):
     from toxicbuild.slave.server import run_server
+    from . import settings
 
     set_loglevel(loglevel)
     run_server(addr, port, use_ssl=use_ssl,
+               metrics_port=getattr(settings, 'METRICS_PORT', None),
                certfile=certfile, keyfile=keyfile)
 
 
@@ -34,7 +34,8 @@
 
 import asyncio
 import os
-from toxicbuild.core.utils import (exec_cmd, interpolate_dict_values,
+from toxicbuild.core.utils import (exec_cmd, exec_argv, get_envvars,
+                                   interpolate_dict_values,
                                    LoggerMixin)
 from toxicbuild.slave import settings
 from toxicbuild.slave.build import BuildStep, Builder
@@ -68,6 +69,9 @@ class DockerContainerBuilder(Builder):
         # Should we use a volume to keep the docker caches for
         # subsequent builds?
         self._dind_volume = getattr(settings, 'USE_DIND_VOLUME', False)
+        # The environment for the docker commands executed in the host.
+        # It is built only once as we execute lots of commands.
+        self.host_env = get_envvars({})
 
     def _get_name(self, name, workdir, platform):
         name = '{}-{}-{}'.format(
@@ -92,6 +96,16 @@ class DockerContainerBuilder(Builder):
                            'DOCKER_NEVER_REMOVE_CONTAINER', False):
                 await self.rm_container()
 
+    async def _exec_docker(self, *args, timeout=3600):
+        """Executes a docker command in the host without a shell.
+
+        :param args: The arguments for the docker command."""
+
+        cmd = [self.docker_cmd] + list(args)
+        self.log('Executing {}'.format(' '.join(cmd)), level='debug')
+        r = await exec_argv(cmd, cwd='.', timeout=timeout, env=self.host_env)
+        return r
+
     def _get_steps(self):
         # we must set the data dir here because
         # it is not the same as in the build running
@@ -112,14 +126,10 @@ class DockerContainerBuilder(Builder):
         msg = 'Checking if container exists'
         self.log(msg, level='debug')
 
-        opt = '' if only_running else '-a'
-        cmd = '{} container ps {} --filter name={}'.format(self.docker_cmd,
-                                                           opt, self.cname)
-        cmd += '| wc -l'
-        msg = 'Executing {}'.format(cmd)
-        self.log(msg, level='debug')
-        ret = await exec_cmd(cmd, cwd='.')
-        return int(ret) > 1
+        opts = [] if only_running else ['-a']
+        ret = await self._exec_docker('container', 'ps', *opts, '-q',
+                                      '--filter', 'name={}'.format(self.cname))
+        return bool(ret.strip())
 
     async def is_running(self):
         is_running = await self.container_exists(only_running=True)
@@ -130,8 +140,7 @@ class DockerContainerBuilder(Builder):
         machine.
         """
         try:
-            cmd = '{} info'.format(self.docker_cmd)
-            await exec_cmd(cmd, cwd='.')
+            await self._exec_docker('info')
             r = True
         except Exception:
             r = False
@@ -179,12 +188,15 @@ class DockerContainerBuilder(Builder):
         self.log('slave started', level='debug')
 
     def _get_dind_opts(self):
-        privileged = '--privileged' if self._is_dind else ''
-        vol_name = '{}-{}-volume'.format(self.manager.repo_id, self.name)
-        volume = '--mount source={},destination=/var/lib/docker/'.format(
-            vol_name) if self._is_dind and self._dind_volume else ''
-
-        dind_opts = '{} {}'.format(privileged, volume)
+        if not self._is_dind:
+            return []
+
+        dind_opts = ['--privileged']
+        if self._dind_volume:
+            vol_name = '{}-{}-volume'.format(self.manager.repo_id, self.name)
+            dind_opts += ['--mount',
+                          'source={},destination=/var/lib/docker/'.format(
+                              vol_name)]
         return dind_opts
 
     async def start_container(self):
@@ -194,48 +206,38 @@ class DockerContainerBuilder(Builder):
 
         if not exists:
             dind_opts = self._get_dind_opts()
-            cmd = '{} run -d -t {} --name {} {}'.format(self.docker_cmd,
-                                                        dind_opts,
-                                                        self.cname,
-                                                        self.image_name)
+            args = ['run', '-d', '-t'] + dind_opts + [
+                '--name', self.cname, self.image_name]
 
         else:
-            cmd = '{} start {}'.format(self.docker_cmd, self.cname)
+            args = ['start', self.cname]
 
-        self.log(cmd, level='debug')
-        await exec_cmd(cmd, cwd='.')
+        await self._exec_docker(*args)
         await self.wait_start()
 
     async def kill_container(self):
         msg = 'Killing container {}'.format(self.cname)
         self.log(msg, level='debug')
-        cmd = '{} kill {}'.format(self.docker_cmd, self.cname)
-        self.log(cmd, level='debug')
-        await exec_cmd(cmd, cwd='.')
+        await self._exec_docker('kill', self.cname)
 
     async def rm_container(self):
         msg = 'Removing container {}'.format(self.cname)
         self.log(msg, level='debug')
-        cmd = '{} rm {}'.format(self.docker_cmd, self.cname)
-        self.log(cmd, level='debug')
-        await exec_cmd(cmd, cwd='.')
+        await self._exec_docker('rm', self.cname)
 
     async def copy2container(self):
         """Recursive copy a directory to the container's src dir."""
 
         msg = 'Copying files to container {}'.format(self.cname)
         self.log(msg, level='debug')
-        cmd = '{} cp {} {}:{}'.format(
-            self.docker_cmd, self.workdir, self.cname, self.docker_src_dir)
-        self.log(cmd, level='debug')
-        await exec_cmd(cmd, cwd='.')
+        await self._exec_docker('cp', self.workdir, '{}:{}'.format(
+            self.cname, self.docker_src_dir))
 
         msg = 'Changing files perms in container {}'.format(self.cname)
         self.log(msg, level='debug')
-        cmd = '{} exec -u root -t {} chown -R {}:{} {}'.format(
-            self.docker_cmd, self.cname, self.docker_user, self.docker_user,
-            self.docker_src_dir)
-        await exec_cmd(cmd, cwd='.')
+        owner = '{}:{}'.format(self.docker_user, self.docker_user)
+        await self._exec_docker('exec', '-u', 'root', '-t', self.cname,
+                                'chown', '-R', owner, self.docker_src_dir)
 
     async def rm_from_container(self):
         """Removes the source code of a container that will not be removed.
@@ -244,12 +246,8 @@ class DockerContainerBuilder(Builder):
         msg = 'Removing files from container {}'.format(self.cname)
         self.log(msg, level='debug')
         # removing source dir
-        cmd = '{} exec -u root {} rm -rf {}'.format(self.docker_cmd,
-                                                    self.cname,
-                                                    self.docker_src_dir)
-        msg = 'Executing {}'.format(cmd)
-        self.log(msg, level='debug')
-        await exec_cmd(cmd, cwd='.', timeout=30)
+        await self._exec_docker('exec', '-u', 'root', self.cname,
+                                'rm', '-rf', self.docker_src_dir, timeout=30)
 
 
 class BuildStepDocker(BuildStep, LoggerMixin):
@@ -272,10 +270,10 @@ class BuildStepDocker(BuildStep, LoggerMixin):
                    step.timeout, step.stop_on_fail, container_name)
 
     async def _get_docker_env(self):
-        cmd = 'env'
-        envvars = ''
-        cmd = self._get_docker_cmd(cmd, envvars)
-        output = await exec_cmd(cmd, cwd='.')
+        cmd = [self.docker_cmd, 'exec', '-u', self.docker_user,
+               self.container_name, '/bin/bash', '-c',
+               'cd {} && env'.format(self.docker_src_dir)]
+        output = await exec_argv(cmd, cwd='.')
         env = {}
         for li in output.split('\n'):
             if not li:
@@ -309,7 +307,8 @@ class BuildStepDocker(BuildStep, LoggerMixin):
             envvars, self.docker_src_dir, cmd)
         return cmd
 
-    async def exec_cmd(self, cmd, cwd, timeout, out_fn, **envvars):
+    async def exec_cmd(self, cmd, cwd, timeout, out_fn, output_buffer=None,
+                       **envvars):
         cmd_envvars = await self._get_cmd_line_envvars(envvars)
 
         cmd = self._get_docker_cmd(cmd, cmd_envvars)
@@ -317,5 +316,6 @@ class BuildStepDocker(BuildStep, LoggerMixin):
         self.log('Executing {}'.format(cmd), level='debug')
         output = await exec_cmd(cmd, cwd='.',
                                 timeout=self.timeout,
-                                out_fn=out_fn, **envvars)
+                                out_fn=out_fn, output=output_buffer,
+                                **envvars)
         return output
@@ -47,7 +47,8 @@ class BuildManager(LoggerMixin):
 
     def __init__(self, protocol, repo_id, repo_url, vcs_type, branch,
                  named_tree, config_type='yml',
-                 config_filename='toxicbuild.yml', builders_from=None):
+                 config_filename='toxicbuild.yml', builders_from=None,
+                 clone_options=None):
         """
         :param manager: instance of :class:`toxicbuild.slave.BuildManager.`
         :param repo_id: The repository ID.
@@ -59,12 +60,17 @@ class BuildManager(LoggerMixin):
         :param config_filename: The name of the build config file.
         :param builders_from: If not None, builders to this branch will be used
           instead of builders for the current branch.
+        :param clone_options: The options for the clone of the repository.
+          See :class:`~toxicbuild.core.vcs.VCS`.
         """
         self.protocol = protocol
         self.repo_id = repo_id
         self.repo_url = repo_url
         self.vcs_type = vcs_type
-        self.vcs = get_vcs(vcs_type)(self.workdir)
+        self.vcs = get_vcs(vcs_type)(
+            self.workdir,
+            mirrors_dir=getattr(settings, 'GIT_MIRRORS_DIR', None),
+            clone_options=clone_options)
         self.branch = branch
         self.named_tree = named_tree
         self.config_type = config_type
@@ -18,9 +18,11 @@
 # along with toxicbuild. If not, see <http://www.gnu.org/licenses/>.
 
 import traceback
+from toxicbuild.core.output import read_output_file, READ_LEN
 from toxicbuild.core.protocol import BaseToxicProtocol
 from toxicbuild.core.utils import log, datetime2string, now
 from toxicbuild.slave import settings
+from toxicbuild.slave.build import get_step_output_path
 from toxicbuild.slave.managers import BuildManager
 from toxicbuild.slave.exceptions import (BadData, BadBuilderConfig)
 
@@ -30,6 +32,7 @@ class BuildServerProtocol(BaseToxicProtocol):
     """ A simple server for build requests.
     """
     encrypted_token = settings.ACCESS_TOKEN
+    max_frame_len = getattr(settings, 'MAX_FRAME_LEN', None)
     _clients_connected = 0
     _is_shuting_down = False
 
@@ -61,6 +64,9 @@ class BuildServerProtocol(BaseToxicProtocol):
                 build_info = await self.build()
 
                 await self.send_response(code=0, body=build_info)
+
+            elif self.action == 'step_output':
+                await self.step_output()
             else:
                 msg = 'Action {} does not exist'.format(self.action)
                 self.log(msg, level='error')
@@ -133,6 +139,31 @@ class BuildServerProtocol(BaseToxicProtocol):
                 build_info = await builder.build()
             return build_info
 
+    async def step_output(self):
+        """ Sends part of the full output of a step which output was
+        truncated. The body of the response has the ``output``, the
+        ``offset`` for the next request and the ``size`` of the output.
+        Offsets and size are in bytes.
+        """
+        try:
+            step_uuid = self.data['body']['step_uuid']
+        except KeyError:
+            raise BadData('No step_uuid for step_output.')
+
+        offset = int(self.data['body'].get('offset', 0))
+        length = int(self.data['body'].get('length', READ_LEN))
+        path = get_step_output_path(step_uuid)
+        try:
+            output, offset, size = read_output_file(path, offset, length)
+        except FileNotFoundError:
+            msg = 'No output for step {}'.format(step_uuid)
+            await self.send_response(code=1, body={'error': msg})
+            return
+
+        await self.send_response(code=0, body={'output': output,
+                                               'offset': offset,
+                                               'size': size})
+
     async def get_buildmanager(self):
         """ Returns the builder manager for this request
         """
@@ -149,11 +180,13 @@ class BuildServerProtocol(BaseToxicProtocol):
         config_filename = self.data['body'].get(
             'config_filename') or 'toxicbuild.yml'
         builders_from = self.data['body'].get('builders_from')
+        clone_options = self.data['body'].get('clone_options')
 
         manager = BuildManager(self, repo_id, repo_url, vcs_type, branch,
                                named_tree, config_type=config_type,
                                config_filename=config_filename,
-                               builders_from=builders_from)
+                               builders_from=builders_from,
+                               clone_options=clone_options)
 
         return manager
 
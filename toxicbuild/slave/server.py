@@ -38,7 +38,8 @@ class BuildServer(ToxicServer):
 
 
 def run_server(addr='0.0.0.0', port=7777, loop=None, use_ssl=False,
-               **ssl_kw):  # pragma no cover
+               metrics_port=None, **ssl_kw):  # pragma no cover
     log('Serving at {}'.format(port))
-    with BuildServer(addr, port, loop, use_ssl, **ssl_kw) as server:
+    with BuildServer(addr, port, loop, use_ssl, metrics_port=metrics_port,
+                     **ssl_kw) as server:
         server.start()
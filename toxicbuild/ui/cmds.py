@@ -24,7 +24,8 @@ import shutil
 import sys
 
 from toxicbuild.core.cmd import command, main
-from toxicbuild.core.utils import bcrypt, changedir, SettingsPatcher
+from toxicbuild.core.utils import (bcrypt, changedir, SettingsPatcher,
+                                   set_event_loop_policy)
 
 from . import create_settings
 
@@ -84,6 +85,7 @@ def start(workdir, daemonize=False, stdout=LOGFILE, stderr=LOGFILE,
         from . import settings
 
         SettingsPatcher().patch_pyro_settings(settings)
+        set_event_loop_policy(settings)
 
         from pyrocumulus.commands.base import get_command
 
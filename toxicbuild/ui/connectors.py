@@ -78,6 +78,9 @@ class StreamConnector(LoggerMixin):
             return
 
         client_settings = get_client_settings()
+        # the stream sends many responses, it can't use a pooled
+        # connection.
+        client_settings['use_pool'] = False
 
         client = await get_hole_client(self.user, **client_settings)
 